@@ -0,0 +1,130 @@
+"""Admission control and request deadlines for the prediction routes.
+
+Each model gets an ``AdmissionLimiter``: at most ``max_concurrency``
+requests are handled at once and at most ``max_queue`` more wait, first come
+first served, for a slot. A request arriving to a full queue is shed
+straight away (``Overloaded``), so under a spike a few clients get a fast
+503 instead of every client getting a slow answer.
+
+A request may carry a deadline (``X-Request-Timeout-Ms``, or a configured
+default). It is kept in a context variable for the rest of the request, like
+the stage timer: a request still queued at its deadline gives up, and work
+whose deadline has passed is dropped before the model runs
+(``check_deadline``, and the micro-batcher when it forms a batch).
+"""
+import asyncio, time
+from collections import deque
+from contextvars import ContextVar
+
+# timeout: gave up waiting in the queue; expired: admitted, but dropped before predict at its deadline
+OUTCOMES = ("admitted", "queued", "shed", "timeout", "expired")
+
+class Overloaded(Exception):
+    """The limiter's wait queue is full; the client should retry after ``retry_after`` seconds."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before its prediction was computed."""
+
+_deadline = ContextVar("request_deadline", default=None)
+
+def request_deadline(header, default_ms=0, clock=time.monotonic):
+    """Deadline (on ``clock``) from a timeout in milliseconds, the header's if valid else ``default_ms``; None for no deadline."""
+    try:
+        timeout_ms = float(header) if header is not None else default_ms
+    except ValueError:
+        timeout_ms = default_ms
+    if not timeout_ms or timeout_ms != timeout_ms or timeout_ms < 0:
+        return None
+    return clock() + timeout_ms / 1000.0
+
+def set_deadline(deadline):
+    """Make ``deadline`` the current request's; returns the token for ``reset_deadline``."""
+    return _deadline.set(deadline)
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+def current_deadline():
+    return _deadline.get()
+
+def check_deadline(clock=time.monotonic):
+    """Raise DeadlineExceeded if the current request's deadline has passed."""
+    deadline = _deadline.get()
+    if deadline is not None and clock() > deadline:
+        raise DeadlineExceeded("Request deadline passed before the prediction was computed")
+
+class AdmissionLimiter:
+    """Bounded concurrency with a bounded FIFO wait queue for one model.
+
+    ``counter`` (a metrics.Counter labelled (model, outcome)) counts the
+    requests of each of OUTCOMES. ``max_concurrency=0`` admits everything.
+    """
+
+    def __init__(self, name, max_concurrency=64, max_queue=256, retry_after=1, counter=None, clock=time.monotonic):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.counter = counter
+        self.clock = clock
+        self.active = 0
+        self._waiters = deque()
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+
+    def record(self, outcome):
+        self.counts[outcome] += 1
+        if self.counter is not None:
+            self.counter.inc((self.name, outcome))
+
+    async def acquire(self, deadline=None):
+        """Take a slot, waiting in the queue until ``deadline`` at the latest.
+
+        Raises Overloaded when the queue is full and DeadlineExceeded when the
+        deadline passes first.
+        """
+        if self.max_concurrency <= 0 or (self.active < self.max_concurrency and not self._waiters):
+            self.active += 1
+            self.record("admitted")
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.record("shed")
+            raise Overloaded(f"Model {self.name} is overloaded, retry later", self.retry_after)
+        timeout = None if deadline is None else deadline - self.clock()
+        if timeout is not None and timeout <= 0:
+            self.record("timeout")
+            raise DeadlineExceeded("Request deadline passed while waiting for admission")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.record("queued")
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended; pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.record("timeout")
+                raise DeadlineExceeded("Request deadline passed while waiting for admission")
+            raise
+        self.record("admitted")
+
+    def release(self):
+        """Give the slot back, handing it straight to the longest-waiting request if there is one."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {"max_concurrency": self.max_concurrency, "max_queue": self.max_queue,
+                "active": self.active, "waiting": len(self._waiters), **self.counts}
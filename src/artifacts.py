@@ -0,0 +1,132 @@
+import numpy as np
+import hashlib, json, os, shutil, time
+
+FORMAT_VERSION = 1
+ARTIFACTS_DIR = os.path.join(os.path.dirname(__file__), "..", "model", "artifacts")
+MANIFEST = "manifest.json"
+LATEST = "LATEST"
+
+class ArtifactError(Exception):
+    """Raised when an artifact is unreadable, corrupt or in an unknown format."""
+
+class Artifact:
+    """One loaded artifact version: its manifest metadata plus memory-mapped arrays."""
+
+    def __init__(self, name, version, path, meta, arrays):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.meta = meta
+        self.arrays = arrays
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _version_dir(version):
+    return f"v{version:04d}"
+
+def list_versions(name, root=ARTIFACTS_DIR):
+    """All complete versions of artifact ``name``, oldest first."""
+    directory = os.path.join(root, name)
+    if not os.path.isdir(directory):
+        return []
+    versions = []
+    for entry in os.listdir(directory):
+        if entry.startswith("v") and entry[1:].isdigit() and os.path.exists(os.path.join(directory, entry, MANIFEST)):
+            versions.append(int(entry[1:]))
+    return sorted(versions)
+
+def latest_version(name, root=ARTIFACTS_DIR):
+    """Version named by the LATEST pointer, or None if nothing has been written."""
+    try:
+        with open(os.path.join(root, name, LATEST), "r") as f:
+            return int(f.read().strip())
+    except FileNotFoundError:
+        return None
+
+def write_artifact(name, arrays, meta, root=ARTIFACTS_DIR):
+    """Write ``arrays`` as raw C-order files plus a checksummed manifest.
+
+    The version is staged in a temporary directory and renamed into place, then
+    LATEST is swapped to point at it, so readers never observe a partial write.
+    Returns the new version number.
+    """
+    directory = os.path.join(root, name)
+    os.makedirs(directory, exist_ok=True)
+    version = max(list_versions(name, root), default=0) + 1
+    staging = os.path.join(directory, f".{_version_dir(version)}.tmp-{os.getpid()}")
+    os.makedirs(staging)
+    try:
+        entries = {}
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            filename = f"{key}.bin"
+            array.tofile(os.path.join(staging, filename))
+            entries[key] = {
+                "file": filename,
+                "dtype": np.lib.format.dtype_to_descr(array.dtype),
+                "shape": list(array.shape),
+                "sha256": _sha256(os.path.join(staging, filename)),
+            }
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "name": name,
+            "version": version,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "meta": meta,
+            "arrays": entries,
+        }
+        with open(os.path.join(staging, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(staging, os.path.join(directory, _version_dir(version)))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    pointer = os.path.join(directory, f".{LATEST}.tmp-{os.getpid()}")
+    with open(pointer, "w") as f:
+        f.write(f"{version}\n")
+    os.replace(pointer, os.path.join(directory, LATEST))
+    return version
+
+def read_artifact(name, version=None, root=ARTIFACTS_DIR, verify=False):
+    """Open an artifact version (LATEST by default) with its arrays memory-mapped.
+
+    Arrays are mapped read-only, so every process serving the same version
+    shares one copy through the OS page cache and nothing is read until it is
+    touched. ``verify`` checks each file against its manifest checksum, which
+    reads every file in full, so it is off by default. Raises FileNotFoundError if the artifact does not exist.
+    """
+    if version is None:
+        version = latest_version(name, root)
+        if version is None:
+            raise FileNotFoundError(f"No artifact '{name}' in {root}")
+    path = os.path.join(root, name, _version_dir(version))
+    with open(os.path.join(path, MANIFEST), "r") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ArtifactError(f"Artifact {name} v{version} has unsupported format {manifest.get('format_version')}")
+
+    arrays = {}
+    for key, entry in manifest["arrays"].items():
+        filename = os.path.join(path, entry["file"])
+        dtype = np.lib.format.descr_to_dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        expected_size = dtype.itemsize * int(np.prod(shape))
+        if os.path.getsize(filename) != expected_size:
+            raise ArtifactError(f"Artifact {name} v{version}: {entry['file']} is truncated")
+        if verify and _sha256(filename) != entry["sha256"]:
+            raise ArtifactError(f"Artifact {name} v{version}: checksum mismatch for {entry['file']}")
+        if expected_size == 0:
+            # np.memmap cannot map empty files
+            arrays[key] = np.empty(shape, dtype=dtype)
+        else:
+            arrays[key] = np.memmap(filename, dtype=dtype, mode="r", shape=shape)
+    return Artifact(name, version, path, manifest["meta"], arrays)
@@ -0,0 +1,149 @@
+import asyncio, time
+from collections import deque
+
+import numpy as np
+
+from admission import DeadlineExceeded
+
+class MicroBatcher:
+    """Coalesces concurrent single-row predictions into one vectorized call.
+
+    ``submit`` queues a (1, n_features) row and awaits its prediction. A
+    background task takes everything queued once either ``max_batch_size``
+    rows are waiting or ``max_wait_ms`` has passed since the first one
+    arrived, runs ``predict`` on the stacked rows in an executor thread and
+    resolves each request's future with its own row. Up to
+    ``max_concurrency`` batches run at once, so the next batch can form while
+    the previous one is being scored. ``max_batch_size=1`` disables batching.
+    Rows whose deadline has passed by the time their batch forms are failed
+    with DeadlineExceeded instead of being scored.
+    """
+
+    def __init__(self, predict, max_batch_size=32, max_wait_ms=2.0, max_concurrency=2, executor=None):
+        self.predict = predict
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self._queue = deque()
+        self._loop = None
+        self._task = None
+        self._executing = 0
+        self.batches = 0
+        self.rows = 0
+        self.max_queue_depth = 0
+        self.expired = 0
+        self.batch_size_buckets = [2 ** i for i in range(int(np.log2(self.max_batch_size)) + 1)]
+        if self.batch_size_buckets[-1] < self.max_batch_size:
+            self.batch_size_buckets.append(self.max_batch_size)
+        self.batch_size_counts = [0] * len(self.batch_size_buckets)
+
+    def _start(self, loop):
+        # The asyncio primitives belong to one event loop, so (re)create them for the running one
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._task = loop.create_task(self._run())
+
+    async def submit(self, row, deadline=None):
+        """Prediction for one (1, n_features) row, unless ``deadline`` (time.monotonic) passes first.
+
+        The row must not be reused by the caller.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._start(loop)
+        future = loop.create_future()
+        self._queue.append((row, future, deadline))
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+        self._wakeup.set()
+        return await future
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def drain(self, poll=0.005):
+        """Stop once every queued row has been scored, e.g. after its model version was replaced."""
+        while self._queue or self._executing:
+            await asyncio.sleep(poll)
+        await self.stop()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if len(self._queue) < self.max_batch_size and self.max_wait > 0:
+                deadline = self._loop.time() + self.max_wait
+                while len(self._queue) < self.max_batch_size:
+                    remaining = deadline - self._loop.time()
+                    if remaining <= 0:
+                        break
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+            batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.max_batch_size))]
+            if not self._queue:
+                self._wakeup.clear()
+            batch = self._unexpired(batch)
+            if batch:
+                await self._slots.acquire()
+                self._executing += 1
+                self._loop.create_task(self._execute(batch))
+
+    def _unexpired(self, batch):
+        """The rows of ``batch`` still worth scoring; the others fail with DeadlineExceeded."""
+        now = time.monotonic()
+        live = []
+        for item in batch:
+            _, future, deadline = item
+            if deadline is not None and now > deadline:
+                self.expired += 1
+                if not future.done():
+                    future.set_exception(DeadlineExceeded("Request deadline passed before the prediction was computed"))
+            elif not future.cancelled():
+                live.append(item)
+        return live
+
+    async def _execute(self, batch):
+        try:
+            rows = np.concatenate([row for row, _, _ in batch])
+            predictions = await self._loop.run_in_executor(self.executor, self.predict, rows)
+            for (_, future, _), prediction in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(float(prediction))
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._executing -= 1
+            self._slots.release()
+            self._record(len(batch))
+
+    def _record(self, size):
+        self.batches += 1
+        self.rows += size
+        for i, bucket in enumerate(self.batch_size_buckets):
+            if size <= bucket:
+                self.batch_size_counts[i] += 1
+                break
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": len(self._queue),
+            "max_queue_depth": self.max_queue_depth,
+            "expired": self.expired,
+            "batches": self.batches,
+            "rows": self.rows,
+            "mean_batch_size": self.rows / self.batches if self.batches else 0.0,
+            "batch_size_histogram": {f"le_{bucket}": count for bucket, count in zip(self.batch_size_buckets, self.batch_size_counts)},
+        }
@@ -0,0 +1,269 @@
+"""Serving benchmarks with regression gates.
+
+Starts the API locally, replays rows from data/future_unseen_examples.csv
+against every prediction endpoint at fixed concurrency levels and records
+p50/p95/p99 latency and requests/sec. Micro-benchmarks time the demographics
+join, feature assembly and each model's ``predict`` in process. Results are
+written as JSON; with ``--baseline`` the run exits non-zero when any latency
+grew, or any throughput dropped, by more than ``--max-regression``.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --output new.json --baseline bench.json --max-regression 0.2
+
+The prediction cache is disabled in the benchmarked server (replayed rows
+would otherwise all be cache hits) unless ``--cache`` is given.
+"""
+import argparse, json, os, platform, socket, subprocess, sys, threading, time
+
+import numpy as np
+import pandas as pd
+import requests
+
+from inference import DEFAULT_SALE_MONTH, DEFAULT_SALE_YEAR
+from score_bulk import load_models
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES_PATH = os.path.join(SRC_DIR, "data", "future_unseen_examples.csv")
+BASIC_FIELDS = ['bedrooms', 'bathrooms', 'sqft_living', 'sqft_lot', 'floors', 'sqft_above', 'sqft_basement', 'zipcode']
+CONCURRENCY_LEVELS = (1, 8, 32)
+BATCH_SIZE = 32
+
+# Which way each recorded number should move; anything else in the results is informational
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "median_us")
+HIGHER_IS_BETTER = ("rps",)
+
+def load_payloads(path=EXAMPLES_PATH):
+    """API payloads for each row of ``path`` (to_dict yields plain Python ints and floats)."""
+    return pd.read_csv(path, dtype={'zipcode': str}).to_dict(orient="records")
+
+def endpoint_requests(payloads, batch_size=BATCH_SIZE):
+    """(path, list of JSON bodies) to replay for each endpoint."""
+    basic = [{key: payload[key] for key in BASIC_FIELDS} for payload in payloads]
+    batches = [payloads[i:i + batch_size] for i in range(0, len(payloads), batch_size)]
+    return {
+        "predict": ("/predict", payloads),
+        "predict_basic": ("/predict_basic", basic),
+        "predict_improved": ("/predict_improved", payloads),
+        "predict_batch_basic": ("/predict_batch?model=basic", batches),
+        "predict_batch_improved": ("/predict_batch?model=improved", batches),
+    }
+
+def summarize(latencies, elapsed):
+    """Latency percentiles (ms) and throughput for one load level."""
+    latencies = np.asarray(latencies) * 1000.0
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"requests": len(latencies), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+            "rps": len(latencies) / elapsed}
+
+def run_load(base_url, path, bodies, concurrency, n_requests):
+    """Send ``n_requests`` POSTs from ``concurrency`` client threads and summarize their latencies."""
+    latencies = []
+    failures = []
+    counter = iter(range(n_requests))
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            response = session.post(base_url + path, json=bodies[i % len(bodies)])
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+                if response.status_code != 200:
+                    failures.append(response.status_code)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = summarize(latencies, time.perf_counter() - start)
+    result["errors"] = len(failures)
+    return result
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(port, workers=1, cache=False, timeout=120):
+    """Start the API from src/ and wait until /ready reports every worker warm."""
+    env = dict(os.environ)
+    if not cache:
+        env["PREDICTION_CACHE_SIZE"] = "0"
+    if workers > 1:
+        command = [sys.executable, "prefork.py", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+    server = subprocess.Popen(command, cwd=SRC_DIR, env=env)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with status {server.returncode} during startup")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/ready", timeout=1).status_code == 200:
+                return server
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not become ready in time")
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+def http_benchmarks(payloads, levels=CONCURRENCY_LEVELS, n_requests=500, workers=1, cache=False):
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_server(port, workers, cache)
+    try:
+        results = {}
+        for name, (path, bodies) in endpoint_requests(payloads).items():
+            # Untimed pass so connection setup and first-call costs are not measured
+            run_load(base_url, path, bodies, max(levels), max(levels))
+            results[name] = {f"c{level}": run_load(base_url, path, bodies, level, n_requests) for level in levels}
+        return results
+    finally:
+        stop_server(server)
+
+def time_call(function, repeat=7, min_time=0.05):
+    """Median seconds per call of ``function()`` over ``repeat`` timed loops, like timeit."""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        if time.perf_counter() - start >= min_time / 10:
+            break
+        loops *= 10
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        times.append((time.perf_counter() - start) / loops)
+    return float(np.median(times))
+
+def micro_benchmarks(payloads, batch_rows=1000):
+    """Per-call time of the demographics join, feature assembly and each model's predict."""
+    rows = [dict(payload, sale_year=DEFAULT_SALE_YEAR, sale_month=DEFAULT_SALE_MONTH) for payload in payloads]
+    batch = [rows[i % len(rows)] for i in range(batch_rows)]
+    results = {}
+    for name, (predictor, assembler) in load_models(("basic", "improved")).items():
+        index = assembler.index
+        payload = rows[0]
+        offset = index.offset(payload['zipcode'])
+        row = assembler.assemble(payload, offset).copy()
+        offsets = index.offsets_for([payload['zipcode'] for payload in batch])
+        X = assembler.assemble_batch(batch, offsets)
+        timings = {
+            "demographics_join": time_call(lambda: index.offset(payload['zipcode'])),
+            "assemble_row": time_call(lambda: assembler.assemble(payload, offset)),
+            "predict_row": time_call(lambda: predictor.predict(row)),
+            f"predict_batch_{batch_rows}": time_call(lambda: predictor.predict(X)),
+        }
+        for key, seconds in timings.items():
+            results[f"{name}.{key}"] = {"median_us": seconds * 1e6}
+    return results
+
+def failed_requests(results):
+    """Descriptions of every HTTP endpoint and concurrency level that had non-200 responses."""
+    return [f"http.{name}.{level}: {stats['errors']} of the requests failed"
+            for name, levels in results.get("http", {}).items()
+            for level, stats in levels.items() if stats.get("errors")]
+
+def compare(results, baseline, max_regression=0.2):
+    """Descriptions of every metric in ``results`` that regressed past ``max_regression`` vs ``baseline``.
+
+    Any increase in failed requests is a regression, however fast the failures were.
+    """
+    regressions = []
+
+    def walk(current, previous, path):
+        for key, value in current.items():
+            if key not in previous:
+                continue
+            if isinstance(value, dict):
+                walk(value, previous[key], path + [key])
+            elif key == "errors" and value > previous[key]:
+                regressions.append(f"{'.'.join(path + [key])}: {previous[key]} -> {value}")
+            elif key in LOWER_IS_BETTER and previous[key] > 0 and value > previous[key] * (1 + max_regression):
+                regressions.append(f"{'.'.join(path + [key])}: {previous[key]:.4g} -> {value:.4g} (+{value / previous[key] - 1:.0%})")
+            elif key in HIGHER_IS_BETTER and previous[key] > 0 and value < previous[key] * (1 - max_regression):
+                regressions.append(f"{'.'.join(path + [key])}: {previous[key]:.4g} -> {value:.4g} ({value / previous[key] - 1:.0%})")
+
+    for section in ("http", "micro"):
+        walk(results.get(section, {}), baseline.get(section, {}), [section])
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the prediction API and compare against a baseline.")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the results JSON")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to gate against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed relative slowdown before the run fails (default: 0.2 = 20%%)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=list(CONCURRENCY_LEVELS))
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint and concurrency level")
+    parser.add_argument("--workers", type=int, default=1, help="server workers; more than 1 serves with prefork.py")
+    parser.add_argument("--cache", action="store_true", help="keep the prediction cache enabled")
+    parser.add_argument("--skip-http", action="store_true", help="only run the in-process micro-benchmarks")
+    args = parser.parse_args()
+
+    payloads = load_payloads()
+    results = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "workers": args.workers,
+            "cache": args.cache,
+        },
+        "micro": micro_benchmarks(payloads),
+    }
+    if not args.skip_http:
+        results["http"] = http_benchmarks(payloads, args.concurrency, args.requests, args.workers, args.cache)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for name, timing in results["micro"].items():
+        print(f"{name:40s} {timing['median_us']:10.1f} us")
+    for name, levels in results.get("http", {}).items():
+        for level, stats in levels.items():
+            print(f"{name:24s} {level:>4s}  p50 {stats['p50_ms']:7.2f} ms  p95 {stats['p95_ms']:7.2f} ms  "
+                  f"p99 {stats['p99_ms']:7.2f} ms  {stats['rps']:8.1f} req/s  errors {stats['errors']}")
+
+    # Fast 4xx/5xx answers (or shed load) would otherwise pass for good latency
+    failures = failed_requests(results)
+    if failures:
+        print(f"\n{len(failures)} endpoint level(s) with failed requests:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.max_regression:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.max_regression:.0%} against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -2,34 +2,41 @@ import pandas as pd
 from sklearn.ensemble import GradientBoostingRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import r2_score, mean_absolute_error
-import pickle, json, pathlib, os
+import argparse, pickle, json, pathlib, os
+
+from artifacts import write_artifact
+from datasets import CHUNK_SIZE, SALES_PATH, load_demographics, load_training_table, training_chunks
+from drift import build_profile
+from geo_features import GeoIndex, add_geo_features
+from model_search import SEARCH_SPACE, load_search_space, run_search
+from out_of_core import RowSample, StreamingMetrics, chunk_model, fit_chunks, holdout_mask
+from tree_ensemble import export_compiled_model
 
-SALES_PATH = os.path.join(os.path.dirname(__file__), "data", "kc_house_data.csv")
-DEMOGRAPHICS_PATH = os.path.join(os.path.dirname(__file__), "data", "zipcode_demographics.csv")
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "..", "model")
 
-def load_data():
-    sales_data = pd.read_csv(SALES_PATH, dtype={'zipcode': str})
-    demographics = pd.read_csv(DEMOGRAPHICS_PATH, dtype={'zipcode': str})
-    return sales_data, demographics
-
-def feature_engineer(data):
-    data['date'] = pd.to_datetime(data['date'])
-    data['sale_year'] = data['date'].dt.year
-    data['sale_month'] = data['date'].dt.month
-    return data.drop(columns=['date', 'id'])
-
-def prepare_data(sales_data, demographics):
-    sales_data = feature_engineer(sales_data)
-    merged = pd.merge(sales_data, demographics, on='zipcode', how='left')
-    y = merged.pop('price')
-    X = merged.drop(columns=['zipcode']).apply(pd.to_numeric, errors='coerce').fillna(0)
+def prepare_training_table(table):
+    """X, y for the improved model from the training table, which already has the date features and demographics."""
+    y = table.pop('price')
+    X = table.drop(columns=['id', 'date', 'zipcode']).apply(pd.to_numeric, errors='coerce').fillna(0)
     return X, y
 
-def train_model(X, y):
+def split_data(X, y, ids, geo=True):
+    """Train/test split; with ``geo`` the neighborhood index is built from the training sales only.
+
+    Training rows get leave-one-house-out neighborhood features, test rows
+    are scored against the training sales the way serving will score them.
+    """
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    model = GradientBoostingRegressor(n_estimators=100, learning_rate=0.1, max_depth=5, random_state=42).fit(X_train, y_train)
-    return model, X_train, X_test, y_train, y_test
+    geo_index = None
+    if geo:
+        train_ids = ids[X_train.index]
+        geo_index = GeoIndex.from_sales(X_train['lat'], X_train['long'], y_train, X_train['sqft_living'], train_ids)
+        X_train = add_geo_features(X_train, geo_index, exclude_ids=train_ids)
+        X_test = add_geo_features(X_test, geo_index)
+    return X_train, X_test, y_train, y_test, geo_index
+
+def train_model(X_train, y_train):
+    return GradientBoostingRegressor(n_estimators=100, learning_rate=0.1, max_depth=5, random_state=42).fit(X_train, y_train)
 
 def evaluate_model(model, X_test, y_test):
     y_pred = model.predict(X_test)
@@ -38,17 +45,109 @@ def evaluate_model(model, X_test, y_test):
     print(f"--- Improved Model ---\nR2: {r2:.4f}\nMAE: ${mae:,.2f}")
     return r2, mae
 
-def save_artifacts(model, features):
+def save_artifacts(model, features, geo_index=None):
+    """Pickle and compiled artifact of ``model``, fit on the columns ``features``."""
     pathlib.Path(OUTPUT_DIR).mkdir(exist_ok=True)
     pickle.dump(model, open(f"{OUTPUT_DIR}/model_improved.pkl", 'wb'))
-    json.dump(list(features.columns), open(f"{OUTPUT_DIR}/model_features_improved.json", 'w'))
+    json.dump(list(features), open(f"{OUTPUT_DIR}/model_features_improved.json", 'w'))
+    root = os.path.join(OUTPUT_DIR, "artifacts")
+    # The model artifact records which geo index version its neighborhood features came from
+    geo_version = write_artifact("geo", *geo_index.to_artifact(), root) if geo_index is not None else None
+    export_compiled_model(model, features, root, geo_version=geo_version)
+
+def save_profile(table, demographics):
+    """Write the reference profile of the raw sales features that the API's drift monitor compares traffic with."""
+    known = table['zipcode'].isin(demographics['zipcode']).to_numpy()
+    return write_artifact("profile", *build_profile(table, known), os.path.join(OUTPUT_DIR, "artifacts"))
+
+def chunk_features(chunk, geo_index, columns=None, exclude_own=True):
+    """X, y of one training table chunk in the column order ``columns`` (default: the chunk's own)."""
+    ids = chunk['id'].to_numpy()
+    X, y = prepare_training_table(chunk)
+    if geo_index is not None:
+        X = add_geo_features(X, geo_index, exclude_ids=ids if exclude_own else None)
+    return (X if columns is None else X.reindex(columns=columns, fill_value=0)), y
+
+def train_chunked(path=SALES_PATH, chunk_rows=CHUNK_SIZE, sample_rows=1_000_000, trees_per_chunk=50, geo=True):
+    """Train on a sales CSV of any size with memory bounded by one chunk plus a ``sample_rows`` sample.
+
+    Three passes over the file: a uniform sample of the sales gives the drift
+    profile and the neighborhood index, a histogram GBM is then fit chunk by
+    chunk with warm start, and finally the held-out rows (out_of_core.holdout_mask)
+    are scored. Returns (model, feature columns, geo index).
+    """
+    sample = RowSample(sample_rows)
+    for chunk in training_chunks(path, chunk_rows):
+        sample.add(chunk)
+    table = sample.frame
+    save_profile(table, load_demographics())
+    geo_index = None
+    if geo:
+        train = table[~holdout_mask(table['id'].to_numpy())]
+        geo_index = GeoIndex.from_sales(train['lat'], train['long'], train['price'], train['sqft_living'], train['id'])
+    print(f"Sampled {len(table):,} of {sample.rows:,} sales")
+
+    columns = []
+    def train_chunks():
+        for chunk in training_chunks(path, chunk_rows):
+            chunk = chunk[~holdout_mask(chunk['id'].to_numpy())]
+            X, y = chunk_features(chunk, geo_index, columns or None)
+            if not columns:
+                columns.extend(X.columns)
+            yield X, y
+    model, rows = fit_chunks(chunk_model(trees_per_chunk), train_chunks(), trees_per_chunk)
+    print(f"Trained {model.n_iter_} trees on {rows:,} sales")
+
+    metrics = StreamingMetrics()
+    for chunk in training_chunks(path, chunk_rows):
+        chunk = chunk[holdout_mask(chunk['id'].to_numpy())]
+        if len(chunk):
+            # Held-out houses are scored against the training sales, as in serving
+            X, y = chunk_features(chunk, geo_index, columns, exclude_own=False)
+            metrics.update(y, model.predict(X))
+    print(f"--- Improved Model (chunked) ---\nR2: {metrics.r2:.4f}\nMAE: ${metrics.mae:,.2f} on {metrics.n:,} held-out sales")
+    return model, pd.Index(columns), geo_index
+
+def search_model(X_train, y_train, X_test, y_test, families, space=SEARCH_SPACE, n_jobs=-1):
+    """Pick the model by parallel search instead of the fixed settings of train_model."""
+    pathlib.Path(OUTPUT_DIR).mkdir(exist_ok=True)
+    return run_search(families, X_train, y_train, X_test, y_test,
+                      os.path.join(OUTPUT_DIR, "search_report_improved.json"), space, n_jobs)
 
 def main():
-    sales_data, demographics = load_data()
-    X, y = prepare_data(sales_data, demographics)
-    model, X_train, X_test, y_train, y_test = train_model(X, y)
+    parser = argparse.ArgumentParser(description="Train the improved model.")
+    parser.add_argument("--search", action="store_true", help="search model families and hyperparameters in parallel")
+    parser.add_argument("--families", nargs="+", choices=("gbr", "hgb"), default=["gbr", "hgb"])
+    parser.add_argument("--search-space", help="JSON file overriding the default search space")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="parallel fits (default: all cores)")
+    parser.add_argument("--no-geo", action="store_true", help="leave out the neighborhood features from past sales")
+    parser.add_argument("--chunked", action="store_true",
+                        help="stream the sales CSV in chunks and fit a histogram GBM chunk by chunk, for data larger than memory")
+    parser.add_argument("--sales", default=SALES_PATH, help="sales CSV for --chunked (default: data/kc_house_data.csv)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_SIZE, help="sales per chunk with --chunked")
+    parser.add_argument("--sample-rows", type=int, default=1_000_000,
+                        help="sales sampled for the neighborhood index and drift profile with --chunked")
+    parser.add_argument("--trees-per-chunk", type=int, default=50, help="boosting iterations added per chunk with --chunked")
+    args = parser.parse_args()
+
+    if args.chunked:
+        model, features, geo_index = train_chunked(args.sales, args.chunk_rows, args.sample_rows,
+                                                   args.trees_per_chunk, geo=not args.no_geo)
+        save_artifacts(model, features, geo_index)
+        return
+
+    table = load_training_table()
+    save_profile(table, load_demographics())
+    ids = table['id'].to_numpy()
+    X, y = prepare_training_table(table)
+    X_train, X_test, y_train, y_test, geo_index = split_data(X, y, ids, geo=not args.no_geo)
+    if args.search:
+        space = load_search_space(args.search_space) if args.search_space else SEARCH_SPACE
+        model = search_model(X_train, y_train, X_test, y_test, args.families, space, args.n_jobs)
+    else:
+        model = train_model(X_train, y_train)
     evaluate_model(model, X_test, y_test)
-    save_artifacts(model, X_train)
+    save_artifacts(model, X_train.columns, geo_index)
 
 if __name__ == "__main__":
     main()
@@ -1,36 +1,66 @@
-import json, pathlib, pickle, os
-import pandas as pd
+import argparse, json, pathlib, pickle, os
 from sklearn.model_selection import train_test_split
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import RobustScaler
 
-SALES_PATH = os.path.join(os.path.dirname(__file__), "data", "kc_house_data.csv")
-DEMOGRAPHICS_PATH = os.path.join(os.path.dirname(__file__), "data", "zipcode_demographics.csv")
+from artifacts import write_artifact
+from datasets import load_demographics, load_training_table
+from model_search import SEARCH_SPACE, load_search_space, run_search
+from neighbors import NeighborIndex
+
 SALES_COLUMN_SELECTION = ['price', 'bedrooms', 'bathrooms', 'sqft_living', 'sqft_lot', 'floors', 'sqft_above', 'sqft_basement', 'zipcode']
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "..", "model")
 
 def load_data():
-    data = pd.read_csv(SALES_PATH, usecols=SALES_COLUMN_SELECTION, dtype={'zipcode': str})
-    demographics = pd.read_csv(DEMOGRAPHICS_PATH, dtype={'zipcode': str})
-    merged = data.merge(demographics, on="zipcode").drop(columns="zipcode")
+    table = load_training_table()
+    demographics = load_demographics()
+    # Only houses whose zipcode has demographics, like an inner join
+    table = table[table['zipcode'].isin(demographics['zipcode'])].reset_index(drop=True)
+    merged = table[SALES_COLUMN_SELECTION + list(demographics.columns.drop('zipcode'))].drop(columns="zipcode")
     y = merged.pop('price')
     return merged, y
 
 def train_model(x, y):
     x_train, _, y_train, _ = train_test_split(x, y, random_state=42)
     model = make_pipeline(RobustScaler(), KNeighborsRegressor()).fit(x_train, y_train)
-    return model, x_train
+    return model, x_train, y_train
 
-def save_artifacts(model, features):
+def search_model(x, y, space=SEARCH_SPACE, n_jobs=-1):
+    """Pick the number of neighbors by parallel search; same split as train_model."""
+    x_train, x_test, y_train, y_test = train_test_split(x, y, random_state=42)
+    pathlib.Path(OUTPUT_DIR).mkdir(exist_ok=True)
+    model = run_search(["knn"], x_train, y_train, x_test, y_test,
+                       os.path.join(OUTPUT_DIR, "search_report_basic.json"), space, n_jobs)
+    return model, x_train, y_train
+
+def build_neighbor_index(model, x_train, y_train):
+    # KD-tree over the scaled training rows, plus ~sqrt(n) k-means clusters for approximate search
+    n_clusters = int(len(x_train) ** 0.5)
+    return NeighborIndex.from_pipeline(model, x_train, y_train, algorithm='kd_tree', n_clusters=n_clusters)
+
+def save_artifacts(model, features, neighbor_index):
     pathlib.Path(OUTPUT_DIR).mkdir(exist_ok=True)
     pickle.dump(model, open(f"{OUTPUT_DIR}/model.pkl", 'wb'))
     json.dump(list(features.columns), open(f"{OUTPUT_DIR}/model_features.json", 'w'))
+    arrays, meta = neighbor_index.to_artifact()
+    meta['features'] = list(features.columns)
+    write_artifact("basic", arrays, meta, os.path.join(OUTPUT_DIR, "artifacts"))
 
 def main():
+    parser = argparse.ArgumentParser(description="Train the basic model.")
+    parser.add_argument("--search", action="store_true", help="search the number of neighbors in parallel")
+    parser.add_argument("--search-space", help="JSON file overriding the default search space")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="parallel fits (default: all cores)")
+    args = parser.parse_args()
+
     x, y = load_data()
-    model, x_train = train_model(x, y)
-    save_artifacts(model, x_train)
+    if args.search:
+        space = load_search_space(args.search_space) if args.search_space else SEARCH_SPACE
+        model, x_train, y_train = search_model(x, y, space, args.n_jobs)
+    else:
+        model, x_train, y_train = train_model(x, y)
+    save_artifacts(model, x_train, build_neighbor_index(model, x_train, y_train))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,128 @@
+"""K-fold cross-validated evaluation of several models at once.
+
+Each model is refitted from its (unfitted) configuration on k-1 folds and
+predicts the held-out fold, so every row is scored by a model that never saw
+it. All (model, fold) fits run in parallel worker processes. Fold predictions
+are cached on disk under a key derived from the model configuration, the
+exact training data and the fold layout; a re-run that only changes the
+reported metrics reads them back instead of refitting and re-predicting.
+"""
+import hashlib, json, os, pickle
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import KFold
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", "model", "cv_cache")
+
+def fingerprint(estimator, X, y, n_folds, seed):
+    """Cache key for the fold predictions of ``estimator`` on (X, y)."""
+    digest = hashlib.sha256()
+    digest.update(pickle.dumps(clone(estimator), protocol=4))
+    digest.update(json.dumps([list(map(str, X.columns)), n_folds, seed]).encode())
+    digest.update(np.ascontiguousarray(X.to_numpy(dtype=np.float64)).tobytes())
+    digest.update(np.ascontiguousarray(np.asarray(y, dtype=np.float64)).tobytes())
+    return digest.hexdigest()[:16]
+
+def folds(n_rows, n_folds=5, seed=42):
+    """(train, test) row positions of each fold."""
+    return list(KFold(n_splits=n_folds, shuffle=True, random_state=seed).split(np.arange(n_rows)))
+
+def _fold_path(cache_dir, key, fold):
+    return os.path.join(cache_dir, key, f"fold_{fold}.npy")
+
+def fit_predict_fold(estimator, X, y, train, test, path):
+    """Fit a fresh copy of ``estimator`` on ``train`` rows, predict ``test`` rows and cache the result."""
+    model = clone(estimator).fit(X.iloc[train], y.iloc[train])
+    predictions = np.asarray(model.predict(X.iloc[test]), dtype=np.float64)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.tmp-{os.getpid()}.npy"
+    np.save(temporary, predictions)
+    os.replace(temporary, path)
+    return predictions
+
+def cross_val_predictions(models, n_folds=5, seed=42, n_jobs=-1, cache_dir=CACHE_DIR):
+    """Out-of-fold predictions for each of ``models`` ({name: (estimator, X, y)}).
+
+    Returns ({name: predictions in row order}, {name: fold layout}, number of folds computed).
+    """
+    layouts, keys, tasks = {}, {}, []
+    for name, (estimator, X, y) in models.items():
+        layouts[name] = folds(len(X), n_folds, seed)
+        keys[name] = fingerprint(estimator, X, y, n_folds, seed)
+        for fold, (train, test) in enumerate(layouts[name]):
+            path = _fold_path(cache_dir, keys[name], fold)
+            if not os.path.exists(path):
+                tasks.append(delayed(fit_predict_fold)(estimator, X, y, train, test, path))
+    if tasks:
+        Parallel(n_jobs=n_jobs)(tasks)
+
+    predictions = {}
+    for name, (_, X, _) in models.items():
+        out = np.empty(len(X), dtype=np.float64)
+        for fold, (_, test) in enumerate(layouts[name]):
+            out[test] = np.load(_fold_path(cache_dir, keys[name], fold))
+        predictions[name] = out
+    return predictions, layouts, len(tasks)
+
+def bootstrap_ci(y_true, y_pred, n_boot=1000, confidence=0.95, seed=0, chunk_size=100):
+    """Percentile bootstrap confidence intervals of R2 and MAE, resampling rows."""
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    r2, mae = [], []
+    for start in range(0, n_boot, chunk_size):
+        # Chunked so the (resamples, rows) index matrix stays small
+        sample = rng.integers(0, len(y_true), size=(min(chunk_size, n_boot - start), len(y_true)))
+        truth, errors = y_true[sample], y_true[sample] - y_pred[sample]
+        mae.append(np.abs(errors).mean(axis=1))
+        total = ((truth - truth.mean(axis=1, keepdims=True)) ** 2).sum(axis=1)
+        r2.append(1 - (errors ** 2).sum(axis=1) / total)
+    tail = (1 - confidence) / 2 * 100
+    bounds = [tail, 100 - tail]
+    return {"r2": np.percentile(np.concatenate(r2), bounds).tolist(),
+            "mae": np.percentile(np.concatenate(mae), bounds).tolist()}
+
+def fold_scores(y_true, y_pred, layout):
+    """R2 and MAE of each held-out fold."""
+    y_true = np.asarray(y_true)
+    return [{"r2": float(r2_score(y_true[test], y_pred[test])), "mae": float(mean_absolute_error(y_true[test], y_pred[test]))}
+            for _, test in layout]
+
+def zipcode_breakdown(y_true, y_pred, zipcodes):
+    """Error statistics per zipcode, worst MAE first."""
+    errors = pd.DataFrame({"zipcode": np.asarray(zipcodes), "error": np.asarray(y_pred) - np.asarray(y_true),
+                           "price": np.asarray(y_true)})
+    errors["abs_error"] = errors["error"].abs()
+    errors["abs_pct_error"] = errors["abs_error"] / errors["price"]
+    grouped = errors.groupby("zipcode")
+    breakdown = pd.DataFrame({
+        "count": grouped.size(),
+        "mae": grouped["abs_error"].mean(),
+        "median_abs_error": grouped["abs_error"].median(),
+        "bias": grouped["error"].mean(),
+        "mape": grouped["abs_pct_error"].mean(),
+    })
+    return breakdown.sort_values("mae", ascending=False)
+
+def evaluate(models, zipcodes, n_folds=5, seed=42, n_boot=1000, n_jobs=-1, cache_dir=CACHE_DIR):
+    """Cross-validated report for ``models`` ({name: (estimator, X, y)}) scored on the same rows."""
+    predictions, layouts, computed = cross_val_predictions(models, n_folds, seed, n_jobs, cache_dir)
+    report = {"folds": n_folds, "seed": seed, "bootstrap": n_boot, "folds_computed": computed, "models": {}}
+    for name, (_, X, y) in models.items():
+        y_pred = predictions[name]
+        per_fold = fold_scores(y, y_pred, layouts[name])
+        report["models"][name] = {
+            "rows": len(X),
+            "r2": float(r2_score(y, y_pred)),
+            "mae": float(mean_absolute_error(y, y_pred)),
+            "ci": bootstrap_ci(y, y_pred, n_boot, seed=seed),
+            "fold_r2_std": float(np.std([fold["r2"] for fold in per_fold])),
+            "fold_mae_std": float(np.std([fold["mae"] for fold in per_fold])),
+            "per_fold": per_fold,
+            "zipcodes": zipcode_breakdown(y, y_pred, zipcodes).reset_index().to_dict(orient="records"),
+        }
+    return report
@@ -0,0 +1,198 @@
+"""Parsed, columnar copies of the training data, shared by the training, evaluation and test scripts.
+
+The first load of a table parses the CSVs in chunks and writes each column
+as a raw binary file under ``data/.cache/<table>/`` with a manifest. Later
+loads memory-map those files instead of parsing text. A cached table is
+rebuilt when the SHA-256 of any of its source files changes or when
+PREP_VERSION is bumped. A source whose size and modification time match the
+manifest is not rehashed, so an unchanged multi-GB file costs one ``stat``.
+
+String columns are stored dictionary-encoded (int32 codes plus the distinct
+values in the manifest), so every column is a fixed-width array.
+"""
+import hashlib, json, os, shutil
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+SALES_PATH = os.path.join(DATA_DIR, "kc_house_data.csv")
+DEMOGRAPHICS_PATH = os.path.join(DATA_DIR, "zipcode_demographics.csv")
+CACHE_DIR = os.path.join(DATA_DIR, ".cache")
+MANIFEST = "manifest.json"
+
+# Bump whenever the preparation below changes, so stale caches are rebuilt
+PREP_VERSION = 1
+# Sale dates look like 20141013T000000; an explicit format avoids per-row format inference
+DATE_FORMAT = "%Y%m%dT%H%M%S"
+CHUNK_SIZE = 500_000
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _source_state(path, previous=None):
+    """Size, mtime and content hash of ``path``, reusing ``previous``'s hash if the file looks untouched."""
+    stat = os.stat(path)
+    state = {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+        state["sha256"] = previous["sha256"]
+    else:
+        state["sha256"] = _sha256(path)
+    return state
+
+class _ColumnWriter:
+    """Appends DataFrame chunks column by column to raw files in ``directory``."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.columns = {}
+        self.files = {}
+        self.rows = 0
+
+    def append(self, chunk):
+        if not self.columns:
+            for i, name in enumerate(chunk.columns):
+                self.columns[name] = {"file": f"{i:03d}.bin"}
+                self.files[name] = open(os.path.join(self.directory, f"{i:03d}.bin"), "wb")
+        for name in chunk.columns:
+            self._write(name, chunk[name])
+        self.rows += len(chunk)
+
+    def _write(self, name, series):
+        column = self.columns[name]
+        if series.dtype.kind in "biufcmM":
+            values = series.to_numpy()
+            if "dtype" not in column:
+                column["dtype"] = np.lib.format.dtype_to_descr(values.dtype)
+            dtype = np.lib.format.descr_to_dtype(column["dtype"])
+            if values.dtype != dtype:
+                if not np.can_cast(values.dtype, dtype, "same_kind"):
+                    raise ValueError(f"Column {name!r} changed from {dtype} to {values.dtype} between chunks")
+                values = values.astype(dtype)
+        else:
+            # Dictionary-encode text; the vocabulary grows as new values show up in later chunks
+            categories = column.setdefault("categories", [])
+            column["dtype"] = np.lib.format.dtype_to_descr(np.dtype(np.int32))
+            positions = {value: i for i, value in enumerate(categories)}
+            local_codes, uniques = pd.factorize(series)
+            for value in uniques.tolist():
+                if value not in positions:
+                    positions[value] = len(categories)
+                    categories.append(value)
+            # Map this chunk's codes to the table-wide ones; factorize marks missing values -1
+            mapping = np.array([positions[value] for value in uniques.tolist()] + [-1], dtype=np.int32)
+            values = mapping[local_codes]
+        np.ascontiguousarray(values).tofile(self.files[name])
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+def _read_columns(directory, manifest):
+    columns = {}
+    for name, column in manifest["columns"].items():
+        dtype = np.lib.format.descr_to_dtype(column["dtype"])
+        path = os.path.join(directory, column["file"])
+        if manifest["rows"] == 0:
+            values = np.empty(0, dtype=dtype)
+        else:
+            values = np.memmap(path, dtype=dtype, mode="r", shape=(manifest["rows"],))
+        if "categories" in column:
+            # Code -1 (missing) picks the trailing None
+            values = np.array(column["categories"] + [None], dtype=object)[values]
+        columns[name] = values
+    return pd.DataFrame(columns)
+
+def cached_table(name, sources, build_chunks, cache_dir=CACHE_DIR):
+    """Table ``name`` from the cache, or built from ``build_chunks()`` and cached.
+
+    ``build_chunks`` yields DataFrame chunks in row order; ``sources`` are the
+    files the table is derived from.
+    """
+    directory = os.path.join(cache_dir, name)
+    manifest_path = os.path.join(directory, MANIFEST)
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        manifest = None
+
+    if manifest is not None and manifest.get("prep_version") == PREP_VERSION and len(manifest["sources"]) == len(sources):
+        states = [_source_state(path, previous) for path, previous in zip(sources, manifest["sources"])]
+        if [state["sha256"] for state in states] == [source["sha256"] for source in manifest["sources"]]:
+            if states != manifest["sources"]:
+                # Same content, new mtime: remember the new stat so the next load skips hashing
+                manifest["sources"] = states
+                _write_manifest(directory, manifest)
+            return _read_columns(directory, manifest)
+    else:
+        states = [_source_state(path) for path in sources]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    staging = os.path.join(cache_dir, f".{name}.tmp-{os.getpid()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    writer = _ColumnWriter(staging)
+    try:
+        for chunk in build_chunks():
+            writer.append(chunk)
+    except BaseException:
+        writer.close()
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    writer.close()
+    manifest = {"name": name, "prep_version": PREP_VERSION, "sources": states, "rows": writer.rows, "columns": writer.columns}
+    _write_manifest(staging, manifest)
+    # Swap the new table in; a concurrent reader at worst sees a missing table and rebuilds it
+    retired = os.path.join(cache_dir, f".{name}.old-{os.getpid()}")
+    if os.path.exists(directory):
+        os.rename(directory, retired)
+    os.rename(staging, directory)
+    shutil.rmtree(retired, ignore_errors=True)
+    return _read_columns(directory, manifest)
+
+def _write_manifest(directory, manifest):
+    temporary = os.path.join(directory, f".{MANIFEST}.tmp-{os.getpid()}")
+    with open(temporary, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+
+def _sales_chunks(path=SALES_PATH, chunk_size=CHUNK_SIZE):
+    for chunk in pd.read_csv(path, dtype={'zipcode': str}, chunksize=chunk_size):
+        chunk['date'] = pd.to_datetime(chunk['date'], format=DATE_FORMAT)
+        yield chunk
+
+def _demographics_chunks(path=DEMOGRAPHICS_PATH):
+    yield pd.read_csv(path, dtype={'zipcode': str})
+
+def load_sales():
+    """kc_house_data.csv with ``zipcode`` as text and ``date`` parsed."""
+    return cached_table("sales", [SALES_PATH], _sales_chunks)
+
+def load_demographics():
+    """zipcode_demographics.csv with ``zipcode`` as text."""
+    return cached_table("demographics", [DEMOGRAPHICS_PATH], _demographics_chunks)
+
+def training_chunks(path=SALES_PATH, chunk_size=CHUNK_SIZE, demographics_path=DEMOGRAPHICS_PATH):
+    """Chunks of the training table (see load_training_table) straight from a sales CSV, without caching.
+
+    Only one chunk of sales is in memory at a time, for sales histories too
+    large to load whole.
+    """
+    demographics = pd.read_csv(demographics_path, dtype={'zipcode': str})
+    for chunk in _sales_chunks(path, chunk_size):
+        chunk['sale_year'] = chunk['date'].dt.year
+        chunk['sale_month'] = chunk['date'].dt.month
+        yield chunk.merge(demographics, on='zipcode', how='left')
+
+def load_training_table():
+    """Sales with ``sale_year``/``sale_month`` added after the sales columns, left-joined with demographics.
+
+    Every training and evaluation script selects its columns from this table,
+    so the zipcode join is done once per change of the source data.
+    """
+    return cached_table("training", [SALES_PATH, DEMOGRAPHICS_PATH], training_chunks)
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+class DemographicsIndex:
+    """Zipcode -> demographics lookup backed by one contiguous float64 matrix.
+
+    Columns are stored in the order the model feature list expects them, so a
+    looked-up row can be copied straight into a feature vector. Zipcodes with
+    missing values in any of those columns are left out of the index, which
+    keeps the "unknown zipcode" check a single dict lookup.
+    """
+
+    def __init__(self, demographics, features=None):
+        available = [col for col in demographics.columns if col != 'zipcode']
+        if features is None:
+            self.columns = available
+        else:
+            self.columns = [col for col in features if col in available]
+        values = demographics[self.columns].to_numpy(dtype=np.float64)
+        complete = ~np.isnan(values).any(axis=1)
+        self.matrix = np.ascontiguousarray(values[complete])
+        zipcodes = demographics['zipcode'].astype(str).values[complete]
+        self.offsets = {zipcode: offset for offset, zipcode in enumerate(zipcodes)}
+
+    @classmethod
+    def from_csv(cls, path, features=None):
+        return cls(pd.read_csv(path, dtype={'zipcode': str}), features)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, zipcode):
+        return zipcode in self.offsets
+
+    def offset(self, zipcode):
+        """Row offset of ``zipcode`` in ``matrix``, or None if it is unknown."""
+        return self.offsets.get(zipcode)
+
+    def row(self, zipcode):
+        offset = self.offsets.get(zipcode)
+        return None if offset is None else self.matrix[offset]
+
+    def offsets_for(self, zipcodes):
+        """Vector of row offsets for ``zipcodes``; unknown zipcodes map to -1."""
+        get = self.offsets.get
+        return np.fromiter((get(zipcode, -1) for zipcode in zipcodes), dtype=np.intp, count=len(zipcodes))
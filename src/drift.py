@@ -0,0 +1,250 @@
+"""Online comparison of live request features with the training data.
+
+A reference profile is computed from kc_house_data.csv at training time and
+saved as the 'profile' artifact: for every feature, bin edges at the
+training quantiles, the share of training rows in each bin, mean, standard
+deviation and a few quantiles.
+
+``DriftMonitor`` keeps one sketch per feature with memory fixed by the
+profile: a histogram over those bins (from which live quantiles are
+interpolated), running sums for mean and variance, min and max, plus counts
+of rows and of unknown zipcodes. Handlers add a payload to a small
+per-process buffer; every ``flush_rows`` rows the buffer is binned in one
+vectorized pass and added to the sketches. The sketches live in shared
+memory allocated before prefork.py forks, so the report covers every worker
+(less the at most ``flush_rows - 1`` rows each worker still has buffered).
+
+Drift per feature is the population stability index (PSI) of the live bin
+shares against the training ones, and the shift of the live mean in
+training standard deviations.
+"""
+import math, multiprocessing, operator, threading
+
+import numpy as np
+
+# Numeric HouseFeatures fields that are columns of kc_house_data.csv
+PROFILE_FEATURES = ("bedrooms", "bathrooms", "sqft_living", "sqft_lot", "floors", "waterfront", "view",
+                    "condition", "grade", "sqft_above", "sqft_basement", "yr_built", "yr_renovated",
+                    "lat", "long", "sqft_living15", "sqft_lot15")
+PROFILE_BINS = 20
+PROFILE_QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+# Usual PSI reading: below 0.1 stable, up to 0.25 a moderate shift, above that a major one
+PSI_MODERATE = 0.1
+PSI_MAJOR = 0.25
+# Floor on bin shares so an empty bin gives a large but finite PSI term
+PSI_EPSILON = 1e-4
+
+def bin_rows(values, edges):
+    """Bin of each value, per feature: (rows, features) values against (features, edges) sorted edges.
+
+    Edges are padded with +inf, so a feature with fewer distinct quantiles
+    simply never reaches the padded bins.
+    """
+    binned = np.empty(values.shape, dtype=np.intp)
+    for i in range(len(edges)):
+        # side='right': a value equal to an edge goes in the bin that starts at it
+        binned[:, i] = np.searchsorted(edges[i], values[:, i], side='right')
+    return binned
+
+def build_profile(frame, known_zipcode, features=PROFILE_FEATURES, bins=PROFILE_BINS):
+    """Arrays and metadata of the reference profile of ``frame`` for artifacts.write_artifact.
+
+    ``known_zipcode`` marks the rows whose zipcode has demographics.
+    """
+    values = frame[list(features)].to_numpy(dtype=np.float64)
+    edges = np.full((len(features), bins - 1), np.inf)
+    for i in range(len(features)):
+        # A feature with few distinct values (waterfront, view, condition...) gets one bin per value,
+        # any other one bins between its distinct inner quantiles
+        distinct = np.unique(values[:, i])
+        if len(distinct) >= bins:
+            distinct = np.unique(np.quantile(values[:, i], np.linspace(0, 1, bins + 1)[1:-1]))
+        edges[i, :len(distinct)] = distinct
+    binned = bin_rows(values, edges)
+    shares = np.stack([np.bincount(binned[:, i], minlength=bins) for i in range(len(features))]) / len(values)
+    arrays = {
+        'edges': edges,
+        'shares': shares,
+        'mean': values.mean(axis=0),
+        'std': values.std(axis=0),
+        'quantiles': np.quantile(values, PROFILE_QUANTILES, axis=0).T.copy(),
+        'min': values.min(axis=0),
+        'max': values.max(axis=0),
+    }
+    meta = {
+        'features': list(features),
+        'bins': int(bins),
+        'quantiles': list(PROFILE_QUANTILES),
+        'rows': int(len(values)),
+        'unknown_zipcode_rate': float(1 - np.mean(known_zipcode)),
+    }
+    return arrays, meta
+
+def psi(live, reference):
+    """Population stability index of bin shares ``live`` against ``reference`` (last axis)."""
+    live = np.maximum(live, PSI_EPSILON)
+    reference = np.maximum(reference, PSI_EPSILON)
+    return ((live - reference) * np.log(live / reference)).sum(axis=-1)
+
+def histogram_quantiles(counts, edges, low, high, levels):
+    """Quantiles interpolated linearly within the bins of a histogram.
+
+    The first and last bins are open-ended, so they are closed with the
+    observed ``low`` and ``high``.
+    """
+    finite = edges[np.isfinite(edges)]
+    bounds = np.concatenate([[low], finite, [high]])
+    counts = counts[:len(bounds) - 1]
+    cumulative = np.cumsum(counts)
+    total = cumulative[-1]
+    out = []
+    for level in levels:
+        target = level * total
+        j = min(int(np.searchsorted(cumulative, target, side='left')), len(counts) - 1)
+        before = cumulative[j - 1] if j else 0
+        fraction = (target - before) / counts[j] if counts[j] else 0.0
+        lower, upper = max(bounds[j], low), min(bounds[j + 1], high)
+        out.append(float(lower + fraction * (upper - lower)) if upper >= lower else float(lower))
+    return out
+
+class DriftMonitor:
+    """Fixed-memory streaming sketches of request features, compared with a reference profile.
+
+    ``profile`` is the 'profile' artifact and ``index`` the DemographicsIndex
+    that decides whether a zipcode is known. Create it before forking workers
+    to share the sketches between them.
+    """
+
+    def __init__(self, profile, index, flush_rows=64, min_count=100):
+        self.profile = profile
+        self.index = index
+        self.features = tuple(profile.meta['features'])
+        self.flush_rows = flush_rows
+        self.min_count = min_count
+        self.enabled = True
+        self._row = operator.itemgetter(*self.features)
+        self._edges = np.asarray(profile['edges'])
+        self._center = np.asarray(profile['mean'])
+        n, bins = len(self.features), profile.meta['bins']
+        # Shared layout: bin counts, then per-feature count, sum and sum of squares of deviations
+        # from the training mean (better conditioned than raw sums), min and max, then rows and unknown zipcodes
+        self._layout = {'counts': n * bins, 'n': n, 'sum': n, 'sumsq': n, 'min': n, 'max': n, 'totals': 2}
+        self._shared = multiprocessing.RawArray('d', sum(self._layout.values()))
+        self._shared_lock = multiprocessing.Lock()
+        self._buffer = []
+        self._buffer_unknown = 0
+        self._lock = threading.Lock()
+        self.reset()
+
+    def _views(self):
+        """Named numpy views onto the shared sketch memory."""
+        flat = np.frombuffer(self._shared, dtype=np.float64)
+        views, start = {}, 0
+        for name, size in self._layout.items():
+            views[name] = flat[start:start + size]
+            start += size
+        views['counts'] = views['counts'].reshape(len(self.features), -1)
+        return views
+
+    def observe(self, payload):
+        """Record one request payload (a dict of fields; fields it lacks are skipped)."""
+        if not self.enabled:
+            return
+        try:
+            row = self._row(payload)
+        except KeyError:
+            # Payloads of /predict_basic carry only some of the features
+            row = [payload.get(name, math.nan) for name in self.features]
+        known = self.index.offset(payload['zipcode']) is not None
+        with self._lock:
+            self._buffer.append(row)
+            self._buffer_unknown += not known
+            full = len(self._buffer) >= self.flush_rows
+        if full:
+            self.flush()
+
+    def observe_columns(self, columns, rows, unknown_zipcodes):
+        """Record a validated columnar batch of ``rows`` rows ({field: array})."""
+        if not self.enabled or not rows:
+            return
+        values = np.full((rows, len(self.features)), np.nan)
+        for i, name in enumerate(self.features):
+            if name in columns:
+                values[:, i] = columns[name]
+        self._update(values, unknown_zipcodes)
+
+    def flush(self):
+        """Add the rows buffered in this process to the shared sketches."""
+        with self._lock:
+            rows, unknown = self._buffer, self._buffer_unknown
+            self._buffer, self._buffer_unknown = [], 0
+        if rows:
+            self._update(np.array(rows, dtype=np.float64), unknown)
+
+    def _update(self, values, unknown_zipcodes):
+        present = ~np.isnan(values)
+        binned = bin_rows(np.where(present, values, -np.inf), self._edges)
+        features, bins = self._layout['n'], self._layout['counts'] // self._layout['n']
+        flat = (np.arange(features) * bins + binned)[present]
+        counts = np.bincount(flat, minlength=features * bins)
+        deviations = np.where(present, values - self._center, 0.0)
+        with self._shared_lock:
+            views = self._views()
+            views['counts'] += counts.reshape(features, bins)
+            views['n'] += present.sum(axis=0)
+            views['sum'] += deviations.sum(axis=0)
+            views['sumsq'] += (deviations ** 2).sum(axis=0)
+            np.fmin(views['min'], np.where(present, values, np.inf).min(axis=0), out=views['min'])
+            np.fmax(views['max'], np.where(present, values, -np.inf).max(axis=0), out=views['max'])
+            views['totals'] += (len(values), unknown_zipcodes)
+
+    def reset(self):
+        """Start a new observation window: clear the shared sketches and this process's buffer."""
+        with self._lock:
+            self._buffer, self._buffer_unknown = [], 0
+        with self._shared_lock:
+            views = self._views()
+            for name in ('counts', 'n', 'sum', 'sumsq', 'totals'):
+                views[name][:] = 0
+            views['min'][:] = np.inf
+            views['max'][:] = -np.inf
+
+    def report(self):
+        """Drift scores per feature and overall, after flushing this process's buffer."""
+        self.flush()
+        with self._shared_lock:
+            views = {name: view.copy() for name, view in self._views().items()}
+        profile, meta = self.profile, self.profile.meta
+        rows, unknown = views['totals']
+        features = {}
+        for i, name in enumerate(self.features):
+            n = views['n'][i]
+            entry = {"count": int(n), "reference_mean": float(profile['mean'][i]), "reference_std": float(profile['std'][i]),
+                     "reference_quantiles": dict(zip(map(str, meta['quantiles']), profile['quantiles'][i].tolist()))}
+            if n:
+                mean = self._center[i] + views['sum'][i] / n
+                variance = max(views['sumsq'][i] / n - (views['sum'][i] / n) ** 2, 0.0)
+                score = float(psi(views['counts'][i] / n, np.asarray(profile['shares'][i])))
+                std = float(profile['std'][i])
+                entry.update({
+                    "mean": float(mean), "std": math.sqrt(variance),
+                    "min": float(views['min'][i]), "max": float(views['max'][i]),
+                    "quantiles": dict(zip(map(str, meta['quantiles']), histogram_quantiles(
+                        views['counts'][i], self._edges[i], views['min'][i], views['max'][i], meta['quantiles']))),
+                    "mean_shift": float((mean - profile['mean'][i]) / std) if std else 0.0,
+                    "psi": score,
+                })
+            entry["drift"] = ("insufficient data" if not n or n < self.min_count else
+                              "major" if entry["psi"] > PSI_MAJOR else "moderate" if entry["psi"] > PSI_MODERATE else "none")
+            features[name] = entry
+        scored = {name: entry["psi"] for name, entry in features.items() if entry["count"] >= self.min_count}
+        return {
+            "rows": int(rows),
+            "profile_version": profile.version,
+            "reference_rows": meta['rows'],
+            "unknown_zipcode_rate": float(unknown / rows) if rows else None,
+            "reference_unknown_zipcode_rate": meta['unknown_zipcode_rate'],
+            "max_psi": max(scored.values()) if scored else None,
+            "drifted": sorted(name for name, entry in features.items() if entry["drift"] in ("moderate", "major")),
+            "features": features,
+        }
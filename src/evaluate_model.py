@@ -1,28 +1,44 @@
-import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import r2_score, mean_absolute_error
-import pickle, json, os
+import argparse, pickle, json, os
 
-def load_model():
-    model_path = os.path.join(os.path.dirname(__file__), "..", "model", "model.pkl")
-    features_path = os.path.join(os.path.dirname(__file__), "..", "model", "model_features.json")
+from create_improved_model import prepare_training_table
+from cross_validation import CACHE_DIR, evaluate as cross_validate
+from datasets import load_training_table
+from geo_features import add_geo_features, load_geo_index, uses_geo_features
+from artifacts import read_artifact
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "..", "model")
+MODEL_FILES = {
+    "basic": ("model.pkl", "model_features.json"),
+    "improved": ("model_improved.pkl", "model_features_improved.json"),
+}
+
+def load_model(name="basic"):
+    model_file, features_file = MODEL_FILES[name]
+    model_path = os.path.join(MODEL_DIR, model_file)
+    features_path = os.path.join(MODEL_DIR, features_file)
     with open(model_path, "rb") as f:
         model = pickle.load(f)
     with open(features_path, "r") as f:
         model_features = json.load(f)
     return model, model_features
 
+def model_geo_index(name):
+    """The GeoIndex model ``name`` was trained against, per its artifact (else the LATEST geo artifact)."""
+    try:
+        meta = read_artifact(name, root=os.path.join(MODEL_DIR, "artifacts"), verify=False).meta
+    except FileNotFoundError:
+        meta = None
+    return load_geo_index(meta, root=os.path.join(MODEL_DIR, "artifacts"))
+
 def load_data():
-    sales_path = os.path.join(os.path.dirname(__file__), "data", "kc_house_data.csv")
-    demographics_path = os.path.join(os.path.dirname(__file__), "data", "zipcode_demographics.csv")
-    sales_data = pd.read_csv(sales_path, dtype={'zipcode': str})
-    demographics = pd.read_csv(demographics_path, dtype={'zipcode': str})
-    return sales_data, demographics
-
-def prepare_data(sales_data, demographics, model_features):
-    merged = pd.merge(sales_data, demographics, on='zipcode', how='left')
-    y = merged.pop('price')
-    X = merged[model_features]
+    """Sales joined with demographics, from the shared dataset cache."""
+    return load_training_table()
+
+def prepare_data(table, model_features):
+    y = table.pop('price')
+    X = table[model_features]
     return X, y
 
 def evaluate(model, X, y):
@@ -35,13 +51,61 @@ def evaluate(model, X, y):
 def print_results(r2, mae):
     print(f"--- Model Evaluation ---\nR2: {r2:.4f}\nMAE: ${mae:,.2f}\nExplains {r2:.1%} variance, avg error ${mae:,.2f}")
 
+def cross_validation_inputs(names):
+    """{name: (model, X, y)} for each model plus the zipcode of every row; all share the same rows."""
+    table = load_data()
+    zipcodes = table['zipcode'].to_numpy()
+    models = {}
+    for name in names:
+        model, model_features = load_model(name)
+        if name == "improved":
+            # Same preparation the improved model was trained with (numeric coercion, zero fill)
+            X, y = prepare_training_table(table.copy())
+            if uses_geo_features(model_features):
+                # Each sale's neighborhood features leave out the sales of its own house
+                X = add_geo_features(X, model_geo_index(name), exclude_ids=table['id'].to_numpy())
+            X = X[model_features]
+        else:
+            X, y = prepare_data(table.copy(), model_features)
+        models[name] = (model, X, y)
+    return models, zipcodes
+
+def print_report(report, top_zipcodes=10):
+    print(f"--- {report['folds']}-fold cross-validation ({report['folds_computed']} folds computed, the rest cached) ---")
+    for name, result in report["models"].items():
+        (r2_low, r2_high), (mae_low, mae_high) = result["ci"]["r2"], result["ci"]["mae"]
+        print(f"{name}: R2 {result['r2']:.4f} [{r2_low:.4f}, {r2_high:.4f}] (fold std {result['fold_r2_std']:.4f}), "
+              f"MAE ${result['mae']:,.0f} [${mae_low:,.0f}, ${mae_high:,.0f}] (fold std ${result['fold_mae_std']:,.0f})")
+        print(f"  worst zipcodes by MAE:")
+        for row in result["zipcodes"][:top_zipcodes]:
+            print(f"    {row['zipcode']}  n={row['count']:<5d} MAE ${row['mae']:>10,.0f}  bias ${row['bias']:>+10,.0f}  "
+                  f"MAPE {row['mape']:.1%}")
+
 def main():
+    parser = argparse.ArgumentParser(description="Evaluate the trained models.")
+    parser.add_argument("--holdout", action="store_true",
+                        help="only score the basic model on the 20%% holdout split (previous behaviour)")
+    parser.add_argument("--models", nargs="+", choices=tuple(MODEL_FILES), default=list(MODEL_FILES))
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--bootstrap", type=int, default=1000, help="bootstrap resamples for confidence intervals")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="parallel fold fits (default: all cores)")
+    parser.add_argument("--top-zipcodes", type=int, default=10)
+    parser.add_argument("--report", default=os.path.join(MODEL_DIR, "evaluation_report.json"))
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="where fold predictions are cached")
+    args = parser.parse_args()
     try:
-        model, model_features = load_model()
-        sales_data, demographics = load_data()
-        X, y = prepare_data(sales_data, demographics, model_features)
-        r2, mae = evaluate(model, X, y)
-        print_results(r2, mae)
+        if args.holdout:
+            model, model_features = load_model()
+            X, y = prepare_data(load_data(), model_features)
+            r2, mae = evaluate(model, X, y)
+            print_results(r2, mae)
+            return
+        models, zipcodes = cross_validation_inputs(args.models)
+        report = cross_validate(models, zipcodes, args.folds, n_boot=args.bootstrap, n_jobs=args.n_jobs,
+                                cache_dir=args.cache_dir)
+        print_report(report, args.top_zipcodes)
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
     except FileNotFoundError as e:
         print(f"Error: {e}")
 
@@ -0,0 +1,66 @@
+"""Per-feature contributions to the improved model's predictions.
+
+Uses Saabas' path-based attribution on the trees of a CompiledEnsemble.
+Every node of a tree holds the mean target of the training rows that
+reached it. Following a row from the root to its leaf, each split moves the
+expected value from the parent's mean to the child's. That step is
+credited to the feature the parent split on. For every row:
+
+    prediction = bias + sum(contributions)
+
+``bias`` is the model's initial prediction plus every tree's root value,
+the same for all rows. The contributions are exact for the trees as
+trained; they explain this model, not the underlying data.
+
+Since a leaf fixes the whole path to it, the per-feature sum along the path
+is computed once per leaf when the explainer is built. Explaining rows is
+then the same tree traversal as a prediction plus one gather and sum of
+those leaf vectors across trees.
+"""
+import numpy as np
+
+class TreeExplainer:
+    """Path-based feature contributions for a CompiledEnsemble, precomputed per leaf."""
+
+    def __init__(self, ensemble):
+        if not ensemble.node_values:
+            raise ValueError("The ensemble has no split node values; re-export it to explain its predictions")
+        self.ensemble = ensemble
+        self.bias = float(ensemble.init + np.sum(ensemble.value[ensemble.roots], dtype=np.float64))
+        self._paths = self._path_contributions(ensemble)
+
+    @staticmethod
+    def _path_contributions(ensemble):
+        """(n_nodes, n_features) sums of the value steps credited to each feature from the root to every node."""
+        value = np.asarray(ensemble.value, dtype=np.float64)
+        paths = np.zeros((len(value), ensemble.n_features), dtype=np.float64)
+        frontier = np.asarray(ensemble.roots)
+        # One level of every tree per step; leaves point back to themselves and drop out of the frontier
+        for _ in range(ensemble.max_depth):
+            splits = frontier[ensemble.left[frontier] != frontier]
+            if not len(splits):
+                break
+            features = ensemble.feature[splits]
+            children = []
+            for child in (ensemble.left[splits], ensemble.right[splits]):
+                paths[child] = paths[splits]
+                paths[child, features] += value[child] - value[splits]
+                children.append(child)
+            frontier = np.concatenate(children)
+        return paths
+
+    def explain(self, X, chunk_size=64):
+        """(predictions, contributions) for rows of ``X`` in training feature order.
+
+        ``contributions`` has one column per feature. The predictions are
+        the ensemble's own, so they match ``ensemble.predict`` exactly, and
+        each equals ``bias`` plus its row of contributions up to rounding.
+        """
+        X = self.ensemble.check_input(X)
+        predictions = np.empty(X.shape[0], dtype=np.float64)
+        contributions = np.empty((X.shape[0], self.ensemble.n_features), dtype=np.float64)
+        for start in range(0, X.shape[0], chunk_size):
+            leaves = self.ensemble.leaves(X[start:start + chunk_size])
+            predictions[start:start + leaves.shape[1]] = self.ensemble.predict_leaves(leaves)
+            contributions[start:start + leaves.shape[1]] = self._paths[leaves].sum(axis=0)
+        return predictions, contributions
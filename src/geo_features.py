@@ -0,0 +1,122 @@
+"""Neighborhood features from past sales around a house's location.
+
+``GeoIndex`` holds the location and price per square foot of every training
+sale in a ball tree on the haversine metric. Two features are answered from
+it for any (lat, long):
+
+- ``geo_knn_price_per_sqft``: median price per sqft of the ``n_neighbors``
+  nearest past sales
+- ``geo_sales_density``: past sales per km² within ``radius_km``
+
+The tree is built at training time and stored in a 'geo' artifact as its
+internal node arrays (like NeighborIndex), so serving memory-maps it and a
+lookup is one vectorized tree query for a row or a whole batch. When scoring
+training sales themselves, ``exclude_ids`` leaves each house's own sales
+out of its features so they do not leak its price.
+"""
+import numpy as np
+import sklearn
+from sklearn.neighbors import BallTree
+
+from artifacts import ARTIFACTS_DIR, read_artifact
+from neighbors import restore_tree, tree_arrays
+
+GEO_FEATURES = ("geo_knn_price_per_sqft", "geo_sales_density")
+EARTH_RADIUS_KM = 6371.0088
+
+def uses_geo_features(features):
+    return any(feature in GEO_FEATURES for feature in features)
+
+class GeoIndex:
+    """Ball tree over past sale locations with their price per square foot."""
+
+    def __init__(self, points, price_per_sqft, ids, tree, n_neighbors=10, radius_km=1.0, leaf_size=40):
+        self.points = points
+        self.price_per_sqft = price_per_sqft
+        self.ids = ids
+        self.tree = tree
+        self.n_neighbors = n_neighbors
+        self.radius_km = radius_km
+        self.leaf_size = leaf_size
+        # Sorted ids and how many sales each has, to discount a house's own sales from its density
+        self._unique_ids, self._id_counts = np.unique(ids, return_counts=True)
+
+    @classmethod
+    def from_sales(cls, lat, long, price, sqft_living, ids, n_neighbors=10, radius_km=1.0, leaf_size=40):
+        """Index past sales given as equal-length arrays; ``ids`` identifies the house of each sale."""
+        points = np.ascontiguousarray(np.radians(np.column_stack([lat, long])), dtype=np.float64)
+        price_per_sqft = np.asarray(price, dtype=np.float64) / np.asarray(sqft_living, dtype=np.float64)
+        tree = BallTree(points, leaf_size=leaf_size, metric='haversine')
+        return cls(points, price_per_sqft, np.asarray(ids, dtype=np.int64), tree, n_neighbors, radius_km, leaf_size)
+
+    def to_artifact(self):
+        """Arrays and metadata for artifacts.write_artifact."""
+        tree_state, tree_scalars = tree_arrays(self.tree)
+        arrays = {'points': self.points, 'price_per_sqft': self.price_per_sqft, 'ids': self.ids, **tree_state}
+        meta = {
+            'features': list(GEO_FEATURES),
+            'n_neighbors': int(self.n_neighbors),
+            'radius_km': float(self.radius_km),
+            'leaf_size': int(self.leaf_size),
+            'tree_scalars': tree_scalars,
+            'sklearn_version': sklearn.__version__,
+        }
+        return arrays, meta
+
+    @classmethod
+    def from_artifact(cls, artifact):
+        """Rebuild an index around the memory-mapped arrays of an artifact."""
+        meta = artifact.meta
+        points = artifact['points']
+        tree = restore_tree(BallTree, points, artifact, meta['leaf_size'], 'haversine')
+        return cls(points, artifact['price_per_sqft'], artifact['ids'], tree,
+                   meta['n_neighbors'], meta['radius_km'], meta['leaf_size'])
+
+    def _own_sales(self, ids):
+        """How many indexed sales belong to each of ``ids`` (0 for houses not in the index)."""
+        positions = np.searchsorted(self._unique_ids, ids).clip(max=len(self._unique_ids) - 1)
+        return np.where(self._unique_ids[positions] == ids, self._id_counts[positions], 0)
+
+    def query(self, lat, long, exclude_ids=None):
+        """(n, len(GEO_FEATURES)) feature array for n locations.
+
+        With ``exclude_ids``, every indexed sale of the house with that id is
+        ignored for the matching row. Raises ValueError for non-finite coordinates.
+        """
+        X = np.radians(np.column_stack([np.asarray(lat, dtype=np.float64), np.asarray(long, dtype=np.float64)]))
+        out = np.empty((len(X), len(GEO_FEATURES)), dtype=np.float64)
+        if not len(X):
+            return out
+        if not np.isfinite(X).all():
+            raise ValueError("lat and long must be finite")
+        # Checked above, so sklearn's own finiteness scan (a good part of a one-row query) is skipped
+        with sklearn.config_context(assume_finite=True):
+            return self._query(X, out, exclude_ids)
+
+    def _query(self, X, out, exclude_ids):
+        k = self.n_neighbors
+        radius = self.radius_km / EARTH_RADIUS_KM
+        counts = self.tree.query_radius(X, radius, count_only=True)
+        if exclude_ids is None:
+            neighbors = self.tree.query(X, k=k, return_distance=False)
+        else:
+            exclude_ids = np.asarray(exclude_ids, dtype=np.int64)
+            own = self._own_sales(exclude_ids)
+            candidates = self.tree.query(X, k=min(k + int(own.max()), len(self.points)), return_distance=False)
+            # Stable sort moves the house's own sales behind the others, keeping distance order
+            other = self.ids[candidates] != exclude_ids[:, None]
+            neighbors = np.take_along_axis(candidates, np.argsort(~other, axis=1, kind='stable')[:, :k], axis=1)
+            counts = counts - own
+        out[:, 0] = np.median(self.price_per_sqft[neighbors], axis=1)
+        out[:, 1] = counts / (np.pi * self.radius_km ** 2)
+        return out
+
+def add_geo_features(frame, geo_index, exclude_ids=None):
+    """``frame`` with the GEO_FEATURES columns appended, from its ``lat`` and ``long`` columns."""
+    values = geo_index.query(frame['lat'].to_numpy(), frame['long'].to_numpy(), exclude_ids)
+    return frame.assign(**{name: values[:, i] for i, name in enumerate(GEO_FEATURES)})
+
+def load_geo_index(model_meta=None, root=ARTIFACTS_DIR, verify=False):
+    """The GeoIndex a model artifact was trained against (its ``geo_version``), else the LATEST one."""
+    version = model_meta.get('geo_version') if model_meta else None
+    return GeoIndex.from_artifact(read_artifact("geo", version, root, verify))
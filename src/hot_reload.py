@@ -0,0 +1,158 @@
+"""Swapping model versions into a running server without a restart.
+
+A ``ServedModel`` holds everything a request needs from one model version:
+the predictor, its feature assembler and demographics index, the prediction
+cache key, its own micro-batcher and, for tree models, its explainer. Handlers look the current one up once
+per request and use only that object, so replacing the registry entry is
+atomic: requests that already hold the old version finish on it, new ones
+get the new version.
+
+``ModelRegistry.reload`` loads a version in a worker thread, warms it by
+scoring a batch of reference houses, checks the predictions (finite and
+positive, identical for single rows and batches, identical to the serving
+model when the version is unchanged, and within ``max_change`` median
+relative change otherwise), then swaps it in and retires the old version's
+batcher once its queued rows are scored.
+"""
+import asyncio, logging, time
+
+import numpy as np
+
+from artifacts import latest_version
+
+logger = logging.getLogger("uvicorn.error")
+
+class ReloadError(Exception):
+    """A candidate version failed its warm-up checks and was not swapped in."""
+
+class ServedModel:
+    """One loaded version of a model and everything needed to serve it."""
+
+    def __init__(self, name, version, predictor, assembler, key, batcher, explainer=None):
+        self.name = name
+        self.version = version
+        self.predictor = predictor
+        self.assembler = assembler
+        self.key = key
+        self.batcher = batcher
+        self.explainer = explainer
+        self.loaded_at = time.time()
+
+    @property
+    def index(self):
+        return self.assembler.index
+
+    def predict_rows(self, rows):
+        """Predictions for payload dicts whose zipcodes are all in the demographics index."""
+        offsets = self.index.offsets_for([row['zipcode'] for row in rows])
+        if (offsets < 0).any():
+            raise ReloadError(f"{self.name} v{self.version}: reference rows with unknown zipcodes")
+        return np.asarray(self.predictor.predict(self.assembler.assemble_batch(rows, offsets)), dtype=np.float64)
+
+    def describe(self):
+        return {"version": self.version, "key": list(self.key), "features": len(self.assembler.features),
+                "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.loaded_at))}
+
+def check_candidate(candidate, current, reference_rows, max_change=0.5, single_rows=8):
+    """Warm ``candidate`` up on ``reference_rows`` and compare it with the ``current`` model.
+
+    Raises ReloadError when a check fails; returns a summary of the comparison.
+    """
+    start = time.perf_counter()
+    predictions = candidate.predict_rows(reference_rows)
+    warmup_seconds = time.perf_counter() - start
+    if not np.isfinite(predictions).all() or (predictions <= 0).any():
+        raise ReloadError(f"{candidate.name} v{candidate.version}: non-finite or non-positive reference predictions")
+    for i, row in enumerate(reference_rows[:single_rows]):
+        # The micro-batcher scores rows in batches of any size, so a row must not depend on its batch
+        if candidate.predict_rows([row])[0] != predictions[i]:
+            raise ReloadError(f"{candidate.name} v{candidate.version}: single-row prediction differs from batch")
+
+    report = {"rows": len(reference_rows), "warmup_seconds": warmup_seconds}
+    if current is not None:
+        baseline = current.predict_rows(reference_rows)
+        change = np.abs(predictions - baseline) / np.abs(baseline)
+        report["median_relative_change"] = float(np.median(change))
+        report["max_relative_change"] = float(change.max())
+        if candidate.version == current.version and not np.array_equal(predictions, baseline):
+            raise ReloadError(f"{candidate.name} v{candidate.version}: predictions differ from the serving copy of the same version")
+        if report["median_relative_change"] > max_change:
+            raise ReloadError(f"{candidate.name} v{candidate.version}: median relative change "
+                              f"{report['median_relative_change']:.1%} vs v{current.version} exceeds {max_change:.0%}")
+    return report
+
+class ModelRegistry:
+    """The serving version of each model, replaced atomically by ``reload``.
+
+    ``loader(name, version)`` builds a ServedModel (``version=None`` means
+    the LATEST artifact). ``cache`` is the PredictionCache whose entries of a
+    replaced version are dropped.
+    """
+
+    def __init__(self, loader, reference_rows, cache=None, max_change=0.5):
+        self.loader = loader
+        self.reference_rows = reference_rows
+        self.cache = cache
+        self.max_change = max_change
+        self.models = {}
+        self.reloads = 0
+        self.rejected = {}
+        self._lock = None
+
+    def __getitem__(self, name):
+        return self.models[name]
+
+    def get(self, name):
+        return self.models.get(name)
+
+    async def reload(self, name, version=None, force=False):
+        """Load, warm and check ``version`` of model ``name`` and swap it in; returns a report.
+
+        Raises FileNotFoundError for a missing version and ReloadError when a
+        check fails. Loading the version already being served is a no-op
+        unless ``force`` is given.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            current = self.models.get(name)
+            if version is not None and current is not None and version == current.version and not force:
+                return {"model": name, "version": current.version, "swapped": False}
+            start = time.perf_counter()
+            candidate = await loop.run_in_executor(None, self.loader, name, version)
+            if current is not None and candidate.version == current.version and not force:
+                return {"model": name, "version": current.version, "swapped": False}
+            try:
+                report = await loop.run_in_executor(None, check_candidate, candidate, current,
+                                                    self.reference_rows, self.max_change)
+            except ReloadError:
+                self.rejected[name] = candidate.version
+                raise
+            self.models[name] = candidate
+            self.reloads += 1
+            self.rejected.pop(name, None)
+            if current is not None:
+                if self.cache is not None and current.key != candidate.key:
+                    self.cache.invalidate(current.key)
+                loop.create_task(current.batcher.drain())
+            report.update({"model": name, "version": candidate.version, "swapped": True,
+                           "previous_version": current.version if current is not None else None,
+                           "reload_seconds": time.perf_counter() - start})
+            logger.info("Reloaded %s: v%s -> v%s", name, report["previous_version"], candidate.version)
+            return report
+
+    async def watch(self, root, interval):
+        """Reload every model whose LATEST artifact pointer moves, polling every ``interval`` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            for name, current in list(self.models.items()):
+                version = latest_version(name, root)
+                if version is None or version == current.version or version == self.rejected.get(name):
+                    continue
+                try:
+                    await self.reload(name, version)
+                except Exception as e:
+                    # Keep serving the current version; the same version is not retried until LATEST moves again
+                    self.rejected[name] = version
+                    logger.warning("Reload of %s v%s failed: %s", name, version, e)
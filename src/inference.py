@@ -0,0 +1,117 @@
+import threading
+from operator import itemgetter
+
+import numpy as np
+
+from geo_features import GEO_FEATURES
+
+# Sale date assumed for houses that do not say when they are being sold
+DEFAULT_SALE_YEAR = 2023
+DEFAULT_SALE_MONTH = 6
+
+def drop_feature_names(estimator):
+    """Strip fitted feature names so ndarray input skips sklearn's name check.
+
+    Estimators fitted on a DataFrame validate (and warn about) column names on
+    every predict call. Once a FeatureAssembler guarantees the column order,
+    that check is pure overhead. Works in place on pipelines and plain estimators.
+    """
+    steps = [step for _, step in estimator.steps] if hasattr(estimator, 'steps') else [estimator]
+    for step in steps:
+        if 'feature_names_in_' in vars(step):
+            del step.feature_names_in_
+    return estimator
+
+def _slot_spec(slots):
+    """Use a slice when the slots are one contiguous run, a fancy index otherwise."""
+    if len(slots) and np.array_equal(slots, np.arange(slots[0], slots[0] + len(slots))):
+        return slice(int(slots[0]), int(slots[0]) + len(slots))
+    return np.asarray(slots, dtype=np.intp)
+
+class FeatureAssembler:
+    """Builds model input rows straight from request payloads and demographics.
+
+    The column plan is compiled once from the model feature list: which slots
+    come from the payload (and under which key) and which come from the
+    demographics matrix. Assembly is then a couple of vectorized writes into a
+    preallocated buffer, one per thread: the API assembles single rows on the
+    event loop, and rows that need the neighborhood query in the thread pool
+    (into their own ``out``, as the pool thread may reuse its buffer for the
+    next request first). Models trained with neighborhood features also need
+    ``geo_index``, which answers them from the payload's lat/long.
+    """
+
+    def __init__(self, features, demographics_index, dtype=np.float64, geo_index=None):
+        self.features = list(features)
+        self.index = demographics_index
+        self.dtype = np.dtype(dtype)
+        self.geo = geo_index
+        demographic_positions = {col: i for i, col in enumerate(demographics_index.columns)}
+        geo_slots = [i for i, f in enumerate(self.features) if f in GEO_FEATURES]
+        if geo_slots and geo_index is None:
+            raise ValueError("Features include neighborhood features but no GeoIndex was given")
+        derived = set(demographic_positions) | set(GEO_FEATURES)
+
+        self.payload_fields = [f for f in self.features if f not in derived]
+        payload_slots = [i for i, f in enumerate(self.features) if f not in derived]
+        demographic_slots = [i for i, f in enumerate(self.features) if f in demographic_positions]
+        demographic_columns = [demographic_positions[f] for f in self.features if f in demographic_positions]
+
+        self._payload_getter = itemgetter(*self.payload_fields) if self.payload_fields else (lambda payload: ())
+        if len(self.payload_fields) == 1:
+            getter = self._payload_getter
+            self._payload_getter = lambda payload: (getter(payload),)
+        self._payload_slot_list = payload_slots
+        self._payload_slots = _slot_spec(payload_slots)
+        self._demographic_slots = _slot_spec(demographic_slots)
+        self._demographic_columns = _slot_spec(demographic_columns)
+        self._geo_slots = _slot_spec(geo_slots) if geo_slots else None
+        self._geo_columns = _slot_spec([GEO_FEATURES.index(self.features[i]) for i in geo_slots])
+        self._local = threading.local()
+
+    def _buffer(self):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = np.empty((1, len(self.features)), dtype=self.dtype)
+        return buffer
+
+    def assemble(self, payload, offset, out=None):
+        """Return a (1, n_features) array for one payload and its demographics row offset.
+
+        Without ``out`` the thread's reusable buffer is returned, so the result
+        is only valid until the next call on the same thread.
+        """
+        out = self._buffer() if out is None else out
+        row = out[0]
+        row[self._payload_slots] = self._payload_getter(payload)
+        row[self._demographic_slots] = self.index.matrix[offset, self._demographic_columns]
+        if self._geo_slots is not None:
+            row[self._geo_slots] = self.geo.query((payload['lat'],), (payload['long'],))[0, self._geo_columns]
+        return out
+
+    def assemble_batch(self, payloads, offsets):
+        """Return a fresh (n, n_features) array for many payloads at once."""
+        out = np.empty((len(payloads), len(self.features)), dtype=self.dtype)
+        if len(payloads):
+            getter = self._payload_getter
+            out[:, self._payload_slots] = [getter(payload) for payload in payloads]
+            out[:, self._demographic_slots] = self.index.matrix[np.asarray(offsets)][:, self._demographic_columns]
+            if self._geo_slots is not None:
+                geo = self.geo.query([payload['lat'] for payload in payloads], [payload['long'] for payload in payloads])
+                out[:, self._geo_slots] = geo[:, self._geo_columns]
+        return out
+
+    def assemble_columns(self, columns, offsets):
+        """Return a fresh (n, n_features) array from column data, e.g. a DataFrame chunk.
+
+        ``columns`` maps each payload field to an array-like of n values, so no
+        per-row Python objects are created.
+        """
+        offsets = np.asarray(offsets)
+        out = np.empty((len(offsets), len(self.features)), dtype=self.dtype)
+        for slot, field in zip(self._payload_slot_list, self.payload_fields):
+            out[:, slot] = columns[field]
+        out[:, self._demographic_slots] = self.index.matrix[offsets][:, self._demographic_columns]
+        if self._geo_slots is not None and len(offsets):
+            out[:, self._geo_slots] = self.geo.query(columns['lat'], columns['long'])[:, self._geo_columns]
+        return out
@@ -1,12 +1,140 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
 from fastapi.middleware.cors import CORSMiddleware
 import pandas as pd
+import numpy as np
 import pickle
+import asyncio
 import json
-from typing import List, Optional
+import logging
+import os
+import random
+from typing import Literal, Optional
+
+from demographics import DemographicsIndex
+from inference import DEFAULT_SALE_MONTH, DEFAULT_SALE_YEAR, FeatureAssembler, drop_feature_names
+from tree_ensemble import CompiledEnsemble, input_dtype
+from explanations import TreeExplainer
+from profiler import ProfilerBusy, SamplingProfiler
+from neighbors import NeighborIndex
+from geo_features import load_geo_index, uses_geo_features
+from artifacts import ArtifactError, read_artifact
+from prediction_cache import PredictionCache
+from batching import MicroBatcher
+from prefork import ReadyWorkers
+from drift import DriftMonitor
+from hot_reload import ModelRegistry, ReloadError, ServedModel
+from wire_formats import (ARROW, JSON, NDJSON, NPY, WireFormatError, decode_columns, encode_predictions, field_specs,
+                          media_type, ndjson_blocks, ndjson_lines, negotiate, validate_columns)
+from metrics import Counter, Histogram, mark, render, start_timer, stop_timer
+from admission import (OUTCOMES, AdmissionLimiter, DeadlineExceeded, Overloaded, check_deadline, current_deadline,
+                       request_deadline, reset_deadline, set_deadline)
+
+# Latency of the prediction routes, whole requests and per stage. The metrics live in shared
+# memory, so under prefork.py every worker's /metrics reports the totals of all workers.
+TIMED_ROUTES = ("/predict", "/predict_basic", "/predict_improved", "/predict_batch", "/explain_improved")
+STAGES = ("validation", "demographics", "assembly", "predict", "serialization")
+request_seconds = Histogram("prediction_request_seconds", "Time spent handling a prediction request.",
+                            ("route",), (TIMED_ROUTES,))
+stage_seconds = Histogram("prediction_stage_seconds", "Time spent in each stage of a prediction request.",
+                          ("route", "stage"), (TIMED_ROUTES, STAGES))
+requests_total = Counter("prediction_requests_total", "Prediction requests by route and status class.",
+                         ("route", "status"), (TIMED_ROUTES, ("2xx", "4xx", "5xx")))
+
+# Admission control per model: up to ADMISSION_MAX_CONCURRENCY requests (0: no limit) are handled at
+# once per worker and ADMISSION_MAX_QUEUE more wait; beyond that requests get 503 with a Retry-After of
+# ADMISSION_RETRY_AFTER seconds. A request's deadline is its X-Request-Timeout-Ms header, else
+# REQUEST_TIMEOUT_MS (0: none); past it the request is answered 503 instead of being scored.
+MODEL_NAMES = ("basic", "improved")
+ROUTE_MODELS = {"/predict": "basic", "/predict_basic": "basic", "/predict_improved": "improved", "/explain_improved": "improved"}
+DEADLINE_HEADER = "x-request-timeout-ms"
+REQUEST_TIMEOUT_MS = float(os.environ.get("REQUEST_TIMEOUT_MS", 0))
+admission_total = Counter("prediction_admission_total", "Prediction requests by model and admission outcome.",
+                          ("model", "outcome"), (MODEL_NAMES, OUTCOMES))
+limiters = {name: AdmissionLimiter(name, int(os.environ.get("ADMISSION_MAX_CONCURRENCY", 64)),
+                                   int(os.environ.get("ADMISSION_MAX_QUEUE", 256)),
+                                   int(os.environ.get("ADMISSION_RETRY_AFTER", 1)), admission_total)
+            for name in MODEL_NAMES}
+
+def unavailable(detail, retry_after):
+    return JSONResponse({"detail": detail}, status_code=503, headers={"Retry-After": str(retry_after)})
+
+class TimedRoute(APIRoute):
+    """Route that times the prediction routes.
+
+    The stage timer starts before FastAPI parses and validates the body, so the
+    handler's first ``mark("validation")`` covers that; the time between the
+    handler returning and the response being ready is recorded as serialization.
+    The request must be admitted by its model's limiter before the handler
+    runs, and its deadline is set for the handler to check.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        if self.path not in TIMED_ROUTES:
+            return handler
+        route = self.path
+
+        async def timed_handler(request):
+            timer, token = start_timer(stage_seconds, route)
+            deadline_token = set_deadline(request_deadline(request.headers.get(DEADLINE_HEADER), REQUEST_TIMEOUT_MS))
+            # /predict_batch names its model in the query; an invalid name is left to the handler's validation
+            limiter = limiters.get(ROUTE_MODELS.get(route) or request.query_params.get("model", "basic"))
+            profile_token = profiler.enter(route) if profiler is not None and profiler.active else None
+            status = 500
+            try:
+                try:
+                    if limiter is not None:
+                        await limiter.acquire(current_deadline())
+                except Overloaded as e:
+                    response = unavailable(str(e), e.retry_after)
+                except DeadlineExceeded as e:
+                    response = unavailable(str(e), limiter.retry_after)
+                else:
+                    try:
+                        response = await handler(request)
+                    except DeadlineExceeded as e:
+                        retry_after = 1
+                        if limiter is not None:
+                            limiter.record("expired")
+                            retry_after = limiter.retry_after
+                        response = unavailable(str(e), retry_after)
+                    finally:
+                        if limiter is not None:
+                            limiter.release()
+                timer.mark("serialization")
+                status = response.status_code
+                return response
+            except HTTPException as e:
+                status = e.status_code
+                raise
+            except RequestValidationError:
+                status = 422
+                raise
+            finally:
+                reset_deadline(deadline_token)
+                stop_timer(token)
+                if profile_token is not None:
+                    profiler.exit(profile_token)
+                request_seconds.observe((route,), timer.elapsed())
+                requests_total.inc((route, f"{status // 100}xx"))
+
+        return timed_handler
 
 app = FastAPI()
+app.router.route_class = TimedRoute
+
+# Per-request detail is only logged with DEBUG_REQUESTS=1, or for a DEBUG_SAMPLE_RATE fraction of requests
+logger = logging.getLogger("uvicorn.error")
+DEBUG_REQUESTS = os.environ.get("DEBUG_REQUESTS", "0") == "1"
+DEBUG_SAMPLE_RATE = float(os.environ.get("DEBUG_SAMPLE_RATE", 0))
+
+def log_request_detail():
+    return DEBUG_REQUESTS or (DEBUG_SAMPLE_RATE > 0 and random.random() < DEBUG_SAMPLE_RATE)
 
 # Add CORS middleware
 app.add_middleware(
@@ -17,35 +145,156 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load models and demographics data at startup
-try:
-    with open("../model/model.pkl", "rb") as f:
-        model = pickle.load(f)
-except FileNotFoundError:
-    model = None
+# Load models and demographics data at startup.
+# Models are served from the versioned artifacts written by the training scripts: a manifest plus raw
+# arrays that are memory-mapped read-only, so every worker shares one copy through the OS page cache
+# and startup does not depend on model size. The pickles are only read when there is no artifact.
+# MODEL_VERIFY_CHECKSUMS=1 checks every file against its manifest SHA-256 at load and reload, which
+# reads the whole model, so it is off by default.
+ARTIFACTS_DIR = os.environ.get("MODEL_ARTIFACTS_DIR", "../model/artifacts")
+VERIFY_CHECKSUMS = os.environ.get("MODEL_VERIFY_CHECKSUMS", "0") == "1"
 
-try:
-    with open("../model/model_features.json", "r") as f:
-        model_features = json.load(f)
-except FileNotFoundError:
-    model_features = None
+# Concurrent single-row requests are coalesced per model into one predict call of up to
+# MICRO_BATCH_MAX_SIZE rows, waiting at most MICRO_BATCH_MAX_WAIT_MS for a batch to fill
+MICRO_BATCH_MAX_SIZE = int(os.environ.get("MICRO_BATCH_MAX_SIZE", 32))
+MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get("MICRO_BATCH_MAX_WAIT_MS", 2.0))
 
 try:
-    with open("../model/model_improved.pkl", "rb") as f:
-        improved_model = pickle.load(f)
+    demographics = pd.read_csv("data/zipcode_demographics.csv", dtype={'zipcode': str})
 except FileNotFoundError:
-    improved_model = None
+    demographics = None
 
-try:
-    with open("../model/model_features_improved.json", "r") as f:
-        improved_model_features = json.load(f)
-except FileNotFoundError:
-    improved_model_features = None
+def tree_explainer(predictor):
+    """TreeExplainer for the improved model, or None when its trees carry no split node values."""
+    ensemble = predictor if isinstance(predictor, CompiledEnsemble) else CompiledEnsemble.from_model(predictor)
+    return TreeExplainer(ensemble) if ensemble.node_values else None
+
+def served_model(name, version, predictor, features, key, dtype=np.float64, geo_index=None):
+    """Bundle a loaded predictor with its demographics index, feature assembler and micro-batcher.
+
+    The assembler writes payload + demographics (and neighborhood features from ``geo_index``)
+    straight into model input arrays, so the fitted column names are no longer needed for
+    validation at predict time. The improved model's explainer precomputes its per-leaf
+    contributions here, once per loaded version.
+    """
+    assembler = FeatureAssembler(features, DemographicsIndex(demographics, features), dtype=dtype, geo_index=geo_index)
+    batcher = MicroBatcher(predictor.predict, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS)
+    explainer = tree_explainer(predictor) if name == "improved" else None
+    return ServedModel(name, version, predictor, assembler, key, batcher, explainer)
+
+def load_artifact_model(name, version=None):
+    """ServedModel for ``version`` (default: LATEST) of artifact ``name``."""
+    artifact = read_artifact(name, version=version, root=ARTIFACTS_DIR, verify=VERIFY_CHECKSUMS)
+    features = artifact.meta['features']
+    if name == "basic":
+        # Prebuilt KD-tree (and k-means partitions) over the basic model's scaled training rows.
+        # BASIC_MODEL_SEARCH=approximate switches to the partitioned search, probing BASIC_MODEL_N_PROBE clusters.
+        predictor = NeighborIndex.from_artifact(artifact)
+        predictor.approximate = os.environ.get("BASIC_MODEL_SEARCH", "exact") == "approximate"
+        predictor.n_probe = int(os.environ.get("BASIC_MODEL_N_PROBE", predictor.n_probe))
+        search = f"approximate:{predictor.n_probe}" if predictor.approximate else "exact"
+        # Cache keys carry the model identity and version (and search mode) so entries never outlive a model
+        return served_model(name, artifact.version, predictor, features, (name, artifact.version, search))
+    # The improved model gets input in the precision its trees compare in (float32 unless it is a histogram GBM),
+    # and its neighborhood features from the geo index version it was trained with
+    predictor = CompiledEnsemble.from_artifact(artifact)
+    geo_index = load_geo_index(artifact.meta, ARTIFACTS_DIR, VERIFY_CHECKSUMS) if uses_geo_features(features) else None
+    return served_model(name, artifact.version, predictor, features, (name, artifact.version), predictor.dtype, geo_index)
+
+def load_pickled_model(name, model_path, features_path):
+    """ServedModel from the training pickles, or None when they are missing."""
+    try:
+        with open(model_path, "rb") as f:
+            model = pickle.load(f)
+        with open(features_path, "r") as f:
+            features = json.load(f)
+    except FileNotFoundError:
+        return None
+    drop_feature_names(model)
+    geo_index = load_geo_index(None, ARTIFACTS_DIR, VERIFY_CHECKSUMS) if uses_geo_features(features) else None
+    return served_model(name, "pickle", model, features, (name, "pickle"), input_dtype(model), geo_index)
+
+def load_model(name, model_path, features_path):
+    if demographics is None:
+        return None
+    try:
+        return load_artifact_model(name)
+    except FileNotFoundError:
+        return load_pickled_model(name, model_path, features_path)
+
+# PREDICTION_CACHE_SIZE=0 disables the cache; PREDICTION_CACHE_TTL is in seconds
+prediction_cache = PredictionCache(
+    maxsize=int(os.environ.get("PREDICTION_CACHE_SIZE", 10000)),
+    ttl=float(os.environ["PREDICTION_CACHE_TTL"]) if os.environ.get("PREDICTION_CACHE_TTL") else None,
+)
 
+# Houses from data/future_unseen_examples.csv that a new model version must score sanely before it
+# is swapped in. A reload is rejected when the median prediction moves by more than MODEL_RELOAD_MAX_CHANGE.
 try:
-    demographics = pd.read_csv("data/zipcode_demographics.csv", dtype={'zipcode': str})
+    reference_houses = pd.read_csv("data/future_unseen_examples.csv", dtype={'zipcode': str}).head(
+        int(os.environ.get("MODEL_RELOAD_REFERENCE_ROWS", 100))).to_dict(orient="records")
 except FileNotFoundError:
-    demographics = None
+    reference_houses = []
+reference_rows = [dict(house, sale_year=DEFAULT_SALE_YEAR, sale_month=DEFAULT_SALE_MONTH) for house in reference_houses]
+if demographics is not None:
+    known_zipcodes = set(demographics['zipcode'])
+    reference_rows = [row for row in reference_rows if row['zipcode'] in known_zipcodes]
+
+# The serving version of each model. Handlers read an entry once per request, so a reload (POST
+# /admin/reload, or the LATEST pointer moving with MODEL_RELOAD_POLL_SECONDS > 0) swaps models atomically.
+models = ModelRegistry(load_artifact_model, reference_rows, prediction_cache,
+                       max_change=float(os.environ.get("MODEL_RELOAD_MAX_CHANGE", 0.5)))
+for model_name, model_path, features_path in (
+        ("basic", "../model/model.pkl", "../model/model_features.json"),
+        ("improved", "../model/model_improved.pkl", "../model/model_features_improved.json")):
+    loaded = load_model(model_name, model_path, features_path)
+    if loaded is not None:
+        models.models[model_name] = loaded
+MODEL_RELOAD_POLL_SECONDS = float(os.environ.get("MODEL_RELOAD_POLL_SECONDS", 0))
+
+# Streaming sketches of request features, compared at GET /drift with the training data profile
+# written by create_improved_model.py. Rows are binned in batches of DRIFT_FLUSH_ROWS per worker;
+# features with fewer than DRIFT_MIN_COUNT live values are not scored. DRIFT_MONITOR=0 turns it off.
+drift_monitor = None
+if demographics is not None and os.environ.get("DRIFT_MONITOR", "1") == "1":
+    try:
+        drift_monitor = DriftMonitor(read_artifact("profile", root=ARTIFACTS_DIR, verify=VERIFY_CHECKSUMS),
+                                     DemographicsIndex(demographics),
+                                     flush_rows=int(os.environ.get("DRIFT_FLUSH_ROWS", 64)),
+                                     min_count=int(os.environ.get("DRIFT_MIN_COUNT", 100)))
+    except FileNotFoundError:
+        logger.warning("No 'profile' artifact; drift monitoring is off until the improved model is retrained")
+# The /admin endpoints and /drift/reset need ADMIN_TOKEN in their X-Admin-Token header; they refuse every
+# request while ADMIN_TOKEN is unset, since they can swap the served model or profile the worker
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+def require_admin_token(x_admin_token):
+    """403 unless ``x_admin_token`` is the server's ADMIN_TOKEN."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are off (set ADMIN_TOKEN)")
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+# On-demand sampling profiler behind POST /admin/profile, off unless PROFILER=1 and ADMIN_TOKEN is set.
+# Nothing is sampled and no thread runs between captures; a capture lasts at most PROFILE_MAX_SECONDS.
+profiler = None
+if os.environ.get("PROFILER", "0") == "1":
+    if ADMIN_TOKEN:
+        profiler = SamplingProfiler(max_seconds=float(os.environ.get("PROFILE_MAX_SECONDS", 60)))
+    else:
+        logger.warning("PROFILER=1 needs ADMIN_TOKEN; profiling is off")
+
+# Workers that have warmed up. Created before prefork.py forks, so it is shared by all workers;
+# WEB_CONCURRENCY is the number of workers that must warm up before /ready reports ready.
+ready_workers = ReadyWorkers(expected=int(os.environ.get("WEB_CONCURRENCY", 1)))
+
+# A house from data/future_unseen_examples.csv, scored by every endpoint before a worker serves traffic
+WARMUP_HOUSE = {
+    "bedrooms": 4, "bathrooms": 1.0, "sqft_living": 1680, "sqft_lot": 5043, "floors": 1.5,
+    "waterfront": 0, "view": 0, "condition": 4, "grade": 6, "sqft_above": 1680, "sqft_basement": 0,
+    "yr_built": 1911, "yr_renovated": 0, "zipcode": "98118", "lat": 47.5354, "long": -122.273,
+    "sqft_living15": 1560, "sqft_lot15": 5765,
+}
 
 class HouseFeatures(BaseModel):
     bedrooms: int
@@ -79,120 +328,474 @@ class BasicHouseFeatures(BaseModel):
     sqft_basement: int
     zipcode: str
 
+SALE_DATE_DEFAULTS = {"sale_year": DEFAULT_SALE_YEAR, "sale_month": DEFAULT_SALE_MONTH}
+# NDJSON bodies are scored in blocks of this many lines while the rest of the body is still arriving
+NDJSON_BLOCK_ROWS = int(os.environ.get("NDJSON_BLOCK_ROWS", 1000))
+
+def apply_sale_date_defaults(input_dict):
+    """Fill in sale_year/sale_month when the client did not provide them."""
+    if input_dict.get('sale_year') is None:
+        input_dict['sale_year'] = DEFAULT_SALE_YEAR
+    if input_dict.get('sale_month') is None:
+        input_dict['sale_month'] = DEFAULT_SALE_MONTH
+    return input_dict
+
+async def assemble_row(served, input_dict, offset):
+    """The model input row of one request.
+
+    Rows that need a neighborhood query (a few hundred microseconds) are
+    assembled in the thread pool so the event loop keeps serving other
+    connections. They get a fresh array rather than the thread's reused
+    buffer, which the thread may overwrite for another request before this
+    one has read it.
+    """
+    assembler = served.assembler
+    if assembler.geo is None:
+        return assembler.assemble(input_dict, offset)
+    out = np.empty((1, len(assembler.features)), dtype=assembler.dtype)
+    return await run_in_threadpool(assembler.assemble, input_dict, offset, out)
+
+async def predict_row(served, row):
+    """Prediction for one assembled row: from the cache, else through the model version's micro-batcher."""
+    key = (served.key, row.tobytes())
+    prediction = prediction_cache.get(key)
+    if prediction is None:
+        # The assembler hands out a reused buffer, so the batcher gets its own copy
+        prediction = await served.batcher.submit(row.copy(), current_deadline())
+        prediction_cache.put(key, prediction)
+    return prediction
+
 @app.on_event("startup")
 async def startup_event():
-    if model is None:
-        raise RuntimeError("Model 'model.pkl' not found.")
-    if model_features is None:
-        raise RuntimeError("Model features 'model_features.json' not found.")
-    if improved_model is None:
-        raise RuntimeError("Improved model 'model_improved.pkl' not found.")
-    if improved_model_features is None:
-        raise RuntimeError("Improved model features 'model_features_improved.json' not found.")
     if demographics is None:
         raise RuntimeError("Demographics data 'zipcode_demographics.csv' not found.")
+    if models.get("basic") is None:
+        raise RuntimeError("Basic model artifact or 'model.pkl' and 'model_features.json' not found.")
+    if models.get("improved") is None:
+        raise RuntimeError("Improved model artifact or 'model_improved.pkl' and 'model_features_improved.json' not found.")
+
+    # Run one prediction through each endpoint so the first real request does not pay for
+    # page-faulting the model arrays in, thread pool start-up or other first-call costs.
+    # The warm-up house is not live traffic, so the drift monitor does not see it.
+    if drift_monitor is not None:
+        drift_monitor.enabled = False
+    await predict(HouseFeatures(**WARMUP_HOUSE))
+    await predict_basic(BasicHouseFeatures(**WARMUP_HOUSE))
+    await predict_improved(HouseFeatures(**WARMUP_HOUSE))
+    if models["improved"].explainer is not None:
+        # Histogram GBM artifacts exported without split node values serve predictions but cannot be explained
+        await explain_improved(HouseFeatures(**WARMUP_HOUSE))
+    if drift_monitor is not None:
+        drift_monitor.enabled = True
+    ready_workers.add(os.getpid())
+    if MODEL_RELOAD_POLL_SECONDS > 0:
+        app.state.reload_watcher = asyncio.create_task(models.watch(ARTIFACTS_DIR, MODEL_RELOAD_POLL_SECONDS))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    watcher = getattr(app.state, "reload_watcher", None)
+    if watcher is not None:
+        watcher.cancel()
+    for served in models.models.values():
+        await served.batcher.stop()
 
 @app.post("/predict")
-def predict(features: HouseFeatures):
-    print("Predict endpoint called")
-    print(f"Input zipcode: {features.zipcode}")
-    print(f"Demographics zipcodes sample: {demographics['zipcode'].head().tolist()}")
-    print(f"98118 in demographics: {'98118' in demographics['zipcode'].values}")
-    print(f"98042 in demographics: {'98042' in demographics['zipcode'].values}")
-    # Convert input to DataFrame
+async def predict(features: HouseFeatures):
+    served = models["basic"]
     input_dict = features.dict()
-    # Set defaults for sale_year and sale_month if not provided
-    if input_dict['sale_year'] is None:
-        input_dict['sale_year'] = 2023  # Default year
-    if input_dict['sale_month'] is None:
-        input_dict['sale_month'] = 6  # Default month
-    input_df = pd.DataFrame([input_dict])
-    print(f"Input df: {input_df}")
-    print(f"Input df zipcode dtype: {input_df['zipcode'].dtype}")
-    print(f"Demographics zipcode dtype: {demographics['zipcode'].dtype}")
-
-    # Merge with demographics data
-    merged_df = pd.merge(input_df, demographics, on='zipcode', how='left')
-    print(f"Merged df shape: {merged_df.shape}")
-    print(f"Merged df nulls: {merged_df.isnull().sum()}")
-    print(f"Merged df: {merged_df}")
-
-    # Check if zipcode was found (only check demographics columns for nulls)
-    demographics_cols = [col for col in merged_df.columns if col != 'sale_year' and col != 'sale_month']
-    if merged_df[demographics_cols].isnull().values.any():
-        print(f"Debug: merged_df has null values in demographics columns")
-        print(f"Debug: input_df columns: {input_df.columns.tolist()}")
-        print(f"Debug: demographics columns: {demographics.columns.tolist()}")
+    apply_sale_date_defaults(input_dict)
+    if drift_monitor is not None:
+        drift_monitor.observe(input_dict)
+    mark("validation")
+    debug = log_request_detail()
+
+    # Look up demographics for the zipcode
+    offset = served.index.offset(features.zipcode)
+    if offset is None:
+        if debug:
+            logger.info("predict: zipcode %s not in demographics index (%d zipcodes)", features.zipcode, len(served.index))
         raise HTTPException(status_code=404, detail=f"Demographics not found for zipcode {features.zipcode}")
-
-    # Drop zipcode and select/reorder features
-    merged_df = merged_df.drop(columns=['zipcode'])
+    mark("demographics")
 
     try:
-        final_features = merged_df[model_features]
+        final_features = await assemble_row(served, input_dict, offset)
     except KeyError as e:
         raise HTTPException(status_code=400, detail=f"Missing feature in input or demographics data: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    mark("assembly")
+    if debug:
+        logger.info("predict: input %s, features %s", input_dict, final_features.tolist())
 
     # Make prediction
-    prediction = model.predict(final_features)
+    prediction = await predict_row(served, final_features)
+    mark("predict")
 
-    return {"prediction": prediction[0]}
+    return {"prediction": prediction, "model_version": served.version}
 
 @app.post("/predict_basic")
-def predict_basic(features: BasicHouseFeatures):
-    # Convert input to DataFrame
-    input_df = pd.DataFrame([features.dict()])
-
-    # Merge with demographics data
-    merged_df = pd.merge(input_df, demographics, on='zipcode', how='left')
+async def predict_basic(features: BasicHouseFeatures):
+    served = models["basic"]
+    input_dict = features.dict()
+    if drift_monitor is not None:
+        drift_monitor.observe(input_dict)
+    mark("validation")
 
-    # Check if zipcode was found
-    if merged_df.isnull().values.any():
+    # Look up demographics for the zipcode
+    offset = served.index.offset(features.zipcode)
+    if offset is None:
         raise HTTPException(status_code=404, detail=f"Demographics not found for zipcode {features.zipcode}")
-
-    # Drop zipcode and select/reorder features
-    merged_df = merged_df.drop(columns=['zipcode'])
+    mark("demographics")
 
     try:
-        final_features = merged_df[model_features]
+        final_features = await assemble_row(served, input_dict, offset)
     except KeyError as e:
         raise HTTPException(status_code=400, detail=f"Missing feature in input or demographics data: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    mark("assembly")
+    if log_request_detail():
+        logger.info("predict_basic: input %s, features %s", input_dict, final_features.tolist())
 
     # Make prediction using basic model
-    prediction = model.predict(final_features)
+    prediction = await predict_row(served, final_features)
+    mark("predict")
 
-    return {"prediction": prediction[0], "model": "basic"}
+    return {"prediction": prediction, "model": "basic", "model_version": served.version}
 
 @app.post("/predict_improved")
-def predict_improved(features: HouseFeatures):
-    # Convert input to DataFrame
+async def predict_improved(features: HouseFeatures):
+    served = models["improved"]
     input_dict = features.dict()
-    # Set defaults for sale_year and sale_month if not provided
-    if input_dict['sale_year'] is None:
-        input_dict['sale_year'] = 2023  # Default year
-    if input_dict['sale_month'] is None:
-        input_dict['sale_month'] = 6  # Default month
-    input_df = pd.DataFrame([input_dict])
-
-    # Merge with demographics data
-    merged_df = pd.merge(input_df, demographics, on='zipcode', how='left')
-
-    # Check if zipcode was found
-    if merged_df.isnull().values.any():
+    apply_sale_date_defaults(input_dict)
+    if drift_monitor is not None:
+        drift_monitor.observe(input_dict)
+    mark("validation")
+
+    # Look up demographics for the zipcode
+    offset = served.index.offset(features.zipcode)
+    if offset is None:
         raise HTTPException(status_code=404, detail=f"Demographics not found for zipcode {features.zipcode}")
-
-    # Drop zipcode and select/reorder features
-    merged_df = merged_df.drop(columns=['zipcode'])
+    mark("demographics")
 
     try:
-        final_features = merged_df[improved_model_features]
+        final_features = await assemble_row(served, input_dict, offset)
     except KeyError as e:
         raise HTTPException(status_code=400, detail=f"Missing feature in input or demographics data: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    mark("assembly")
+    if log_request_detail():
+        logger.info("predict_improved: input %s, features %s", input_dict, final_features.tolist())
 
     # Make prediction using improved model
-    prediction = improved_model.predict(final_features)
+    prediction = await predict_row(served, final_features)
+    mark("predict")
+
+    return {"prediction": prediction, "model": "improved", "model_version": served.version}
+
+@app.post("/explain_improved")
+async def explain_improved(features: HouseFeatures):
+    """Improved model prediction with the contribution of every model feature to it.
+
+    ``prediction`` equals ``bias`` plus the sum of ``contributions`` (see explanations.py).
+    """
+    served = models["improved"]
+    if served.explainer is None:
+        raise HTTPException(status_code=501, detail=f"Improved model v{served.version} cannot be explained; re-export it")
+    input_dict = features.dict()
+    apply_sale_date_defaults(input_dict)
+    mark("validation")
 
-    return {"prediction": prediction[0], "model": "improved"}
+    offset = served.index.offset(features.zipcode)
+    if offset is None:
+        raise HTTPException(status_code=404, detail=f"Demographics not found for zipcode {features.zipcode}")
+    mark("demographics")
+
+    try:
+        final_features = await assemble_row(served, input_dict, offset)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Missing feature in input or demographics data: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    mark("assembly")
+
+    # One traversal of the trees, a small multiple of a prediction, so it is not micro-batched. It runs in
+    # the thread pool with its own copy of the row, as the loop's reused buffer may be refilled meanwhile
+    check_deadline()
+    predictions, contributions = await run_in_threadpool(served.explainer.explain, final_features.copy())
+    mark("predict")
+
+    return {"prediction": float(predictions[0]), "bias": served.explainer.bias,
+            "contributions": dict(zip(served.assembler.features, contributions[0].tolist())),
+            "model": "improved", "model_version": served.version}
+
+def score_batch(served, zipcodes, assemble, explain=False):
+    """Predictions (NaN where the zipcode has no demographics), per-row errors and contributions for one batch.
+
+    ``assemble(found, offsets)`` builds the feature matrix of the rows whose zipcode is known.
+    With ``explain`` the model's explainer also gives each row's feature
+    contributions, else they are None.
+    """
+    predictions = np.full(len(zipcodes), np.nan)
+    contributions = np.full((len(zipcodes), len(served.assembler.features)), np.nan) if explain else None
+    offsets = served.index.offsets_for(zipcodes)
+    found = offsets >= 0
+    mark("demographics")
+    errors = [{"index": int(index), "detail": f"Demographics not found for zipcode {zipcodes[index]}"}
+              for index in (~found).nonzero()[0]]
+    if found.any():
+        try:
+            final_features = assemble(found, offsets[found])
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=f"Missing feature in input or demographics data: {e}")
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        mark("assembly")
+        check_deadline()
+        if explain:
+            predictions[found], contributions[found] = served.explainer.explain(final_features)
+        else:
+            predictions[found] = prediction_cache.predict(served.key, served.predictor, final_features)
+        mark("predict")
+    return predictions, errors, contributions
+
+def score_rows(served, feature_cls, houses, explain=False):
+    """Score a JSON array of house objects, validating each one with ``feature_cls``."""
+    if not isinstance(houses, list) or not all(isinstance(house, dict) for house in houses):
+        raise HTTPException(status_code=422, detail="Expected an array of house objects or an object of arrays")
+    input_rows = []
+    for index, house in enumerate(houses):
+        try:
+            input_rows.append(apply_sale_date_defaults(feature_cls(**house).dict()))
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail={"index": index, "errors": json.loads(e.json())})
+    if drift_monitor is not None:
+        for input_dict in input_rows:
+            drift_monitor.observe(input_dict)
+    mark("validation")
+    return score_batch(served, [input_dict['zipcode'] for input_dict in input_rows],
+                       lambda found, offsets: served.assembler.assemble_batch([input_rows[index] for index in found.nonzero()[0]], offsets),
+                       explain)
+
+def score_columns(served, feature_cls, body, content_type, explain=False):
+    """Score a columnar body: decoded and validated one field at a time, never one house at a time.
+
+    A JSON ``body`` is the already parsed object.
+    """
+    try:
+        columns, rows = validate_columns(decode_columns(body, content_type), field_specs(feature_cls), SALE_DATE_DEFAULTS)
+    except WireFormatError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    mark("validation")
+    predictions, errors, contributions = score_batch(
+        served, columns['zipcode'],
+        lambda found, offsets: served.assembler.assemble_columns({name: values[found] for name, values in columns.items()}, offsets),
+        explain)
+    if drift_monitor is not None:
+        # The only per-row errors of score_batch are unknown zipcodes
+        drift_monitor.observe_columns(columns, rows, len(errors))
+    return predictions, errors, contributions
+
+def score_ndjson_block(served, feature_cls, block, start):
+    """NDJSON result lines for one block of input lines.
+
+    A block that fails to decode or validate is scored again line by line, so
+    only its bad lines fail and the others are still scored.
+    """
+    try:
+        predictions, errors, _ = score_columns(served, feature_cls, block, NDJSON)
+    except HTTPException:
+        lines = block.split(b"\n")
+        predictions = np.full(len(lines), np.nan)
+        errors = []
+        for index, line in enumerate(lines):
+            try:
+                line_predictions, line_errors, _ = score_columns(served, feature_cls, line, NDJSON)
+            except HTTPException as e:
+                errors.append({"index": index, "detail": e.detail})
+                continue
+            predictions[index] = line_predictions[0]
+            errors.extend({"index": index, "detail": error["detail"]} for error in line_errors)
+    return ndjson_lines(predictions, errors, start)
+
+class RequestStreamingResponse(StreamingResponse):
+    """StreamingResponse whose body is produced while the request body is still being read.
+
+    StreamingResponse normally watches ``receive`` for a client disconnect,
+    which would swallow the request body chunks; reading the request stream
+    raises ClientDisconnect on its own.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+async def stream_ndjson(served, feature_cls, chunks):
+    start = 0
+    async for block in ndjson_blocks(chunks, NDJSON_BLOCK_ROWS):
+        yield await run_in_threadpool(score_ndjson_block, served, feature_cls, block, start)
+        start += block.count(b"\n") + 1
+
+BATCH_BODY = {"required": True, "content": {
+    JSON: {"schema": {"oneOf": [{"type": "array", "items": {"type": "object"}},
+                                {"type": "object", "additionalProperties": {"type": "array"}}]}},
+    NDJSON: {"schema": {"type": "string"}}, NPY: {"schema": {"type": "string", "format": "binary"}},
+    ARROW: {"schema": {"type": "string", "format": "binary"}},
+}}
+
+@app.post("/predict_batch", openapi_extra={"requestBody": BATCH_BODY})
+async def predict_batch(request: Request, model_name: Literal["basic", "improved"] = Query("basic", alias="model"),
+                        explain: bool = False):
+    """Score many houses with one demographics lookup pass and one model.predict call.
+
+    The body is a JSON array of houses, columnar JSON, NDJSON, a NumPy record
+    array or an Arrow stream (see wire_formats.py), chosen by Content-Type; the
+    response format follows Accept. Rows whose zipcode has no demographics get
+    a null (NaN) prediction and an entry in ``errors`` instead of failing the
+    whole batch. With ``explain=true`` (improved model, JSON response) every
+    row also gets its feature contributions, as from /explain_improved.
+    """
+    served = models[model_name]
+    feature_cls = HouseFeatures if model_name == "improved" else BasicHouseFeatures
+    content_type = media_type(request.headers.get("content-type"))
+    meta = {"model": model_name, "model_version": served.version}
+    if explain:
+        if served.explainer is None:
+            raise HTTPException(status_code=400, detail=f"The {model_name} model v{served.version} cannot be explained")
+        if content_type == NDJSON or negotiate(request.headers.get("accept")) != JSON:
+            raise HTTPException(status_code=406, detail="Explanations are only returned in a JSON response to a non-streaming body")
+
+    if content_type == NDJSON:
+        # Scored block by block while the body is still arriving; the whole stream uses one model version
+        headers = {f"X-{key.title().replace('_', '-')}": str(value) for key, value in meta.items()}
+        return RequestStreamingResponse(stream_ndjson(served, feature_cls, request.stream()), media_type=NDJSON, headers=headers)
+    if content_type not in (JSON, NPY, ARROW):
+        raise HTTPException(status_code=415, detail=f"Unsupported content type {content_type}")
+
+    body = await request.body()
+    if content_type == JSON:
+        try:
+            houses = json.loads(body)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Invalid JSON: {e}")
+        if isinstance(houses, dict):
+            predictions, errors, contributions = await run_in_threadpool(score_columns, served, feature_cls, houses, JSON, explain)
+        else:
+            predictions, errors, contributions = await run_in_threadpool(score_rows, served, feature_cls, houses, explain)
+    else:
+        predictions, errors, contributions = await run_in_threadpool(score_columns, served, feature_cls, body, content_type, explain)
+    if log_request_detail():
+        logger.info("predict_batch: %d rows, %d errors, model %s, %s", len(predictions), len(errors), model_name, content_type)
+
+    accept = negotiate(request.headers.get("accept"))
+    if accept != JSON:
+        content, response_type, headers = encode_predictions(predictions, errors, accept, meta)
+        return Response(content, media_type=response_type, headers=headers)
+    result = {"predictions": [None if np.isnan(prediction) else prediction for prediction in predictions.tolist()],
+              "errors": errors, **meta}
+    if explain:
+        result.update({"bias": served.explainer.bias, "features": served.assembler.features,
+                       "contributions": [None if np.isnan(prediction) else row
+                                         for prediction, row in zip(predictions.tolist(), contributions.tolist())]})
+    return result
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Prediction cache hit/miss/eviction counters, for sizing PREDICTION_CACHE_SIZE."""
+    return prediction_cache.stats()
+
+@app.get("/batching/stats")
+def batching_stats():
+    """Micro-batcher queue depth and batch-size histogram per model."""
+    return {name: served.batcher.stats() for name, served in models.models.items()}
+
+@app.get("/admission/stats")
+def admission_stats():
+    """Per-model admission limits, slots in use, requests waiting and outcome counts of this worker."""
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+@app.get("/models")
+def model_versions():
+    """The version of each model this worker is serving, and reload counters."""
+    return {"models": {name: served.describe() for name, served in models.models.items()},
+            "reloads": models.reloads, "rejected": models.rejected}
+
+@app.post("/admin/reload")
+async def reload_model(model_name: Literal["basic", "improved"] = Query(..., alias="model"),
+                       version: Optional[int] = None, force: bool = False,
+                       x_admin_token: Optional[str] = Header(None)):
+    """Load ``version`` (default: LATEST) of a model, warm and check it, and swap it in.
+
+    Only the worker that receives the request reloads; under prefork.py use
+    MODEL_RELOAD_POLL_SECONDS so every worker follows the LATEST pointer.
+    """
+    require_admin_token(x_admin_token)
+    try:
+        return await models.reload(model_name, version, force)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except (ReloadError, ArtifactError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+if profiler is not None:
+    # Thread pool and executor stacks carry no route; these functions tell whose work they are
+    profiler.labels.update({code: "/predict_batch" for code in (score_rows.__code__, score_columns.__code__,
+                                                                score_ndjson_block.__code__, score_batch.__code__)})
+    profiler.labels.update({NeighborIndex.predict.__code__: "(micro-batch basic)",
+                            CompiledEnsemble.predict.__code__: "(micro-batch improved)"})
+
+@app.post("/admin/profile")
+async def profile(seconds: float = Query(10, gt=0), requests: int = Query(0, ge=0),
+                  interval_ms: float = Query(5, gt=0), output: Literal["collapsed", "svg", "json"] = Query("collapsed", alias="format"),
+                  x_admin_token: Optional[str] = Header(None)):
+    """Sample this worker's stacks for ``seconds``, or until ``requests`` prediction requests finish.
+
+    Returns collapsed stacks rooted at the route of each sample (for
+    flamegraph.pl or speedscope), an SVG flame graph, or a per-route summary
+    of the hottest functions. Under prefork.py only the worker that receives
+    the request is profiled.
+    """
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling is off (set PROFILER=1 and ADMIN_TOKEN)")
+    require_admin_token(x_admin_token)
+    try:
+        result = await profiler.capture(seconds, requests, interval_ms / 1000)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if output == "svg":
+        return Response(result.svg(title=f"Profile of worker {os.getpid()}"), media_type="image/svg+xml")
+    if output == "json":
+        return result.summary()
+    return PlainTextResponse(result.collapsed())
+
+@app.get("/drift")
+def drift():
+    """Drift of live request features from the training data: PSI and mean shift per feature, unknown zipcode rate."""
+    if drift_monitor is None:
+        raise HTTPException(status_code=404, detail="Drift monitoring is off (DRIFT_MONITOR=0 or no 'profile' artifact)")
+    return drift_monitor.report()
+
+@app.post("/drift/reset")
+def reset_drift(x_admin_token: Optional[str] = Header(None)):
+    """Clear the drift sketches of all workers to start a new observation window."""
+    require_admin_token(x_admin_token)
+    if drift_monitor is None:
+        raise HTTPException(status_code=404, detail="Drift monitoring is off (DRIFT_MONITOR=0 or no 'profile' artifact)")
+    drift_monitor.reset()
+    return {"reset": True}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Request and per-stage latency histograms in Prometheus text format."""
+    return PlainTextResponse(render([request_seconds, stage_seconds, requests_total, admission_total]),
+                             media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 200 once this worker and all WEB_CONCURRENCY workers have warmed up, else 503."""
+    status = {"ready": os.getpid() in ready_workers and ready_workers.all_ready,
+              "warm_workers": len(ready_workers), "expected_workers": ready_workers.expected}
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,144 @@
+import multiprocessing
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from itertools import product
+
+# Latency buckets in seconds: the hot path stages take tens of microseconds, whole requests milliseconds
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def _format_labels(labelnames, labels, extra=()):
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class _SharedMetric:
+    """Values for a fixed set of label combinations, kept in shared memory.
+
+    The memory is allocated when the metric is created, so metrics created at
+    import time in the parent of prefork.py are shared by every worker and any
+    worker's /metrics reports the totals of all of them.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames, labelvalues, width):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {tuple(labels): i for i, labels in enumerate(product(*labelvalues))}
+        self._width = width
+        self._values = multiprocessing.RawArray('d', len(self._series) * width)
+        self._lock = multiprocessing.Lock()
+
+    def _offset(self, labels):
+        """Start of the series for ``labels``, or None for a combination that is not tracked."""
+        i = self._series.get(labels)
+        return None if i is None else i * self._width
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_SharedMetric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), labelvalues=()):
+        super().__init__(name, documentation, labelnames, labelvalues, 1)
+
+    def inc(self, labels=(), amount=1):
+        offset = self._offset(labels)
+        if offset is not None:
+            with self._lock:
+                self._values[offset] += amount
+
+    def value(self, labels=()):
+        return self._values[self._offset(labels)]
+
+    def render(self):
+        lines = self._header()
+        for labels, i in self._series.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(self._values[i])}")
+        return lines
+
+class Histogram(_SharedMetric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), labelvalues=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # Per series: one (non-cumulative) count per bucket, one for +Inf, then the sum
+        super().__init__(name, documentation, labelnames, labelvalues, len(self.buckets) + 2)
+
+    def observe(self, labels, value):
+        offset = self._offset(labels)
+        if offset is not None:
+            bucket = bisect_left(self.buckets, value)
+            with self._lock:
+                self._values[offset + bucket] += 1
+                self._values[offset + len(self.buckets) + 1] += value
+
+    def count(self, labels=()):
+        offset = self._offset(labels)
+        return sum(self._values[offset:offset + len(self.buckets) + 1])
+
+    def render(self):
+        lines = self._header()
+        for labels in self._series:
+            offset = self._offset(labels)
+            with self._lock:
+                values = self._values[offset:offset + self._width]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', le)])} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {repr(values[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {_format_value(cumulative)}")
+        return lines
+
+def render(metrics):
+    """Prometheus text exposition format (version 0.0.4) for ``metrics``."""
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class StageTimer:
+    """Splits one request's wall time into consecutive stages.
+
+    Each ``mark(stage)`` records the time since the previous mark (or since
+    the request started) as that stage's duration.
+    """
+
+    def __init__(self, histogram, route, clock=time.perf_counter):
+        self.histogram = histogram
+        self.route = route
+        self.clock = clock
+        self.start = self.last = clock()
+
+    def mark(self, stage):
+        now = self.clock()
+        self.histogram.observe((self.route, stage), now - self.last)
+        self.last = now
+
+    def elapsed(self):
+        return self.clock() - self.start
+
+_current_timer = ContextVar("stage_timer", default=None)
+
+def start_timer(histogram, route):
+    """Start timing a request; ``mark`` calls in the same context record into it."""
+    timer = StageTimer(histogram, route)
+    return timer, _current_timer.set(timer)
+
+def stop_timer(token):
+    _current_timer.reset(token)
+
+def mark(stage):
+    """Record ``stage`` for the request being timed in this context, if any."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.mark(stage)
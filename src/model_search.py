@@ -0,0 +1,117 @@
+"""Parallel hyperparameter search over model families.
+
+Every candidate of the search space is fitted on the same training split in
+its own worker process (all cores by default) and scored on a held-out
+validation split; the boosting families stop adding trees once the
+validation loss stops improving. The winner is refitted on the full
+training set, scored on the test set, and a report with the fit time and
+accuracy of every candidate is written next to the model.
+"""
+import json, os, time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import ParameterGrid, train_test_split
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import RobustScaler
+
+# Early stopping for the boosting families: stop after 10 iterations without improvement on
+# an internal 10% validation split, so n_estimators/max_iter are upper bounds
+EARLY_STOPPING = {"n_iter_no_change": 10, "validation_fraction": 0.1}
+
+FAMILIES = {
+    # The basic model must stay a scaled uniform KNN so it can be served from a NeighborIndex
+    "knn": lambda **params: make_pipeline(RobustScaler(), KNeighborsRegressor(**params)),
+    "gbr": lambda **params: GradientBoostingRegressor(random_state=42, **EARLY_STOPPING, **params),
+    # Histogram GBM bins features once and fits many times faster on large data
+    "hgb": lambda **params: HistGradientBoostingRegressor(random_state=42, early_stopping=True, **EARLY_STOPPING, **params),
+}
+
+SEARCH_SPACE = {
+    # NeighborIndex ranks neighbors by euclidean distance (and refuses other metrics), so only the neighbor count is searched
+    "knn": {"n_neighbors": [3, 5, 8, 10, 15, 20, 30]},
+    "gbr": {"n_estimators": [1000], "learning_rate": [0.05, 0.1], "max_depth": [4, 5, 6], "subsample": [0.8, 1.0]},
+    "hgb": {"max_iter": [2000], "learning_rate": [0.05, 0.1], "max_leaf_nodes": [15, 31, 63],
+            "min_samples_leaf": [10, 20], "l2_regularization": [0.0, 1.0]},
+}
+
+def load_search_space(path):
+    """Search space from a JSON file shaped like SEARCH_SPACE: {family: {param: [values]}}."""
+    with open(path, "r") as f:
+        return json.load(f)
+
+def candidates(families, space=SEARCH_SPACE):
+    """(family, params) for every grid point of ``families``."""
+    return [(family, params) for family in families for params in ParameterGrid(space[family])]
+
+def _iterations(model):
+    """Trees actually fitted by a boosting model after early stopping, else None."""
+    if hasattr(model, "n_iter_"):
+        return int(model.n_iter_)
+    if hasattr(model, "n_estimators_"):
+        return int(model.n_estimators_)
+    return None
+
+def fit_candidate(family, params, X_train, y_train, X_val, y_val):
+    """Fit one candidate and return its timing and validation accuracy."""
+    start = time.perf_counter()
+    model = FAMILIES[family](**params).fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    y_pred = model.predict(X_val)
+    return {
+        "family": family,
+        "params": params,
+        "fit_seconds": fit_seconds,
+        "iterations": _iterations(model),
+        "r2": float(r2_score(y_val, y_pred)),
+        "mae": float(mean_absolute_error(y_val, y_pred)),
+    }
+
+def search(families, X, y, space=SEARCH_SPACE, n_jobs=-1, validation_size=0.2):
+    """Score every candidate on a validation split of (X, y), best (lowest MAE) first."""
+    X_fit, X_val, y_fit, y_val = train_test_split(X, y, test_size=validation_size, random_state=42)
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(fit_candidate)(family, params, X_fit, y_fit, X_val, y_val)
+        for family, params in candidates(families, space)
+    )
+    return sorted(results, key=lambda result: result["mae"])
+
+def print_results(results):
+    print(f"{'family':6s} {'val MAE':>12s} {'val R2':>7s} {'fit s':>7s} {'iters':>6s}  params")
+    for result in results:
+        iterations = "" if result["iterations"] is None else result["iterations"]
+        print(f"{result['family']:6s} ${result['mae']:>11,.0f} {result['r2']:7.4f} {result['fit_seconds']:7.2f} "
+              f"{iterations:>6}  {result['params']}")
+
+def run_search(families, X_train, y_train, X_test, y_test, report_path, space=SEARCH_SPACE, n_jobs=-1):
+    """Search, refit the winner on the full training set and write the report; returns the winning model."""
+    start = time.perf_counter()
+    results = search(families, X_train, y_train, space, n_jobs)
+    search_seconds = time.perf_counter() - start
+    print_results(results)
+
+    best = results[0]
+    start = time.perf_counter()
+    model = FAMILIES[best["family"]](**best["params"]).fit(X_train, y_train)
+    refit_seconds = time.perf_counter() - start
+    y_pred = model.predict(X_test)
+    test = {"r2": float(r2_score(y_test, y_pred)), "mae": float(mean_absolute_error(y_test, y_pred))}
+    print(f"Winner: {best['family']} {best['params']}\nTest R2: {test['r2']:.4f}\nTest MAE: ${test['mae']:,.2f}")
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "n_jobs": n_jobs,
+        "cpu_count": os.cpu_count(),
+        "train_rows": len(X_train),
+        "test_rows": len(X_test),
+        "search_seconds": search_seconds,
+        "candidates": results,
+        "winner": {"family": best["family"], "params": best["params"], "iterations": _iterations(model),
+                   "refit_seconds": refit_seconds, "test": test},
+    }
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2, default=lambda value: value.item() if isinstance(value, np.generic) else str(value))
+    return model
@@ -0,0 +1,278 @@
+import numpy as np
+import sklearn
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import DistanceMetric
+from sklearn.neighbors import BallTree, KDTree, NearestNeighbors
+
+TREE_TYPES = {'kd_tree': KDTree, 'ball_tree': BallTree}
+TREE_STATE_ARRAYS = ('tree_idx_array', 'tree_node_data', 'tree_node_bounds')
+CLUSTER_ARRAYS = ('centroids', 'cluster_order', 'cluster_offsets')
+# From this many query rows on, one blocked brute-force pass beats per-row tree descents, but only on
+# indexes of at most BRUTE_FORCE_MAX_POINTS points: the pass costs time linear in the points, the tree does not
+BRUTE_FORCE_MIN_ROWS = 16
+BRUTE_FORCE_MAX_POINTS = 100_000
+# Extra candidates fetched so that neighbors tied on distance are resolved the same way by every search path
+TIE_CANDIDATES = 5
+
+def tree_arrays(tree):
+    """Internal node arrays and scalars of a fitted KDTree/BallTree, for storing it in an artifact."""
+    state = tree.__getstate__()
+    return dict(zip(TREE_STATE_ARRAYS, state[1:4])), [int(value) for value in state[4:11]]
+
+def restore_tree(tree_cls, points, artifact, leaf_size, metric):
+    """The tree stored by ``tree_arrays`` around ``points``, rebuilt only if sklearn's version changed."""
+    meta = artifact.meta
+    if meta.get('sklearn_version') == sklearn.__version__:
+        # Restore the prebuilt tree in place; the binary tree keeps views of the mapped arrays
+        tree = tree_cls.__new__(tree_cls)
+        tree.__setstate__((points, *(artifact[key] for key in TREE_STATE_ARRAYS), *meta['tree_scalars'],
+                           DistanceMetric.get_metric(metric), None))
+        return tree
+    # The pickled tree layout is private to sklearn, so rebuild when versions differ
+    return tree_cls(points, leaf_size=leaf_size, metric=metric)
+
+class NeighborIndex:
+    """Prebuilt neighbor search for the basic RobustScaler + KNeighborsRegressor model.
+
+    Holds the scaled training matrix, its targets and a KD-tree/ball-tree built
+    once at training time, so serving never refits or brute-forces the whole
+    matrix. Exact queries return the same neighbors as the pipeline (up to ties
+    in distance).
+
+    On indexes of up to ``BRUTE_FORCE_MAX_POINTS`` points, batches of
+    ``BRUTE_FORCE_MIN_ROWS`` or more rows are answered with sklearn's blocked
+    brute-force search over the same points instead, which is several times
+    faster per row than walking the tree for each one. Larger indexes always
+    use the tree, since a brute-force pass grows with every training row.
+    Every path re-ranks its candidates by (distance, training row), so ties
+    are broken identically and a row's prediction does not depend on which
+    batch it arrived in.
+
+    Optionally the training points are also partitioned into k-means clusters
+    (an inverted file). Approximate queries only scan the ``n_probe`` clusters
+    whose centroids are closest to the query; raising ``n_probe`` trades
+    latency for recall, and ``n_probe == n_clusters`` is exact. Whether plain
+    ``predict`` calls search approximately is set by ``approximate``.
+
+    Rows can be added later with ``append`` without refitting the scaler or
+    rebuilding the tree: they go after the first ``tree_rows`` points, which
+    the tree covers. Exact queries that use the tree also take the nearest
+    appended rows from a blocked brute-force pass over just those rows, and
+    batches and approximate queries see them like any other point. That pass
+    grows with the appended rows, so ``compact``, which folds them into a
+    rebuilt tree, is due once they pass a few thousand (see update_models).
+    """
+
+    def __init__(self, center, scale, points, targets, tree, n_neighbors=5, metric='euclidean', leaf_size=40,
+                 centroids=None, cluster_order=None, cluster_offsets=None, n_probe=8, approximate=False, tree_rows=None):
+        self.center = center
+        self.scale = scale
+        self.points = points
+        self.targets = targets
+        self.tree = tree
+        self.n_neighbors = n_neighbors
+        self.metric = metric
+        self.leaf_size = leaf_size
+        self.centroids = centroids
+        self.cluster_order = cluster_order
+        self.cluster_offsets = cluster_offsets
+        self.n_probe = n_probe
+        self.approximate = approximate
+        self.tree_rows = len(points) if tree_rows is None else int(tree_rows)
+
+    @classmethod
+    def from_pipeline(cls, model, x_train, y_train, algorithm='kd_tree', leaf_size=40, n_clusters=None, n_probe=8):
+        """Build the index from a fitted make_pipeline(RobustScaler(), KNeighborsRegressor())."""
+        scaler, knn = model[0], model[-1]
+        if knn.weights != 'uniform':
+            raise ValueError("NeighborIndex only supports uniform KNN weights")
+        if knn.effective_metric_ != 'euclidean':
+            # Every search path re-ranks its candidates by squared euclidean distance
+            raise ValueError(f"NeighborIndex only supports the euclidean metric, not {knn.effective_metric_!r}")
+        points = np.ascontiguousarray(scaler.transform(x_train), dtype=np.float64)
+        targets = np.asarray(y_train, dtype=np.float64)
+        index = cls(
+            center=np.array(scaler.center_, dtype=np.float64),
+            scale=np.array(scaler.scale_, dtype=np.float64),
+            points=points,
+            targets=targets,
+            tree=TREE_TYPES[algorithm](points, leaf_size=leaf_size, metric=knn.effective_metric_),
+            n_neighbors=knn.n_neighbors,
+            metric=knn.effective_metric_,
+            leaf_size=leaf_size,
+            n_probe=n_probe,
+        )
+        if n_clusters:
+            index.build_clusters(n_clusters)
+        return index
+
+    def to_artifact(self):
+        """Arrays and metadata for artifacts.write_artifact.
+
+        The tree is stored as its internal node arrays so loading it is a
+        memory map instead of a rebuild.
+        """
+        tree_state, tree_scalars = tree_arrays(self.tree)
+        arrays = {'center': self.center, 'scale': self.scale, 'points': self.points, 'targets': self.targets}
+        arrays.update(tree_state)
+        if self.centroids is not None:
+            arrays.update((key, getattr(self, key)) for key in CLUSTER_ARRAYS)
+        meta = {
+            'n_neighbors': int(self.n_neighbors),
+            'metric': self.metric,
+            'leaf_size': int(self.leaf_size),
+            'n_probe': int(self.n_probe),
+            'tree_type': next(key for key, cls in TREE_TYPES.items() if isinstance(self.tree, cls)),
+            'tree_scalars': tree_scalars,
+            'tree_rows': int(self.tree_rows),
+            'sklearn_version': sklearn.__version__,
+        }
+        return arrays, meta
+
+    @classmethod
+    def from_artifact(cls, artifact):
+        """Rebuild an index around the memory-mapped arrays of an artifact."""
+        meta = artifact.meta
+        points = artifact['points']
+        tree_rows = meta.get('tree_rows', len(points))
+        tree = restore_tree(TREE_TYPES[meta['tree_type']], points[:tree_rows], artifact, meta['leaf_size'], meta['metric'])
+        has_clusters = all(key in artifact.arrays for key in CLUSTER_ARRAYS)
+        return cls(
+            center=artifact['center'],
+            scale=artifact['scale'],
+            points=points,
+            targets=artifact['targets'],
+            tree=tree,
+            n_neighbors=meta['n_neighbors'],
+            metric=meta['metric'],
+            leaf_size=meta['leaf_size'],
+            n_probe=meta['n_probe'],
+            tree_rows=tree_rows,
+            **{key: artifact[key] if has_clusters else None for key in CLUSTER_ARRAYS},
+        )
+
+    def append(self, x, y):
+        """Add training rows ``x`` (unscaled) with targets ``y``, leaving the scaler, tree and centroids as they are.
+
+        Each new point joins the cluster of its nearest centroid. Costs a copy
+        of the arrays, not a refit; see ``compact`` for folding the appended
+        rows into the tree.
+        """
+        scaled = np.ascontiguousarray(self.transform(x))
+        if self.centroids is not None:
+            labels = np.empty(len(self.points), dtype=np.intp)
+            labels[self.cluster_order] = np.repeat(np.arange(self.n_clusters), np.diff(self.cluster_offsets))
+            new_labels = ((scaled[:, None, :] - self.centroids[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+            labels = np.concatenate([labels, new_labels])
+            # Stable, so every cluster keeps its rows in index order with the new ones last
+            self.cluster_order = np.argsort(labels, kind='stable').astype(np.intp)
+            self.cluster_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=self.n_clusters))]).astype(np.intp)
+        self.points = np.concatenate([self.points, scaled])
+        self.targets = np.concatenate([self.targets, np.asarray(y, dtype=np.float64)])
+        self._brute = self._appended_brute = None
+
+    @property
+    def appended_rows(self):
+        """Rows added by ``append`` that the tree does not cover yet."""
+        return len(self.points) - self.tree_rows
+
+    def compact(self):
+        """Rebuild the tree over every point, appended rows included."""
+        self.tree = type(self.tree)(self.points, leaf_size=self.leaf_size, metric=self.metric)
+        self.tree_rows = len(self.points)
+        self._appended_brute = None
+
+    def build_clusters(self, n_clusters, random_state=42):
+        """Partition the training points into ``n_clusters`` for approximate search."""
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state, n_init=3).fit(self.points)
+        labels = kmeans.labels_
+        self.centroids = np.ascontiguousarray(kmeans.cluster_centers_)
+        self.cluster_order = np.argsort(labels, kind='stable').astype(np.intp)
+        self.cluster_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_clusters))]).astype(np.intp)
+
+    @property
+    def n_clusters(self):
+        return 0 if self.centroids is None else len(self.centroids)
+
+    def transform(self, X):
+        """Apply the fitted RobustScaler (same arithmetic as RobustScaler.transform)."""
+        X = np.array(X, dtype=np.float64)
+        X -= self.center
+        X /= self.scale
+        return X
+
+    def kneighbors(self, X, approximate=None, n_probe=None):
+        """Indices into ``points`` of the nearest training rows, nearest first.
+
+        ``approximate`` and ``n_probe`` default to the index's own settings.
+        """
+        scaled = self.transform(X)
+        if approximate is None:
+            approximate = self.approximate
+        if approximate and self.centroids is not None:
+            return self._approximate_kneighbors(scaled, n_probe or self.n_probe)
+        return self._exact_kneighbors(scaled)
+
+    def _exact_kneighbors(self, scaled):
+        k = min(self.n_neighbors + TIE_CANDIDATES, len(self.points))
+        if len(scaled) >= BRUTE_FORCE_MIN_ROWS and len(self.points) <= BRUTE_FORCE_MAX_POINTS:
+            candidates = self._brute_force().kneighbors(scaled, n_neighbors=k, return_distance=False)
+        else:
+            candidates = self.tree.query(scaled, k=min(k, self.tree_rows), return_distance=False)
+            if self.appended_rows:
+                # Appended rows are not in the tree; their nearest join the candidates
+                appended = self._appended_brute_force().kneighbors(scaled, n_neighbors=min(k, self.appended_rows),
+                                                                  return_distance=False)
+                candidates = np.hstack([candidates, appended + self.tree_rows])
+        return self._nearest(scaled, candidates)
+
+    def _nearest(self, scaled, candidates):
+        """The n_neighbors closest of each row's candidates, ordered by (distance, training row)."""
+        distances = ((self.points[candidates] - scaled[:, None, :]) ** 2).sum(axis=2)
+        order = np.lexsort((candidates, distances), axis=1)[:, :self.n_neighbors]
+        return np.take_along_axis(candidates, order, axis=1)
+
+    def _brute_force(self):
+        # Fitting a brute-force searcher only wraps the (memory-mapped) points, it does not copy them
+        if getattr(self, '_brute', None) is None:
+            self._brute = NearestNeighbors(n_neighbors=self.n_neighbors, algorithm='brute', metric=self.metric).fit(self.points)
+        return self._brute
+
+    def _appended_brute_force(self):
+        if getattr(self, '_appended_brute', None) is None:
+            self._appended_brute = NearestNeighbors(algorithm='brute', metric=self.metric).fit(self.points[self.tree_rows:])
+        return self._appended_brute
+
+    def _approximate_kneighbors(self, scaled, n_probe):
+        n_probe = min(n_probe, self.n_clusters)
+        centroid_distances = ((scaled[:, None, :] - self.centroids[None, :, :]) ** 2).sum(axis=2)
+        probes = np.argpartition(centroid_distances, n_probe - 1, axis=1)[:, :n_probe]
+        neighbors = np.empty((len(scaled), self.n_neighbors), dtype=np.intp)
+        for row, (query, clusters) in enumerate(zip(scaled, probes)):
+            candidates = np.concatenate([
+                self.cluster_order[self.cluster_offsets[c]:self.cluster_offsets[c + 1]] for c in clusters
+            ])
+            if len(candidates) < self.n_neighbors:
+                # Too few points in the probed clusters; fall back to the exact search
+                neighbors[row] = self._exact_kneighbors(query[None, :])[0]
+                continue
+            distances = ((self.points[candidates] - query) ** 2).sum(axis=1)
+            nearest = np.lexsort((candidates, distances))[:self.n_neighbors]
+            neighbors[row] = candidates[nearest]
+        return neighbors
+
+    def predict(self, X, approximate=None, n_probe=None):
+        """Mean target of the nearest neighbors, like KNeighborsRegressor with uniform weights."""
+        return np.mean(self.targets[self.kneighbors(X, approximate, n_probe)], axis=1)
+
+    def recall(self, X, n_probe=None):
+        """Fraction of approximate neighbors that are as close as the exact k-th neighbor.
+
+        Measured on distances rather than indices so that ties are not counted as misses.
+        """
+        scaled = self.transform(X)
+        exact = self._exact_kneighbors(scaled)[:, -1]
+        kth_distance = np.sqrt(((self.points[exact] - scaled) ** 2).sum(axis=1))
+        approximate = self.kneighbors(X, approximate=True, n_probe=n_probe)
+        distances = np.sqrt(((self.points[approximate] - scaled[:, None, :]) ** 2).sum(axis=2))
+        return float(np.mean(distances <= kth_distance[:, None] + 1e-9))
@@ -0,0 +1,100 @@
+"""Building blocks for training on sales histories larger than memory.
+
+The training table is streamed in chunks (datasets.training_chunks) and
+never held whole:
+
+- ``RowSample`` keeps a uniform sample of bounded size across chunks, for
+  what needs a global view of the data (the neighborhood index, the drift
+  profile)
+- ``holdout_mask`` splits rows into train and test by a hash of the house
+  id, so every pass over the data agrees on the split without storing it
+  and all sales of one house fall on the same side
+- ``fit_chunks`` fits a HistGradientBoostingRegressor chunk by chunk with
+  warm start: each chunk adds ``trees_per_chunk`` boosting iterations, fit
+  to that chunk's residuals of the trees so far on features binned per chunk
+- ``StreamingMetrics`` accumulates R2 and MAE over chunks of predictions
+"""
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingRegressor
+
+HOLDOUT_SHARE = 0.2
+# Odd 64-bit constant (2**64 / golden ratio) for a multiplicative hash of the ids
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+def holdout_mask(ids, share=HOLDOUT_SHARE):
+    """True for the rows whose house id is in the held-out ``share`` of ids."""
+    hashed = np.asarray(ids).astype(np.uint64) * _HASH_MULTIPLIER
+    return (hashed >> np.uint64(11)).astype(np.float64) / 2.0 ** 53 < share
+
+class RowSample:
+    """Uniform sample of at most ``size`` rows of a stream of DataFrame chunks.
+
+    Every row gets a random key and the ``size`` rows with the smallest keys
+    are kept (bottom-k sampling), so memory is one chunk plus the sample.
+    """
+
+    def __init__(self, size, seed=42):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.rows = 0
+        self._frame = None
+        self._keys = np.empty(0)
+
+    def add(self, chunk):
+        self.rows += len(chunk)
+        keys = self.rng.random(len(chunk))
+        frame = chunk if self._frame is None else pd.concat([self._frame, chunk], ignore_index=True)
+        keys = np.concatenate([self._keys, keys])
+        if len(keys) > self.size:
+            keep = np.sort(np.argpartition(keys, self.size)[:self.size])
+            frame, keys = frame.iloc[keep], keys[keep]
+        self._frame, self._keys = frame.reset_index(drop=True), keys
+
+    @property
+    def frame(self):
+        return self._frame
+
+def chunk_model(trees_per_chunk=50, **params):
+    """Histogram GBM configured for fit_chunks: warm start, no internal validation split."""
+    params = {"learning_rate": 0.1, "max_leaf_nodes": 31, "random_state": 42, **params}
+    return HistGradientBoostingRegressor(max_iter=trees_per_chunk, warm_start=True, early_stopping=False, **params)
+
+def fit_chunks(model, chunks, trees_per_chunk=50):
+    """Fit ``model`` (see chunk_model) on (X, y) chunks, adding ``trees_per_chunk`` iterations per chunk.
+
+    Every chunk must have the columns of the first. Returns the model and the number of rows seen.
+    """
+    rows = 0
+    for i, (X, y) in enumerate(chunks):
+        model.max_iter = trees_per_chunk * (i + 1)
+        model.fit(X, y)
+        rows += len(X)
+    return model, rows
+
+class StreamingMetrics:
+    """R2 and MAE accumulated over chunks of (y_true, y_pred)."""
+
+    def __init__(self):
+        self.n = 0
+        self.abs_error = 0.0
+        self.squared_error = 0.0
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    def update(self, y_true, y_pred):
+        y_true = np.asarray(y_true, dtype=np.float64)
+        errors = y_true - np.asarray(y_pred, dtype=np.float64)
+        self.n += len(y_true)
+        self.abs_error += np.abs(errors).sum()
+        self.squared_error += (errors ** 2).sum()
+        self.total += y_true.sum()
+        self.total_squares += (y_true ** 2).sum()
+
+    @property
+    def mae(self):
+        return self.abs_error / self.n
+
+    @property
+    def r2(self):
+        return 1 - self.squared_error / (self.total_squares - self.total ** 2 / self.n)
@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+class PredictionCache:
+    """Bounded in-process LRU cache of predictions with an optional TTL.
+
+    Keys are ``(model_key, row bytes)``: the model identity/version plus the
+    fully assembled feature vector (after defaults and the demographics join),
+    so equivalent requests hit regardless of which endpoint or JSON spelling
+    they came from. ``maxsize=0`` disables caching. All operations take one
+    lock, which is cheap next to a model call.
+    """
+
+    def __init__(self, maxsize=10000, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Cached value for ``key`` or None, refreshing its LRU position."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = None if self.ttl is None else self.clock() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, model_key=None):
+        """Drop every entry, or only those of ``model_key`` (e.g. after a model reload)."""
+        with self._lock:
+            if model_key is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == model_key]:
+                    del self._entries[key]
+            self.invalidations += 1
+
+    def predict(self, model_key, predictor, X):
+        """``predictor.predict(X)`` that only computes rows not already cached."""
+        if self.maxsize <= 0:
+            return predictor.predict(X)
+        keys = [(model_key, row.tobytes()) for row in X]
+        predictions = np.empty(len(keys), dtype=np.float64)
+        missing = []
+        for i, key in enumerate(keys):
+            value = self.get(key)
+            if value is None:
+                missing.append(i)
+            else:
+                predictions[i] = value
+        if missing:
+            computed = predictor.predict(X[missing] if len(missing) < len(keys) else X)
+            predictions[missing] = computed
+            for i, value in zip(missing, computed):
+                self.put(keys[i], float(value))
+        return predictions
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,142 @@
+"""Serve the API from several worker processes that share one loaded copy of the models.
+
+The parent process imports ``main`` (loading the model artifacts and
+demographics), binds the listening socket and then forks the workers, so the
+read-only model memory is shared copy-on-write instead of being loaded once per
+worker. Each worker runs its own uvicorn event loop on the shared socket and
+warms up every prediction endpoint before it accepts connections.
+
+Workers are recycled gracefully: with ``--max-requests`` a worker stops
+accepting after that many requests (plus a random jitter, so they do not all
+restart at once), finishes what it is serving and is replaced by a fresh fork.
+SIGTERM/SIGINT shut every worker down gracefully.
+
+    python prefork.py --workers 4 --port 8000
+"""
+import argparse, multiprocessing, os, random, signal, socket, sys
+
+import uvicorn
+
+# Exit status of a worker whose application startup (model checks, warm-up) failed
+STARTUP_FAILED = 3
+
+class ReadyWorkers:
+    """Pids of the workers that have finished their warm-up, shared between forked processes.
+
+    Created before the fork, so every worker and the parent see the same
+    shared memory. ``all_ready`` latches once ``expected`` workers have warmed
+    up; a worker that is being recycled does not flip readiness back off, as
+    the others keep serving while its replacement warms up.
+    """
+
+    def __init__(self, expected=1, slots=256):
+        self.expected = expected
+        self._pids = multiprocessing.Array('q', max(slots, expected))
+        self._all_ready = multiprocessing.Value('b', 0)
+
+    def add(self, pid):
+        with self._pids.get_lock():
+            if pid not in self._pids[:]:
+                self._pids[self._pids[:].index(0)] = pid
+            if len(self) >= self.expected:
+                self._all_ready.value = 1
+
+    def discard(self, pid):
+        with self._pids.get_lock():
+            pids = self._pids[:]
+            if pid in pids:
+                self._pids[pids.index(pid)] = 0
+
+    def __contains__(self, pid):
+        return pid in self._pids[:]
+
+    def __len__(self):
+        return sum(1 for pid in self._pids[:] if pid)
+
+    @property
+    def all_ready(self):
+        return bool(self._all_ready.value)
+
+def _run_worker(app, sock, max_requests, graceful_timeout, log_level):
+    config = uvicorn.Config(app, limit_max_requests=max_requests, timeout_graceful_shutdown=graceful_timeout,
+                            log_level=log_level)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    return 0 if server.started else STARTUP_FAILED
+
+def serve(host="0.0.0.0", port=8000, workers=None, max_requests=None, max_requests_jitter=0,
+          graceful_timeout=30, log_level="info"):
+    """Load the app once, fork ``workers`` uvicorn workers and keep that many running until signalled."""
+    workers = workers or os.cpu_count()
+    # main sizes its readiness check from WEB_CONCURRENCY, so set it before the models are loaded
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    import main
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        limit = max_requests + random.randint(0, max_requests_jitter) if max_requests else None
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            status = 1
+            try:
+                status = _run_worker(main.app, sock, limit, graceful_timeout, log_level)
+            finally:
+                os._exit(status)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+    print(f"Serving on http://{host}:{port} with {workers} workers (parent pid {os.getpid()})", flush=True)
+
+    exit_code = 0
+    while children:
+        pid, status = os.wait()
+        children.discard(pid)
+        main.ready_workers.discard(pid)
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) == STARTUP_FAILED:
+            # A worker that cannot start will not start on retry either
+            print(f"Worker {pid} failed to start, shutting down", file=sys.stderr, flush=True)
+            exit_code = 1
+            stop(None, None)
+        elif not stopping:
+            spawn()
+    sock.close()
+    return exit_code
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API from preforked workers sharing the loaded models.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 0)) or None,
+                        help="worker processes (default: WEB_CONCURRENCY or all cores)")
+    parser.add_argument("--max-requests", type=int, default=int(os.environ.get("MAX_REQUESTS", 0)) or None,
+                        help="recycle a worker after this many requests (default: never)")
+    parser.add_argument("--max-requests-jitter", type=int, default=int(os.environ.get("MAX_REQUESTS_JITTER", 0)))
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="seconds a stopping worker gets to finish in-flight requests")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    sys.exit(serve(args.host, args.port, args.workers, args.max_requests, args.max_requests_jitter,
+                   args.graceful_timeout, args.log_level))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""On-demand sampling profiler for a live server, with samples attributed to routes.
+
+Nothing runs until a capture starts: no thread and no hooks. The routes only
+check ``profiler.active``. A capture starts a thread that every ``interval``
+seconds reads the Python stack of every other thread (sys._current_frames)
+and counts each distinct stack. It runs for ``seconds`` or until
+``requests`` routed requests have finished, whichever comes first.
+
+Each sample is attributed to a route:
+
+- on the event loop thread, by the asyncio task running when the sample is
+  taken. While a capture is active, routes register their task on entry
+  (``enter`` / ``exit``), so body validation, the handler and serialization
+  all count.
+- on other threads (the thread pool, the micro-batch executor), by the
+  outermost frame whose code is in ``labels``, e.g. the batch scoring
+  functions for /predict_batch.
+
+Stacks that match neither are only counted as unattributed: idle threads,
+and requests that started before the capture.
+
+A sample is a snapshot, not a trace. The task and the stacks are read a few
+instructions apart, and threads waiting for the GIL show up where they
+wait. Samples times interval is therefore wall time on a thread, not CPU
+time.
+
+``Profile.collapsed`` gives the usual collapsed stacks
+(``route;outer;...;inner count``), which flamegraph.pl or speedscope render
+with one tower per route. ``flame_graph_svg`` renders them directly.
+"""
+import asyncio, html, os, sys, threading, time, zlib
+from collections import Counter
+
+class ProfilerBusy(Exception):
+    """A capture is already running."""
+
+def frame_name(code):
+    """``function (file.py:line)`` for a code object; the line is the function's first, so samples aggregate per function."""
+    # co_qualname is new in Python 3.11
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class Profile:
+    """Collapsed stack counts of one capture, rooted at the route each sample was attributed to."""
+
+    def __init__(self, stacks, seconds, interval, requests, ticks, unattributed):
+        self.stacks = stacks
+        self.seconds = seconds
+        self.interval = interval
+        self.requests = requests
+        self.ticks = ticks
+        self.unattributed = unattributed
+
+    def collapsed(self):
+        """One ``route;outer frame;...;inner frame count`` line per distinct stack."""
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def summary(self, top=10):
+        """Samples per route and the functions with the most samples on top of the stack (self) and anywhere in it (total)."""
+        routes = {}
+        for stack, count in self.stacks.items():
+            route, *frames = stack.split(";")
+            entry = routes.setdefault(route, {"samples": 0, "self": Counter(), "total": Counter()})
+            entry["samples"] += count
+            if frames:
+                entry["self"][frames[-1]] += count
+                entry["total"].update(dict.fromkeys(set(frames), count))
+        return {
+            "seconds": self.seconds, "interval_ms": self.interval * 1000, "ticks": self.ticks,
+            "requests": self.requests, "unattributed_samples": self.unattributed,
+            "routes": {route: {"samples": entry["samples"],
+                               "self": dict(entry["self"].most_common(top)),
+                               "total": dict(entry["total"].most_common(top))}
+                       for route, entry in sorted(routes.items())},
+        }
+
+    def svg(self, **options):
+        return flame_graph_svg(self.stacks, **options)
+
+class SamplingProfiler:
+    """Samples the stacks of all threads for a while on request; idle otherwise.
+
+    ``labels`` maps code objects to the route that threads other than the
+    event loop are working for when that code is on their stack.
+    """
+
+    def __init__(self, labels=None, max_seconds=60.0, min_interval=0.001):
+        self.labels = dict(labels or {})
+        self.max_seconds = max_seconds
+        self.min_interval = min_interval
+        self.active = False
+        self.requests = 0
+        self._tasks = {}
+        self._request_limit = 0
+        self._done = None
+
+    def enter(self, route):
+        """Attribute the current asyncio task to ``route`` during a capture; returns the token for ``exit``."""
+        task = asyncio.current_task()
+        self._tasks[task] = route
+        return task
+
+    def exit(self, token):
+        if self._tasks.pop(token, None) is None:
+            # The capture ended while the request was running
+            return
+        self.requests += 1
+        if self._request_limit and self.requests >= self._request_limit:
+            self._done.set()
+
+    async def capture(self, seconds=10.0, requests=0, interval=0.005):
+        """Sample for ``seconds`` (at most max_seconds), or until ``requests`` routed requests finish if that is sooner.
+
+        Must be awaited on the event loop that serves the routes. Raises ProfilerBusy while another capture runs.
+        """
+        if self.active:
+            raise ProfilerBusy("A profile capture is already running")
+        seconds = min(seconds, self.max_seconds)
+        interval = max(interval, self.min_interval)
+        loop = asyncio.get_running_loop()
+        stacks, counts = Counter(), {"ticks": 0, "unattributed": 0}
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(loop, threading.get_ident(), interval, stop, stacks, counts),
+                                   name="sampling-profiler", daemon=True)
+        self.requests, self._request_limit, self._done = 0, requests, asyncio.Event()
+        self.active = True
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await asyncio.wait_for(self._done.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.active = False
+            self._tasks.clear()
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+        return Profile(dict(stacks), time.perf_counter() - start, interval, self.requests,
+                       counts["ticks"], counts["unattributed"])
+
+    def _sample(self, loop, loop_thread, interval, stop, stacks, counts):
+        own, names = threading.get_ident(), {}
+        while not stop.wait(interval):
+            frames = sys._current_frames()
+            loop_route = self._tasks.get(asyncio.current_task(loop))
+            counts["ticks"] += 1
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                route = loop_route if ident == loop_thread else None
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    if ident != loop_thread and code in self.labels:
+                        # Walking inner to outer, so the outermost labelled frame wins
+                        route = self.labels[code]
+                    name = names.get(code)
+                    if name is None:
+                        name = names[code] = frame_name(code).replace(";", ":")
+                    stack.append(name)
+                    frame = frame.f_back
+                if route is None:
+                    counts["unattributed"] += 1
+                    continue
+                stack.append(route)
+                stacks[";".join(reversed(stack))] += 1
+
+def flame_graph_svg(stacks, width=1200, row_height=16, min_width=0.5, title="Flame graph"):
+    """A self-contained SVG flame graph of collapsed ``stacks`` ({"a;b;c": count}), the root at the bottom.
+
+    Frames narrower than ``min_width`` pixels are left out; hovering a frame shows its samples.
+    """
+    root = [0, {}]
+    for stack, count in stacks.items():
+        node = root
+        node[0] += count
+        for name in stack.split(";"):
+            node = node[1].setdefault(name, [0, {}])
+            node[0] += count
+    total = root[0] or 1
+    scale = (width - 20) / total
+
+    def depth(node):
+        return 1 + max((depth(child) for child in node[1].values()), default=0)
+
+    levels = depth(root)
+    height = (levels + 2) * row_height
+    rects = []
+
+    def draw(name, node, x, level):
+        w = node[0] * scale
+        if w < min_width:
+            return
+        y = height - (level + 1) * row_height
+        # Warm colors, stable per function name
+        hue = zlib.crc32(name.encode()) % 60
+        label = html.escape(name)
+        text = html.escape(name[:int(w / 7)]) if w > 30 else ""
+        rects.append(f'<g><title>{label} ({node[0]} samples, {100 * node[0] / total:.1f}%)</title>'
+                     f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 1}" fill="hsl({hue},85%,60%)"/>'
+                     f'<text x="{x + 3:.1f}" y="{y + row_height - 4}">{text}</text></g>')
+        for child_name, child in sorted(node[1].items()):
+            draw(child_name, child, x, level + 1)
+            x += child[0] * scale
+
+    draw("all", root, 10, 0)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">'
+            f'<text x="10" y="{row_height}" font-size="14">{html.escape(title)}: {root[0]} samples</text>'
+            + "".join(rects) + "</svg>\n")
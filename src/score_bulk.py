@@ -0,0 +1,167 @@
+"""Stream a CSV of houses through the basic and/or improved model.
+
+The input is cut into byte ranges of about ``chunk_bytes`` that end on a line
+break, and each range is sent to a process pool as (start, end) offsets. The
+parent only seeks to the range boundaries; each worker reads and parses its
+own slice, so parsing scales with the workers too. This assumes one line per
+house, i.e. no quoted line breaks, as in kc_house_data.csv.
+
+Each worker memory-maps the model artifacts once at startup, so the workers
+share one copy of the models. Results are written in input order as each
+range completes, and only a bounded number of ranges is in flight, so memory
+use does not depend on the size of the file.
+
+Rows that cannot be scored get an empty prediction and a message in the
+model's ``error_<model>`` column, like the per-row errors of /predict_batch:
+unknown zipcodes, and missing or non-finite values.
+
+    python score_bulk.py data/future_unseen_examples.csv predictions.csv --workers 8
+"""
+import argparse, io, os, time
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from artifacts import ARTIFACTS_DIR, read_artifact
+from demographics import DemographicsIndex
+from geo_features import load_geo_index, uses_geo_features
+from inference import DEFAULT_SALE_MONTH, DEFAULT_SALE_YEAR, FeatureAssembler
+from neighbors import NeighborIndex
+from tree_ensemble import CompiledEnsemble
+
+DEMOGRAPHICS_PATH = os.path.join(os.path.dirname(__file__), "data", "zipcode_demographics.csv")
+MODELS = ("basic", "improved")
+
+_models = {}
+
+def load_models(names, artifacts_dir=ARTIFACTS_DIR, demographics_path=DEMOGRAPHICS_PATH):
+    """Predictor and feature assembler for each model name, served from its latest artifact."""
+    demographics = pd.read_csv(demographics_path, dtype={'zipcode': str})
+    models = {}
+    for name in names:
+        artifact = read_artifact(name, root=artifacts_dir)
+        features = artifact.meta['features']
+        geo_index = load_geo_index(artifact.meta, artifacts_dir) if uses_geo_features(features) else None
+        if name == "basic":
+            predictor, dtype = NeighborIndex.from_artifact(artifact), np.float64
+        else:
+            predictor = CompiledEnsemble.from_artifact(artifact)
+            dtype = predictor.dtype
+        models[name] = (predictor, FeatureAssembler(features, DemographicsIndex(demographics, features), dtype=dtype,
+                                                    geo_index=geo_index))
+    return models
+
+def _init_worker(names, artifacts_dir, demographics_path):
+    _models.update(load_models(names, artifacts_dir, demographics_path))
+
+def _not_finite(values):
+    return ~np.isfinite(pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64))
+
+def row_errors(chunk, assembler, offsets):
+    """Why each row of ``chunk`` cannot be scored by the assembler's model, None where it can."""
+    errors = pd.Series(None, index=chunk.index, dtype=object)
+    # Assigned from the least to the most important problem, so each row keeps the most important one
+    for field in reversed(assembler.payload_fields):
+        errors[_not_finite(chunk[field])] = f"Field {field!r} is missing or not finite"
+    if assembler.geo is not None:
+        errors[_not_finite(chunk['lat']) | _not_finite(chunk['long'])] = "lat and long must be finite"
+    unknown = offsets < 0
+    errors[unknown] = "Demographics not found for zipcode " + chunk['zipcode'][unknown].astype(str)
+    return errors
+
+def score_chunk(chunk):
+    """Predictions and per-row errors for one DataFrame chunk; rows with errors get NaN."""
+    if 'sale_year' not in chunk:
+        chunk['sale_year'] = DEFAULT_SALE_YEAR
+    if 'sale_month' not in chunk:
+        chunk['sale_month'] = DEFAULT_SALE_MONTH
+    zipcodes = chunk['zipcode'].tolist()
+    result = pd.DataFrame(index=chunk.index)
+    for name, (predictor, assembler) in _models.items():
+        offsets = assembler.index.offsets_for(zipcodes)
+        errors = row_errors(chunk, assembler, offsets)
+        valid = errors.isna().to_numpy()
+        predictions = np.full(len(chunk), np.nan)
+        if valid.any():
+            predictions[valid] = predictor.predict(assembler.assemble_columns(chunk[valid], offsets[valid]))
+        result[f"prediction_{name}"] = predictions
+        result[f"error_{name}"] = errors
+    return result
+
+def byte_ranges(path, chunk_bytes):
+    """Column names of the CSV at ``path`` and (start, end) offsets of its data rows, cut at line breaks."""
+    with open(path, "rb") as f:
+        header = f.readline()
+        columns = pd.read_csv(io.BytesIO(header), nrows=0).columns.tolist()
+        size = os.fstat(f.fileno()).st_size
+        ranges, start = [], f.tell()
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            # Finish the line the seek landed in
+            f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return columns, ranges
+
+def score_range(path, columns, start, end, id_column=None):
+    """Read, parse and score the rows in bytes [start, end) of the CSV at ``path``."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    chunk = pd.read_csv(io.BytesIO(data), header=None, names=columns, dtype={'zipcode': str})
+    result = score_chunk(chunk)
+    if id_column:
+        result.insert(0, id_column, chunk[id_column].values)
+    return result
+
+def score_file(input_path, output_path, models=MODELS, chunk_bytes=8 << 20, workers=None, id_column=None,
+               artifacts_dir=ARTIFACTS_DIR, demographics_path=DEMOGRAPHICS_PATH):
+    """Score ``input_path`` into ``output_path`` and return the number of rows written."""
+    workers = workers or os.cpu_count()
+    columns, ranges = byte_ranges(input_path, chunk_bytes)
+    rows = 0
+    with Pool(workers, initializer=_init_worker, initargs=(models, artifacts_dir, demographics_path)) as pool, \
+            open(output_path, "w", newline="") as out:
+        pending = deque()
+        header = True
+
+        def write_next():
+            nonlocal header, rows
+            result = pending.popleft().get()
+            # Workers number their rows from 0; the output numbers them across the file
+            result.index = pd.RangeIndex(rows, rows + len(result))
+            result.to_csv(out, header=header, index_label="row")
+            header = False
+            rows += len(result)
+
+        for start, end in ranges:
+            pending.append(pool.apply_async(score_range, (input_path, columns, start, end, id_column)))
+            # Keep a couple of ranges per worker in flight; more would only buffer in memory
+            if len(pending) >= 2 * workers:
+                write_next()
+        while pending:
+            write_next()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a CSV of houses through the prediction models.")
+    parser.add_argument("input", help="CSV shaped like data/future_unseen_examples.csv")
+    parser.add_argument("output", help="CSV to write predictions to")
+    parser.add_argument("--model", choices=MODELS + ("both",), default="both")
+    parser.add_argument("--chunk-mb", type=float, default=8, help="size of the byte range each worker parses at once")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--id-column", default=None, help="input column to copy into the output")
+    parser.add_argument("--artifacts-dir", default=ARTIFACTS_DIR)
+    args = parser.parse_args()
+
+    models = MODELS if args.model == "both" else (args.model,)
+    start = time.perf_counter()
+    rows = score_file(args.input, args.output, models, int(args.chunk_mb * (1 << 20)), args.workers, args.id_column, args.artifacts_dir)
+    elapsed = time.perf_counter() - start
+    print(f"Scored {rows:,} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)")
+
+if __name__ == "__main__":
+    main()
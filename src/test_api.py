@@ -3,15 +3,21 @@ import requests
 import pandas as pd
 import json
 import os
+import io
+import numpy as np
 
 class TestHousePriceAPI(unittest.TestCase):
     """Test suite for house price prediction API"""
 
     BASE_URL = "http://127.0.0.1:8000"
+    # The token the server was started with; the admin endpoints refuse every request without one
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
     ENDPOINTS = {
         "predict": f"{BASE_URL}/predict",
         "basic": f"{BASE_URL}/predict_basic",
-        "improved": f"{BASE_URL}/predict_improved"
+        "improved": f"{BASE_URL}/predict_improved",
+        "batch": f"{BASE_URL}/predict_batch",
+        "explain": f"{BASE_URL}/explain_improved"
     }
 
     @classmethod
@@ -32,6 +38,14 @@ class TestHousePriceAPI(unittest.TestCase):
                 except requests.exceptions.ConnectionError:
                     self.fail(f"Cannot connect to API server for {name} endpoint")
 
+    def test_ready_after_warm_up(self):
+        """Test that the readiness probe reports ready once the server has warmed up"""
+        response = requests.get(f"{self.BASE_URL}/ready")
+        self.assertEqual(response.status_code, 200, "Server should be ready once it accepts requests")
+        status = response.json()
+        self.assertTrue(status["ready"])
+        self.assertGreaterEqual(status["warm_workers"], status["expected_workers"])
+
     def test_predict_endpoint(self):
         """Test the main predict endpoint"""
         # Get first row of test data
@@ -100,6 +114,187 @@ class TestHousePriceAPI(unittest.TestCase):
                 self.assertIn("prediction", result, f"Response {i} should contain prediction")
                 self.assertGreater(result["prediction"], 0, f"Prediction {i} should be positive")
 
+    def test_batch_matches_single_predictions(self):
+        """Test that batch predictions match the single-row endpoints"""
+        payloads = [self._prepare_payload(self.test_data.iloc[i]) for i in range(min(5, len(self.test_data)))]
+        for model_name, endpoint in (("basic", "basic"), ("improved", "improved")):
+            with self.subTest(model=model_name):
+                rows = payloads if model_name == "improved" else [self._create_basic_payload(p) for p in payloads]
+                response = requests.post(self.ENDPOINTS["batch"], params={"model": model_name}, json=rows)
+                self.assertEqual(response.status_code, 200,
+                               f"Batch endpoint should return 200, got {response.status_code}")
+
+                result = response.json()
+                self.assertEqual(result["model"], model_name, f"Model type should be '{model_name}'")
+                self.assertEqual(result["errors"], [], "Batch should not report errors")
+                self.assertEqual(len(result["predictions"]), len(rows), "Should predict one value per row")
+                for i, row in enumerate(rows):
+                    single = requests.post(self.ENDPOINTS[endpoint], json=row).json()
+                    self.assertAlmostEqual(result["predictions"][i], single["prediction"], places=6,
+                                           msg=f"Batch prediction {i} should match single prediction")
+
+    def test_concurrent_improved_predictions(self):
+        """Test that concurrent single-row improved predictions and explanations each answer for their own house"""
+        from concurrent.futures import ThreadPoolExecutor
+        payloads = [self._prepare_payload(self.test_data.iloc[i]) for i in range(min(40, len(self.test_data)))]
+        expected = requests.post(self.ENDPOINTS["batch"], params={"model": "improved"}, json=payloads).json()["predictions"]
+        for endpoint in ("improved", "explain"):
+            with self.subTest(endpoint=endpoint), ThreadPoolExecutor(16) as pool:
+                results = list(pool.map(lambda payload: requests.post(self.ENDPOINTS[endpoint], json=payload).json(), payloads))
+                for i, result in enumerate(results):
+                    self.assertAlmostEqual(result["prediction"], expected[i], places=6,
+                                           msg=f"House {i} got another house's prediction")
+
+    def test_explanations_add_up_to_predictions(self):
+        """Test that single and batch explanations sum to the improved model's predictions"""
+        payloads = [self._prepare_payload(self.test_data.iloc[i]) for i in range(min(3, len(self.test_data)))]
+        response = requests.post(self.ENDPOINTS["batch"], params={"model": "improved", "explain": "true"}, json=payloads)
+        self.assertEqual(response.status_code, 200, f"Batch explain should return 200, got {response.status_code}")
+        batch = response.json()
+        self.assertEqual(len(batch["contributions"]), len(payloads))
+        for i, payload in enumerate(payloads):
+            single = requests.post(self.ENDPOINTS["explain"], json=payload).json()
+            prediction = requests.post(self.ENDPOINTS["improved"], json=payload).json()["prediction"]
+            self.assertAlmostEqual(single["prediction"], prediction, places=6)
+            self.assertAlmostEqual(single["bias"] + sum(single["contributions"].values()), prediction, delta=1e-6 * prediction)
+            self.assertEqual(list(single["contributions"]), batch["features"])
+            np.testing.assert_allclose(batch["contributions"][i], list(single["contributions"].values()), rtol=1e-9, atol=1e-6)
+
+        response = requests.post(self.ENDPOINTS["batch"], params={"model": "basic", "explain": "true"},
+                                 json=[self._create_basic_payload(payloads[0])])
+        self.assertEqual(response.status_code, 400, "The basic model has no explanations")
+
+    def test_batch_invalid_zipcode_reported_per_row(self):
+        """Test that an unknown zipcode fails only its own row in a batch"""
+        payload = self._create_basic_payload(self._prepare_payload(self.test_data.iloc[0]))
+        rows = [payload, dict(payload, zipcode="99999"), payload]
+
+        response = requests.post(self.ENDPOINTS["batch"], params={"model": "basic"}, json=rows)
+        self.assertEqual(response.status_code, 200,
+                        f"Batch with an invalid zipcode should return 200, got {response.status_code}")
+
+        result = response.json()
+        self.assertIsNone(result["predictions"][1], "Invalid row should have no prediction")
+        self.assertGreater(result["predictions"][0], 0, "Valid rows should still be predicted")
+        self.assertGreater(result["predictions"][2], 0, "Valid rows should still be predicted")
+        self.assertEqual([e["index"] for e in result["errors"]], [1], "Only the invalid row should be reported")
+
+    def test_repeated_prediction_hits_cache(self):
+        """Test that re-scoring the same house is served from the prediction cache"""
+        payload = self._prepare_payload(self.test_data.iloc[0])
+        first = requests.post(self.ENDPOINTS["improved"], json=payload).json()
+        hits_before = requests.get(f"{self.BASE_URL}/cache/stats").json()["hits"]
+        second = requests.post(self.ENDPOINTS["improved"], json=payload).json()
+        stats = requests.get(f"{self.BASE_URL}/cache/stats").json()
+        self.assertEqual(first["prediction"], second["prediction"], "Cached prediction should be identical")
+        self.assertGreater(stats["hits"], hits_before, "Repeated prediction should be a cache hit")
+
+    def test_metrics_report_stage_timings(self):
+        """Test that /metrics exposes per-stage latency histograms in Prometheus format"""
+        payload = self._prepare_payload(self.test_data.iloc[1])
+        requests.post(self.ENDPOINTS["improved"], json=payload)
+        response = requests.get(f"{self.BASE_URL}/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        lines = response.text.splitlines()
+        self.assertIn("# TYPE prediction_stage_seconds histogram", lines)
+        for stage in ("validation", "demographics", "assembly", "predict", "serialization"):
+            count = next(line for line in lines
+                         if line.startswith(f'prediction_stage_seconds_count{{route="/predict_improved",stage="{stage}"}}'))
+            self.assertGreater(float(count.split()[-1]), 0, f"Stage {stage} should have been timed")
+
+    def test_profiler_is_opt_in(self):
+        """Test that the profiling endpoint is off unless the server was started with PROFILER=1"""
+        response = requests.post(f"{self.BASE_URL}/admin/profile", params={"seconds": 0.1})
+        self.assertEqual(response.status_code, 404, "Profiling should be off by default")
+
+    def test_drift_counts_request_features(self):
+        """Test that /drift reports a score for every feature and counts the houses it has seen"""
+        before = requests.get(f"{self.BASE_URL}/drift").json()["rows"]
+        payloads = [self._prepare_payload(row) for _, row in self.test_data.head(5).iterrows()]
+        response = requests.post(self.ENDPOINTS["batch"] + "?model=improved", json=payloads)
+        self.assertEqual(response.status_code, 200)
+        report = requests.get(f"{self.BASE_URL}/drift").json()
+        self.assertEqual(report["rows"], before + 5)
+        self.assertIn("sqft_living", report["features"])
+        self.assertIn("reference_quantiles", report["features"]["sqft_living"])
+
+    def test_past_deadline_is_rejected(self):
+        """Test that work past its X-Request-Timeout-Ms deadline is answered 503 with Retry-After, not scored"""
+        payloads = [self._prepare_payload(row) for _, row in self.test_data.head(3).iterrows()]
+        response = requests.post(self.ENDPOINTS["batch"] + "?model=improved", json=payloads,
+                                 headers={"X-Request-Timeout-Ms": "0.001"})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        stats = requests.get(f"{self.BASE_URL}/admission/stats").json()
+        self.assertGreaterEqual(stats["improved"]["expired"], 1)
+        response = requests.post(self.ENDPOINTS["batch"] + "?model=improved", json=payloads,
+                                 headers={"X-Request-Timeout-Ms": "5000"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_endpoints_need_token(self):
+        """Test that reloading models and resetting drift are refused without the admin token"""
+        for method, path, params in (("post", "/admin/reload", {"model": "basic", "version": 1}), ("post", "/drift/reset", {})):
+            with self.subTest(endpoint=path):
+                response = requests.request(method, self.BASE_URL + path, params=params)
+                self.assertEqual(response.status_code, 403, f"{path} should need X-Admin-Token")
+                response = requests.request(method, self.BASE_URL + path, params=params, headers={"X-Admin-Token": "wrong"})
+                self.assertEqual(response.status_code, 403)
+
+    def test_responses_report_model_version(self):
+        """Test that predictions name the model version that served them, across a forced reload"""
+        if not self.ADMIN_TOKEN:
+            self.skipTest("Set ADMIN_TOKEN for the server and the tests to reload models")
+        payload = self._prepare_payload(self.test_data.iloc[2])
+        versions = requests.get(f"{self.BASE_URL}/models").json()["models"]
+        before = requests.post(self.ENDPOINTS["improved"], json=payload).json()
+        self.assertEqual(before["model_version"], versions["improved"]["version"])
+
+        response = requests.post(f"{self.BASE_URL}/admin/reload", params={"model": "improved", "force": "true"},
+                                 headers={"X-Admin-Token": self.ADMIN_TOKEN})
+        self.assertEqual(response.status_code, 200, f"Reloading the serving version should pass, got {response.text}")
+        report = response.json()
+        self.assertTrue(report["swapped"])
+        self.assertEqual(report["median_relative_change"], 0.0, "The same version should predict identically")
+
+        after = requests.post(self.ENDPOINTS["improved"], json=payload).json()
+        self.assertEqual(after, before)
+
+    def test_batch_wire_formats_match(self):
+        """Test that columnar JSON and NumPy batches score exactly like an array of houses"""
+        payloads = [self._prepare_payload(self.test_data.iloc[i]) for i in range(10)]
+        columns = {field: [payload[field] for payload in payloads] for field in payloads[0]}
+        url = f"{self.ENDPOINTS['batch']}?model=improved"
+        expected = requests.post(url, json=payloads).json()["predictions"]
+
+        columnar = requests.post(url, json=columns)
+        self.assertEqual(columnar.status_code, 200)
+        self.assertEqual(columnar.json()["predictions"], expected)
+
+        records = np.rec.fromarrays([np.array(values) for values in columns.values()], names=list(columns))
+        body = io.BytesIO()
+        np.save(body, records)
+        response = requests.post(url, data=body.getvalue(),
+                                 headers={"Content-Type": "application/x-npy", "Accept": "application/x-npy"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(np.load(io.BytesIO(response.content)).tolist(), expected)
+        self.assertIn("X-Model-Version", response.headers)
+
+    def test_ndjson_bad_lines_fail_alone(self):
+        """Test that malformed or invalid NDJSON lines get their own error and the other lines are still scored"""
+        payloads = [self._prepare_payload(self.test_data.iloc[i]) for i in range(3)]
+        url = f"{self.ENDPOINTS['batch']}?model=improved"
+        expected = requests.post(url, json=payloads).json()["predictions"]
+        lines = [json.dumps(payloads[0]), json.dumps(payloads[1]), '{"bedrooms": 3,', json.dumps(payloads[2]), '{"bedrooms": 3}']
+        response = requests.post(url, data="\n".join(lines) + "\n", headers={"Content-Type": "application/x-ndjson"})
+        self.assertEqual(response.status_code, 200)
+        results = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([result["index"] for result in results], list(range(5)))
+        self.assertEqual([results[i]["prediction"] for i in (0, 1, 3)], expected)
+        for i in (2, 4):
+            self.assertIsNone(results[i]["prediction"])
+            self.assertIn("error", results[i])
+
     def test_invalid_zipcode(self):
         """Test error handling for invalid zipcode"""
         payload = {
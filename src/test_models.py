@@ -6,6 +6,9 @@ import numpy as np
 import os
 from sklearn.metrics import r2_score, mean_absolute_error
 
+from datasets import cached_table, load_demographics, load_sales, load_training_table
+from geo_features import GeoIndex, add_geo_features, load_geo_index, uses_geo_features
+
 class TestHousePriceModels(unittest.TestCase):
     """Test suite for house price prediction models"""
 
@@ -43,11 +46,10 @@ class TestHousePriceModels(unittest.TestCase):
         except FileNotFoundError:
             cls.improved_features = None
 
-        # Load test data
-        sales_path = os.path.join(os.path.dirname(__file__), "data", "kc_house_data.csv")
-        demographics_path = os.path.join(os.path.dirname(__file__), "data", "zipcode_demographics.csv")
-        cls.sales_data = pd.read_csv(sales_path, dtype={'zipcode': str})
-        cls.demographics = pd.read_csv(demographics_path, dtype={'zipcode': str})
+        # Load test data from the shared dataset cache
+        cls.sales_data = load_sales()
+        cls.demographics = load_demographics()
+        cls.training_table = load_training_table()
 
         # Prepare test data for predictions
         cls.test_sample = cls.sales_data.head(1).copy()
@@ -61,6 +63,12 @@ class TestHousePriceModels(unittest.TestCase):
         if cls.improved_features and 'sale_month' in cls.improved_features:
             cls.test_sample['sale_month'] = 6
 
+        # Neighborhood features come from the geo artifact written with the improved model
+        cls.geo_index = None
+        if cls.improved_features and uses_geo_features(cls.improved_features):
+            cls.geo_index = load_geo_index(root=os.path.join(script_dir, "..", "model", "artifacts"))
+            cls.test_sample = add_geo_features(cls.test_sample, cls.geo_index)
+
     def test_basic_model_loaded(self):
         """Test that basic model is loaded correctly"""
         if self.basic_model is None:
@@ -97,6 +105,200 @@ class TestHousePriceModels(unittest.TestCase):
         self.assertEqual(len(prediction), 1, "Should predict one value")
         self.assertGreater(prediction[0], 0, "Prediction should be positive")
 
+    def test_compiled_improved_model_parity(self):
+        """Test that the compiled tree arrays reproduce improved_model.predict"""
+        if self.improved_model is None:
+            self.skipTest("Improved model not found - skipping test")
+        from create_improved_model import chunk_features
+        from tree_ensemble import CompiledEnsemble
+        compiled = CompiledEnsemble.from_model(self.improved_model)
+        X, _ = chunk_features(self.training_table.copy(), self.geo_index, self.improved_features)
+        expected = self.improved_model.predict(X)
+        np.testing.assert_array_equal(compiled.predict(X), expected)
+        np.testing.assert_array_equal(compiled.predict(X.iloc[:1]), expected[:1])
+
+    def test_compiled_hist_gradient_boosting_parity(self):
+        """Test that a compiled HistGradientBoostingRegressor reproduces its predict, missing values included"""
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        from create_improved_model import chunk_features
+        from tree_ensemble import CompiledEnsemble
+        X, y = chunk_features(self.training_table.copy(), None)
+        X = X.astype(np.float64)
+        X.iloc[::50, 0] = np.nan
+        model = HistGradientBoostingRegressor(max_iter=50, random_state=42).fit(X, y)
+        compiled = CompiledEnsemble.from_model(model)
+        np.testing.assert_array_equal(compiled.predict(X), model.predict(X))
+
+    def test_explanations_add_up_to_predictions(self):
+        """Test that per-feature contributions follow each tree path and sum to the prediction"""
+        from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
+        from create_improved_model import chunk_features
+        from tree_ensemble import CompiledEnsemble
+        from explanations import TreeExplainer
+        X, y = chunk_features(self.training_table.head(3000).copy(), None)
+        X = X.astype(np.float64)
+        gbr = GradientBoostingRegressor(n_estimators=20, max_depth=4, random_state=42).fit(X, y)
+        hgb = HistGradientBoostingRegressor(max_iter=20, random_state=42).fit(X, y)
+        for model in (gbr, hgb):
+            with self.subTest(model=type(model).__name__):
+                explainer = TreeExplainer(CompiledEnsemble.from_model(model))
+                predictions, contributions = explainer.explain(X.head(200))
+                np.testing.assert_array_equal(predictions, model.predict(X.head(200)))
+                np.testing.assert_allclose(explainer.bias + contributions.sum(axis=1), predictions, rtol=1e-9)
+
+        # Reference: walk each sklearn tree's decision path and credit the value steps by hand
+        rows = X.head(5).to_numpy()
+        expected = np.zeros_like(rows)
+        for estimator in gbr.estimators_[:, 0]:
+            tree = estimator.tree_
+            paths = estimator.decision_path(rows)
+            for i in range(len(rows)):
+                nodes = paths.indices[paths.indptr[i]:paths.indptr[i + 1]]
+                for parent, child in zip(nodes[:-1], nodes[1:]):
+                    expected[i, tree.feature[parent]] += gbr.learning_rate * (tree.value[child, 0, 0] - tree.value[parent, 0, 0])
+        _, contributions = TreeExplainer(CompiledEnsemble.from_model(gbr)).explain(X.head(5))
+        np.testing.assert_allclose(contributions, expected, rtol=1e-9, atol=1e-6)
+
+    def test_model_search_picks_best_candidate(self):
+        """Test that the parallel search ranks candidates and writes a report for the winner"""
+        import tempfile
+        from sklearn.model_selection import train_test_split
+        from create_improved_model import chunk_features
+        from model_search import run_search
+        X, y = chunk_features(self.training_table.head(3000).copy(), None)
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        space = {"gbr": {"n_estimators": [30], "max_depth": [3]}, "hgb": {"max_iter": [30, 60]}}
+        report_path = os.path.join(tempfile.mkdtemp(), "report.json")
+        model = run_search(["gbr", "hgb"], X_train, y_train, X_test, y_test, report_path, space, n_jobs=2)
+        with open(report_path, "r") as f:
+            report = json.load(f)
+        self.assertEqual(len(report["candidates"]), 3)
+        maes = [candidate["mae"] for candidate in report["candidates"]]
+        self.assertEqual(maes, sorted(maes), "Candidates should be ranked by validation MAE")
+        self.assertEqual(report["winner"]["family"], report["candidates"][0]["family"])
+        self.assertGreater(r2_score(y_test, model.predict(X_test)), 0.5)
+
+    def test_neighbor_index_matches_basic_model(self):
+        """Test that the prebuilt neighbor index reproduces the basic model"""
+        if self.basic_model is None or self.basic_features is None:
+            self.skipTest("Basic model or features not found - skipping test")
+        from sklearn.model_selection import train_test_split
+        from neighbors import NeighborIndex
+        merged = self.sales_data.merge(self.demographics, on='zipcode')
+        X, y = merged[self.basic_features], merged['price']
+        x_train, x_test, y_train, _ = train_test_split(X, y, random_state=42)
+        index = NeighborIndex.from_pipeline(self.basic_model, x_train, y_train, n_clusters=64)
+        # Neighbors may differ only between points tied on distance, so compare distances
+        # (sklearn's brute search computes them via expanded norms, hence the tolerance)
+        scaled = index.transform(x_test.head(500))
+        expected, _ = self.basic_model[-1].kneighbors(scaled)
+        found = np.sqrt(((index.points[index.kneighbors(x_test.head(500))] - scaled[:, None, :]) ** 2).sum(axis=2))
+        np.testing.assert_allclose(found, expected, atol=1e-4)
+        self.assertEqual(index.recall(x_test.head(200), n_probe=index.n_clusters), 1.0,
+                         "Probing every cluster should be exact")
+        self.assertGreater(index.recall(x_test.head(200), n_probe=8), 0.9, "Approximate recall should be high")
+
+    def test_large_index_batches_use_the_tree(self):
+        """Test that batches on an index past BRUTE_FORCE_MAX_POINTS use the tree and find the same neighbors"""
+        from sklearn.neighbors import KNeighborsRegressor
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import RobustScaler
+        import neighbors
+        rng = np.random.default_rng(0)
+        X = rng.normal(size=(2000, 5))
+        y = X.sum(axis=1)
+        index = neighbors.NeighborIndex.from_pipeline(make_pipeline(RobustScaler(), KNeighborsRegressor()).fit(X, y), X, y)
+        with self.assertRaises(ValueError):
+            neighbors.NeighborIndex.from_pipeline(make_pipeline(RobustScaler(), KNeighborsRegressor(p=1)).fit(X, y), X, y)
+        queries = rng.normal(size=(2 * neighbors.BRUTE_FORCE_MIN_ROWS, 5))
+        brute_forced = index.kneighbors(queries)
+        self.assertIsNotNone(index._brute, "A small index should brute-force batches")
+        limit = neighbors.BRUTE_FORCE_MAX_POINTS
+        neighbors.BRUTE_FORCE_MAX_POINTS = len(X) - 1
+        try:
+            index._brute = None
+            np.testing.assert_array_equal(index.kneighbors(queries), brute_forced)
+            self.assertIsNone(index._brute, "A large index should not brute-force batches")
+        finally:
+            neighbors.BRUTE_FORCE_MAX_POINTS = limit
+
+    def test_model_artifacts_round_trip(self):
+        """Test that models served from memory-mapped artifacts predict like the originals"""
+        if self.basic_model is None or self.improved_model is None:
+            self.skipTest("Models not found - skipping test")
+        import tempfile
+        from sklearn.model_selection import train_test_split
+        from artifacts import read_artifact, write_artifact
+        from neighbors import NeighborIndex
+        from tree_ensemble import CompiledEnsemble
+        root = tempfile.mkdtemp()
+        merged = self.sales_data.merge(self.demographics, on='zipcode')
+        x_train, x_test, y_train, _ = train_test_split(merged[self.basic_features], merged['price'], random_state=42)
+
+        index = NeighborIndex.from_pipeline(self.basic_model, x_train, y_train, n_clusters=16)
+        write_artifact("basic", *index.to_artifact(), root)
+        loaded = NeighborIndex.from_artifact(read_artifact("basic", root=root))
+        np.testing.assert_array_equal(loaded.predict(x_test.head(200)), index.predict(x_test.head(200)))
+        np.testing.assert_array_equal(loaded.predict(x_test.head(200), approximate=True),
+                                      index.predict(x_test.head(200), approximate=True))
+
+        compiled = CompiledEnsemble.from_model(self.improved_model)
+        write_artifact("improved", *compiled.to_artifact(), root)
+        loaded = CompiledEnsemble.from_artifact(read_artifact("improved", root=root))
+        features = self.test_sample[self.improved_features]
+        np.testing.assert_array_equal(loaded.predict(features), self.improved_model.predict(features))
+
+    def test_bulk_scoring_matches_models(self):
+        """Test that chunked multi-process scoring writes every row in input order"""
+        import tempfile
+        from score_bulk import load_models, score_file
+        try:
+            models = load_models(("basic", "improved"))
+        except FileNotFoundError:
+            self.skipTest("Model artifacts not found - skipping test")
+        examples_path = os.path.join(os.path.dirname(__file__), "data", "future_unseen_examples.csv")
+        output_path = os.path.join(tempfile.mkdtemp(), "predictions.csv")
+        rows = score_file(examples_path, output_path, chunk_bytes=1000, workers=2)
+
+        examples = pd.read_csv(examples_path, dtype={'zipcode': str})
+        examples['sale_year'] = 2023
+        examples['sale_month'] = 6
+        scored = pd.read_csv(output_path, float_precision='round_trip')
+        self.assertEqual(rows, len(examples))
+        self.assertEqual(scored['row'].tolist(), list(range(len(examples))), "Rows should keep input order")
+        for name, (predictor, assembler) in models.items():
+            offsets = assembler.index.offsets_for(examples['zipcode'].tolist())
+            expected = predictor.predict(assembler.assemble_columns(examples, offsets))
+            np.testing.assert_array_equal(scored[f"prediction_{name}"].values, expected)
+            self.assertTrue(scored[f"error_{name}"].isna().all())
+
+    def test_bulk_scoring_reports_row_errors(self):
+        """Test that rows with a missing lat or an unknown zipcode get an error and leave the other rows scored"""
+        import tempfile
+        from score_bulk import load_models, score_file
+        try:
+            models = load_models(("basic", "improved"))
+        except FileNotFoundError:
+            self.skipTest("Model artifacts not found - skipping test")
+        examples = pd.read_csv(os.path.join(os.path.dirname(__file__), "data", "future_unseen_examples.csv"),
+                               dtype={'zipcode': str})
+        examples.loc[3, 'lat'] = np.nan
+        examples.loc[5, 'zipcode'] = "99999"
+        root = tempfile.mkdtemp()
+        examples.to_csv(os.path.join(root, "houses.csv"), index=False)
+        score_file(os.path.join(root, "houses.csv"), os.path.join(root, "predictions.csv"), chunk_bytes=1000, workers=2)
+
+        scored = pd.read_csv(os.path.join(root, "predictions.csv"))
+        self.assertEqual(len(scored), len(examples))
+        self.assertEqual(scored.loc[5, 'error_basic'], "Demographics not found for zipcode 99999")
+        self.assertTrue(np.isnan(scored.loc[5, 'prediction_basic']))
+        geo = models["improved"][1].geo is not None
+        if geo:
+            self.assertEqual(scored.loc[3, 'error_improved'], "lat and long must be finite")
+            self.assertTrue(np.isnan(scored.loc[3, 'prediction_improved']))
+        self.assertEqual(scored[[f"error_{name}" for name in models]].notna().any(axis=1).sum(), 2 if geo else 1)
+        self.assertTrue(scored.drop(index=[3, 5])[[f"prediction_{name}" for name in models]].notna().all().all())
+
     def test_data_loaded(self):
         """Test that test data is loaded correctly"""
         self.assertIsNotNone(self.sales_data, "Sales data should be loaded")
@@ -111,6 +313,283 @@ class TestHousePriceModels(unittest.TestCase):
         self.assertNotEqual(self.basic_features, self.improved_features,
                            "Basic and improved models should have different features")
 
+class TestGeoFeatures(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.sales = load_sales().head(3000)
+        cls.index = GeoIndex.from_sales(cls.sales['lat'], cls.sales['long'], cls.sales['price'],
+                                        cls.sales['sqft_living'], cls.sales['id'], n_neighbors=5, radius_km=1.0)
+
+    def brute_force(self, lat, long, keep):
+        """Neighborhood features by scanning every sale in ``keep``."""
+        from sklearn.metrics.pairwise import haversine_distances
+        from geo_features import EARTH_RADIUS_KM
+        sales = self.sales[keep]
+        distances = haversine_distances(np.radians([[lat, long]]), np.radians(sales[['lat', 'long']].to_numpy()))[0]
+        nearest = np.argsort(distances, kind='stable')[:5]
+        price_per_sqft = (sales['price'] / sales['sqft_living']).to_numpy()
+        return np.median(price_per_sqft[nearest]), (distances * EARTH_RADIUS_KM <= 1.0).sum() / np.pi
+
+    def test_query_matches_brute_force(self):
+        """Test that the ball tree query agrees with a scan of every sale"""
+        examples = pd.read_csv(os.path.join(os.path.dirname(__file__), "data", "future_unseen_examples.csv"))
+        features = self.index.query(examples['lat'], examples['long'])
+        for i in range(0, len(examples), 10):
+            expected = self.brute_force(examples['lat'][i], examples['long'][i], np.ones(len(self.sales), dtype=bool))
+            np.testing.assert_allclose(features[i], expected)
+
+    def test_excluded_ids_leave_out_own_sales(self):
+        """Test that training rows do not see the sales of their own house"""
+        ids = self.sales['id'].to_numpy()
+        features = self.index.query(self.sales['lat'], self.sales['long'], exclude_ids=ids)
+        resold = np.flatnonzero(pd.Series(ids).duplicated(keep=False).to_numpy())
+        for i in list(range(0, 3000, 300)) + list(resold[:5]):
+            expected = self.brute_force(self.sales['lat'].iloc[i], self.sales['long'].iloc[i], ids != ids[i])
+            np.testing.assert_allclose(features[i], expected)
+
+    def test_artifact_round_trip(self):
+        """Test that a memory-mapped geo artifact answers like the index it was written from"""
+        import tempfile
+        from artifacts import read_artifact, write_artifact
+        root = tempfile.mkdtemp()
+        write_artifact("geo", *self.index.to_artifact(), root)
+        loaded = GeoIndex.from_artifact(read_artifact("geo", root=root))
+        lat, long = self.sales['lat'].to_numpy()[:200], self.sales['long'].to_numpy()[:200]
+        np.testing.assert_array_equal(loaded.query(lat, long), self.index.query(lat, long))
+        single = np.vstack([loaded.query((a,), (o,)) for a, o in zip(lat[:20], long[:20])])
+        np.testing.assert_array_equal(single, self.index.query(lat[:20], long[:20]))
+        with self.assertRaises(ValueError):
+            loaded.query((np.nan,), (-122.3,))
+
+class TestCrossValidation(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from create_improved_model import prepare_training_table
+        from datasets import load_training_table
+        table = load_training_table().head(2000)
+        cls.zipcodes = table['zipcode'].to_numpy()
+        cls.X, cls.y = prepare_training_table(table.copy())
+
+    def test_fold_predictions_cached(self):
+        """Test that a second evaluation reuses the cached fold predictions"""
+        import tempfile
+        from sklearn.linear_model import LinearRegression
+        from sklearn.tree import DecisionTreeRegressor
+        from cross_validation import evaluate
+        models = {"linear": (LinearRegression(), self.X, self.y),
+                  "tree": (DecisionTreeRegressor(max_depth=4, random_state=0), self.X, self.y)}
+        cache_dir = tempfile.mkdtemp()
+        first = evaluate(models, self.zipcodes, n_folds=3, n_boot=100, n_jobs=2, cache_dir=cache_dir)
+        second = evaluate(models, self.zipcodes, n_folds=3, n_boot=200, n_jobs=2, cache_dir=cache_dir)
+        self.assertEqual(first["folds_computed"], 6)
+        self.assertEqual(second["folds_computed"], 0, "Only the metrics changed, so nothing should be refitted")
+        for name in models:
+            self.assertEqual(first["models"][name]["r2"], second["models"][name]["r2"])
+            low, high = second["models"][name]["ci"]["mae"]
+            self.assertLessEqual(low, second["models"][name]["mae"])
+            self.assertGreaterEqual(high, second["models"][name]["mae"])
+            self.assertEqual(sum(row["count"] for row in second["models"][name]["zipcodes"]), len(self.X))
+        changed = {"tree": (DecisionTreeRegressor(max_depth=5, random_state=0), self.X, self.y)}
+        self.assertEqual(evaluate(changed, self.zipcodes, n_folds=3, n_boot=10, n_jobs=1, cache_dir=cache_dir)["folds_computed"], 3,
+                         "A changed model configuration should not reuse cached predictions")
+
+class TestDatasetCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.root = tempfile.mkdtemp()
+        self.source = os.path.join(self.root, "source.csv")
+        self.builds = 0
+        self._write_source("a,zipcode,when\n1,98001,20140101T000000\n2,,20150202T000000\n")
+
+    def _write_source(self, text):
+        with open(self.source, "w") as f:
+            f.write(text)
+
+    def _build(self):
+        self.builds += 1
+        # Two chunks, so the dictionary encoding has to merge vocabularies
+        for chunk in pd.read_csv(self.source, dtype={'zipcode': str}, chunksize=1):
+            chunk['when'] = pd.to_datetime(chunk['when'], format="%Y%m%dT%H%M%S")
+            yield chunk
+
+    def _load(self):
+        return cached_table("table", [self.source], self._build, cache_dir=os.path.join(self.root, "cache"))
+
+    def test_round_trip_and_reuse(self):
+        """Test that a cached table reads back identically without rebuilding"""
+        first = self._load()
+        second = self._load()
+        self.assertEqual(self.builds, 1, "Second load should come from the cache")
+        pd.testing.assert_frame_equal(first, second)
+        self.assertEqual(second['a'].tolist(), [1, 2])
+        self.assertEqual(second['zipcode'].iloc[0], "98001")
+        self.assertTrue(pd.isna(second['zipcode'].iloc[1]))
+        self.assertEqual(second['when'].dt.year.tolist(), [2014, 2015])
+
+    def test_invalidated_by_content_not_mtime(self):
+        """Test that changed source content rebuilds the cache but a touched file does not"""
+        self._load()
+        os.utime(self.source, ns=(0, 0))
+        self._load()
+        self.assertEqual(self.builds, 1, "Same content with a new mtime should not rebuild")
+        self._write_source("a,zipcode,when\n3,98002,20160303T000000\n")
+        table = self._load()
+        self.assertEqual(self.builds, 2)
+        self.assertEqual(table['a'].tolist(), [3])
+
+class TestOutOfCore(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from generate_sales import write_sales
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "sales.csv")
+        write_sales(self.path, 3000, chunk_rows=1000, seed=1)
+
+    def test_synthetic_sales_look_like_the_source(self):
+        """Test that generated sales have the source's columns and consistent, plausible values"""
+        source = load_sales()
+        sales = pd.read_csv(self.path, dtype={'zipcode': str})
+        self.assertEqual(list(sales.columns), [column for column in source.columns])
+        self.assertEqual(len(sales), 3000)
+        self.assertTrue(sales['id'].is_unique)
+        np.testing.assert_array_equal(sales['sqft_living'], sales['sqft_above'] + sales['sqft_basement'])
+        self.assertTrue(sales['zipcode'].isin(load_demographics()['zipcode']).all())
+        self.assertLess(abs(np.log(sales['price'].median() / source['price'].median())), 0.5)
+
+    def test_sampling_split_and_metrics(self):
+        """Test the bounded row sample, the id-hash holdout and streamed metrics against sklearn"""
+        from out_of_core import RowSample, StreamingMetrics, holdout_mask
+        sample = RowSample(500, seed=0)
+        metrics = StreamingMetrics()
+        truth, predictions = [], []
+        for chunk in pd.read_csv(self.path, chunksize=700):
+            sample.add(chunk)
+            guess = chunk['sqft_living'] * 250.0
+            metrics.update(chunk['price'], guess)
+            truth.append(chunk['price']), predictions.append(guess)
+        self.assertEqual((len(sample.frame), sample.rows), (500, 3000))
+        self.assertTrue(sample.frame['id'].is_unique)
+        self.assertGreater(sample.frame['id'].max(), 2500, "Late chunks should be sampled too")
+        truth, predictions = pd.concat(truth), pd.concat(predictions)
+        self.assertAlmostEqual(metrics.r2, r2_score(truth, predictions))
+        self.assertAlmostEqual(metrics.mae, mean_absolute_error(truth, predictions))
+        ids = np.arange(1, 100001)
+        held_out = holdout_mask(ids)
+        self.assertAlmostEqual(held_out.mean(), 0.2, delta=0.01)
+        np.testing.assert_array_equal(held_out[::7], holdout_mask(ids[::7]), "The split must not depend on the chunk")
+
+    def test_chunked_training(self):
+        """Test that chunked training adds trees per chunk and writes a usable model's features and profile"""
+        import create_improved_model
+        from artifacts import read_artifact
+        output_dir = create_improved_model.OUTPUT_DIR
+        create_improved_model.OUTPUT_DIR = self.root
+        try:
+            model, features, geo_index = create_improved_model.train_chunked(
+                self.path, chunk_rows=1000, sample_rows=1500, trees_per_chunk=10)
+        finally:
+            create_improved_model.OUTPUT_DIR = output_dir
+        self.assertEqual(model.n_iter_, 30, "Each of the three chunks should add its trees")
+        self.assertTrue(uses_geo_features(features))
+        self.assertEqual(read_artifact("profile", root=os.path.join(self.root, "artifacts")).meta["rows"], 1500)
+        self.assertLessEqual(len(geo_index.points), 1500)
+
+class TestIncrementalUpdate(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from generate_sales import write_sales
+        self.root = tempfile.mkdtemp()
+        self.artifacts = os.path.join(self.root, "artifacts")
+        self.base_path = os.path.join(self.root, "sales.csv")
+        self.new_path = os.path.join(self.root, "new_sales.csv")
+        write_sales(self.base_path, 3000, seed=1)
+        write_sales(self.new_path, 1000, seed=2, start_year=2017, years=1)
+
+    def test_appended_rows_found_like_indexed_ones(self):
+        """Test that rows appended to a neighbor index are searched like rows it was built with"""
+        from sklearn.neighbors import KDTree, KNeighborsRegressor
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import RobustScaler
+        from artifacts import read_artifact, write_artifact
+        from neighbors import NeighborIndex
+        rng = np.random.default_rng(0)
+        X = rng.normal(size=(3000, 5))
+        y = X.sum(axis=1) + rng.normal(size=3000)
+        model = make_pipeline(RobustScaler(), KNeighborsRegressor()).fit(X[:2400], y[:2400])
+        index = NeighborIndex.from_pipeline(model, X[:2400], y[:2400], n_clusters=40)
+        index.append(X[2400:], y[2400:])
+        self.assertEqual((index.tree_rows, index.appended_rows), (2400, 600))
+        rebuilt = NeighborIndex(index.center, index.scale, index.points.copy(), index.targets.copy(), KDTree(index.points))
+
+        queries = rng.normal(size=(40, 5))
+        write_artifact("basic", *index.to_artifact(), self.artifacts)
+        loaded = NeighborIndex.from_artifact(read_artifact("basic", root=self.artifacts))
+        self.assertEqual(loaded.appended_rows, 600)
+        for rows in (queries[:1], queries[:4], queries):
+            np.testing.assert_array_equal(index.predict(rows), rebuilt.predict(rows))
+            np.testing.assert_array_equal(loaded.predict(rows), rebuilt.predict(rows))
+        self.assertEqual(index.recall(queries, n_probe=index.n_clusters), 1.0, "Appended rows should be in their clusters")
+        index.compact()
+        self.assertEqual(index.appended_rows, 0)
+        np.testing.assert_array_equal(index.predict(queries[:4]), rebuilt.predict(queries[:4]))
+
+    def test_update_writes_new_versions(self):
+        """Test that an update appends to the basic index, adds boosting stages and records before/after metrics"""
+        from sklearn.ensemble import GradientBoostingRegressor
+        from sklearn.neighbors import KNeighborsRegressor
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import RobustScaler
+        from artifacts import read_artifact, write_artifact
+        from create_improved_model import chunk_features
+        from create_model import SALES_COLUMN_SELECTION
+        from neighbors import NeighborIndex
+        from tree_ensemble import export_compiled_model
+        from update_models import load_new_sales, split_new_sales, update_basic, update_improved
+        demographics = load_demographics()
+        base = load_new_sales(self.base_path)
+        features = [c for c in SALES_COLUMN_SELECTION if c not in ('price', 'zipcode')] + list(demographics.columns.drop('zipcode'))
+        knn = make_pipeline(RobustScaler(), KNeighborsRegressor()).fit(base[features], base['price'])
+        arrays, meta = NeighborIndex.from_pipeline(knn, base[features], base['price'], n_clusters=20).to_artifact()
+        write_artifact("basic", arrays, {**meta, 'features': features}, self.artifacts)
+        X, y = chunk_features(base.copy(), None)
+        gbr = GradientBoostingRegressor(n_estimators=20, max_depth=3, random_state=42).fit(X, y)
+        export_compiled_model(gbr, X.columns, self.artifacts)
+        model_path = os.path.join(self.root, "model_improved.pkl")
+        with open(model_path, "wb") as f:
+            pickle.dump(gbr, f)
+
+        train, held_out = split_new_sales(load_new_sales(self.new_path))
+        basic = update_basic(train, held_out, demographics['zipcode'], self.artifacts, compact_share=1.0, force=True)
+        self.assertEqual((basic["base_version"], basic["version"], basic["compacted"]), (1, 2, False))
+        loaded = NeighborIndex.from_artifact(read_artifact("basic", root=self.artifacts))
+        self.assertEqual((loaded.tree_rows, loaded.appended_rows), (len(base), len(train)))
+        self.assertAlmostEqual(mean_absolute_error(held_out['price'], loaded.predict(held_out[features])), basic["after"]["mae"])
+        # Appending again passes the absolute cap, even though it is far below compact_share of the tree
+        again = update_basic(train, held_out, demographics['zipcode'], self.artifacts, compact_share=1.0,
+                             max_appended_rows=len(train), force=True)
+        self.assertEqual((again["version"], again["compacted"], again["appended_rows"]), (3, True, 0))
+        self.assertEqual(NeighborIndex.from_artifact(read_artifact("basic", root=self.artifacts)).tree_rows, len(base) + 2 * len(train))
+
+        improved = update_improved(train, held_out, stages=5, root=self.artifacts, model_path=model_path, force=True)
+        self.assertEqual((improved["trees_before"], improved["trees_after"], improved["version"]), (20, 25, 2))
+        self.assertLess(improved["after"]["mae"], improved["before"]["mae"], "Stages fit on the newer sales should help")
+        artifact = read_artifact("improved", root=self.artifacts)
+        self.assertEqual(artifact.meta["update"]["base_version"], 1)
+        from tree_ensemble import CompiledEnsemble
+        with open(model_path, "rb") as f:
+            updated = pickle.load(f)
+        self.assertEqual({key: updated.get_params()[key] for key in ("n_estimators", "max_depth", "min_samples_leaf", "warm_start")},
+                         {"n_estimators": 25, "max_depth": 3, "min_samples_leaf": 1, "warm_start": False},
+                         "Only the tree count of the pickled model should change")
+        X_held_out, _ = chunk_features(held_out.copy(), None, artifact.meta['features'], exclude_own=False)
+        np.testing.assert_array_equal(CompiledEnsemble.from_artifact(artifact).predict(X_held_out), updated.predict(X_held_out))
+
+        # The stages go on the serving model only; a pickle of another version is refused
+        with open(model_path, "wb") as f:
+            pickle.dump(gbr, f)
+        with self.assertRaises(ValueError):
+            update_improved(train, held_out, root=self.artifacts, model_path=model_path)
+
 if __name__ == '__main__':
     # Run tests when script is executed directly
     unittest.main(verbosity=2, exit=False)
\ No newline at end of file
@@ -0,0 +1,777 @@
+import unittest
+import asyncio
+import pandas as pd
+import numpy as np
+import pickle
+import json
+import os
+import tempfile
+import io
+import time
+import shutil
+import subprocess
+import sys
+import types
+from typing import Optional
+from pydantic import BaseModel
+from sklearn.ensemble import HistGradientBoostingRegressor
+
+from demographics import DemographicsIndex
+from inference import FeatureAssembler, drop_feature_names
+from tree_ensemble import CompiledEnsemble, input_dtype
+from artifacts import ArtifactError, latest_version, read_artifact, write_artifact
+from prediction_cache import PredictionCache
+from batching import MicroBatcher
+from admission import AdmissionLimiter, DeadlineExceeded, Overloaded, request_deadline
+from geo_features import add_geo_features, load_geo_index, uses_geo_features
+from hot_reload import ModelRegistry, ReloadError, ServedModel
+from wire_formats import (JSON, NDJSON, NPY, WireFormatError, decode_columns, field_specs, ndjson_blocks,
+                          negotiate, validate_columns)
+from prefork import ReadyWorkers
+from drift import DriftMonitor, build_profile
+from metrics import Counter, Histogram, StageTimer, render
+from benchmark import compare, failed_requests, summarize
+from profiler import ProfilerBusy, SamplingProfiler, frame_name
+from create_improved_model import chunk_features
+from datasets import load_training_table
+
+def load_model(name):
+    """Load a pickled model artifact, or None if it has not been trained"""
+    try:
+        with open(os.path.join(os.path.dirname(__file__), "..", "model", name), "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+class TestDemographicsIndex(unittest.TestCase):
+    """Test suite for the serving-side demographics lookup"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up test fixtures once for all tests"""
+        script_dir = os.path.dirname(__file__)
+        improved_features_path = os.path.join(script_dir, "..", "model", "model_features_improved.json")
+        try:
+            with open(improved_features_path, "r") as f:
+                cls.improved_features = json.load(f)
+        except FileNotFoundError:
+            cls.improved_features = None
+
+        demographics_path = os.path.join(script_dir, "data", "zipcode_demographics.csv")
+        examples_path = os.path.join(script_dir, "data", "future_unseen_examples.csv")
+        cls.demographics = pd.read_csv(demographics_path, dtype={'zipcode': str})
+        cls.examples = pd.read_csv(examples_path, dtype={'zipcode': str})
+
+    def test_lookup_matches_merge(self):
+        """Test that index rows are identical to a pd.merge join"""
+        index = DemographicsIndex(self.demographics, self.improved_features)
+        merged = pd.merge(self.examples, self.demographics, on='zipcode', how='left')
+        offsets = index.offsets_for(self.examples['zipcode'].tolist())
+        self.assertTrue((offsets >= 0).all(), "All example zipcodes should be known")
+        np.testing.assert_array_equal(index.matrix[offsets], merged[index.columns].to_numpy(dtype=np.float64))
+
+    def test_columns_follow_feature_order(self):
+        """Test that the matrix columns follow the model feature order"""
+        if self.improved_features is None:
+            self.skipTest("Improved model features not found - skipping test")
+        index = DemographicsIndex(self.demographics, self.improved_features)
+        expected = [col for col in self.improved_features if col in self.demographics.columns]
+        self.assertEqual(index.columns, expected)
+        self.assertTrue(index.matrix.flags['C_CONTIGUOUS'], "Matrix should be contiguous")
+
+    def test_unknown_zipcode(self):
+        """Test that unknown zipcodes are reported as missing"""
+        index = DemographicsIndex(self.demographics)
+        self.assertNotIn("99999", index)
+        self.assertIsNone(index.offset("99999"))
+        self.assertIsNone(index.row("99999"))
+        self.assertEqual(index.offsets_for(["99999", self.demographics['zipcode'][0]]).tolist(), [-1, 0])
+
+class TestFeatureAssembler(unittest.TestCase):
+    """Test suite for the pandas-free feature assembly fast path"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up test fixtures once for all tests"""
+        script_dir = os.path.dirname(__file__)
+        cls.features = {}
+        for name, path in (("basic", "model_features.json"), ("improved", "model_features_improved.json")):
+            try:
+                with open(os.path.join(script_dir, "..", "model", path), "r") as f:
+                    cls.features[name] = json.load(f)
+            except FileNotFoundError:
+                cls.features[name] = None
+        cls.models = {"basic": "model.pkl", "improved": "model_improved.pkl"}
+
+        cls.demographics = pd.read_csv(os.path.join(script_dir, "data", "zipcode_demographics.csv"), dtype={'zipcode': str})
+        examples = pd.read_csv(os.path.join(script_dir, "data", "future_unseen_examples.csv"), dtype={'zipcode': str})
+        examples['sale_year'] = 2023
+        examples['sale_month'] = 6
+        cls.payloads = examples.to_dict(orient="records")
+        cls.merged = pd.merge(examples, cls.demographics, on='zipcode', how='left').drop(columns=['zipcode'])
+        cls.geo_index = None
+        if cls.features["improved"] and uses_geo_features(cls.features["improved"]):
+            cls.geo_index = load_geo_index(root=os.path.join(script_dir, "..", "model", "artifacts"))
+            cls.merged = add_geo_features(cls.merged, cls.geo_index)
+
+    def _check_parity(self, name, dtype):
+        features = self.features[name]
+        reference_model = load_model(self.models[name])
+        if features is None or reference_model is None:
+            self.skipTest(f"{name} model or features not found - skipping test")
+        fast_model = drop_feature_names(load_model(self.models[name]))
+        geo_index = self.geo_index if uses_geo_features(features) else None
+        assembler = FeatureAssembler(features, DemographicsIndex(self.demographics, features), dtype=dtype, geo_index=geo_index)
+        offsets = assembler.index.offsets_for([p['zipcode'] for p in self.payloads])
+
+        expected = reference_model.predict(self.merged[features])
+        batch = fast_model.predict(assembler.assemble_batch(self.payloads, offsets))
+        single = np.array([fast_model.predict(assembler.assemble(p, o))[0] for p, o in zip(self.payloads, offsets)])
+        np.testing.assert_array_equal(batch, expected)
+        np.testing.assert_array_equal(single, expected)
+
+    def test_basic_predictions_bit_identical(self):
+        """Test that the basic model fast path matches the DataFrame path exactly"""
+        self._check_parity("basic", np.float64)
+
+    def test_improved_predictions_bit_identical(self):
+        """Test that the improved model fast path matches the DataFrame path exactly"""
+        reference_model = load_model(self.models["improved"])
+        if reference_model is None:
+            self.skipTest("improved model not found - skipping test")
+        self._check_parity("improved", input_dtype(reference_model))
+
+class TestArtifacts(unittest.TestCase):
+    """Test suite for the versioned memory-mapped artifact format"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.arrays = {
+            "weights": np.arange(12, dtype=np.float64).reshape(3, 4),
+            "nodes": np.array([(0, 1.5), (2, -1.0)], dtype=[('feature', '<i8'), ('threshold', '<f8')]),
+            "empty": np.empty((0, 3), dtype=np.int32),
+        }
+
+    def test_round_trip(self):
+        """Test that arrays and metadata come back memory-mapped and unchanged"""
+        version = write_artifact("demo", self.arrays, {"features": ["a", "b"]}, self.root)
+        self.assertEqual(version, 1)
+        artifact = read_artifact("demo", root=self.root)
+        self.assertEqual(artifact.meta, {"features": ["a", "b"]})
+        self.assertIsInstance(artifact["weights"], np.memmap)
+        self.assertFalse(artifact["weights"].flags.writeable, "Mapped arrays should be read-only")
+        for key, array in self.arrays.items():
+            np.testing.assert_array_equal(artifact[key], array)
+            self.assertEqual(artifact[key].dtype, array.dtype)
+
+    def test_versions_and_latest(self):
+        """Test that each write creates a new version and moves LATEST"""
+        write_artifact("demo", self.arrays, {"run": 1}, self.root)
+        write_artifact("demo", self.arrays, {"run": 2}, self.root)
+        self.assertEqual(latest_version("demo", self.root), 2)
+        self.assertEqual(read_artifact("demo", root=self.root).meta, {"run": 2})
+        self.assertEqual(read_artifact("demo", version=1, root=self.root).meta, {"run": 1})
+
+    def test_corruption_detected(self):
+        """Test that a modified array file fails checksum verification"""
+        write_artifact("demo", self.arrays, {}, self.root)
+        path = os.path.join(self.root, "demo", "v0001", "weights.bin")
+        with open(path, "r+b") as f:
+            f.write(b"\xff")
+        with self.assertRaises(ArtifactError):
+            read_artifact("demo", root=self.root, verify=True)
+        read_artifact("demo", root=self.root)
+
+    def test_missing_artifact(self):
+        """Test that a missing artifact raises FileNotFoundError"""
+        with self.assertRaises(FileNotFoundError):
+            read_artifact("missing", root=self.root)
+
+class CountingModel:
+    """Stand-in model that records how many rows it was asked to predict"""
+
+    def __init__(self):
+        self.rows = 0
+        self.calls = 0
+
+    def predict(self, X):
+        self.rows += len(X)
+        self.calls += 1
+        return X.sum(axis=1)
+
+class TestPredictionCache(unittest.TestCase):
+    """Test suite for the in-process prediction cache"""
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first"""
+        cache = PredictionCache(maxsize=2)
+        cache.put("a", 1.0)
+        cache.put("b", 2.0)
+        cache.get("a")
+        cache.put("c", 3.0)
+        self.assertIsNone(cache.get("b"), "Least recently used entry should be evicted")
+        self.assertEqual(cache.get("a"), 1.0)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_ttl_expiry(self):
+        """Test that entries expire after the TTL"""
+        now = [0.0]
+        cache = PredictionCache(maxsize=10, ttl=5.0, clock=lambda: now[0])
+        cache.put("a", 1.0)
+        now[0] = 4.0
+        self.assertEqual(cache.get("a"), 1.0)
+        now[0] = 5.0
+        self.assertIsNone(cache.get("a"), "Entry should expire at its TTL")
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_predict_only_computes_misses(self):
+        """Test that cached rows are not sent to the model again"""
+        cache = PredictionCache(maxsize=100)
+        model = CountingModel()
+        X = np.arange(12, dtype=np.float64).reshape(4, 3)
+        np.testing.assert_array_equal(cache.predict("m", model, X[:2]), X[:2].sum(axis=1))
+        np.testing.assert_array_equal(cache.predict("m", model, X), X.sum(axis=1))
+        self.assertEqual(model.rows, 4, "Only the two uncached rows should be predicted")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 4))
+
+    def test_invalidate_model(self):
+        """Test that invalidating one model keeps the other model's entries"""
+        cache = PredictionCache(maxsize=100)
+        X = np.ones((1, 3))
+        cache.predict("old", CountingModel(), X)
+        cache.predict("other", CountingModel(), X)
+        cache.invalidate("old")
+        self.assertEqual(len(cache), 1)
+        model = CountingModel()
+        cache.predict("old", model, X)
+        self.assertEqual(model.rows, 1, "Invalidated entries should be recomputed")
+
+class TestMicroBatcher(unittest.TestCase):
+    def run_requests(self, batcher, rows):
+        async def run():
+            try:
+                return await asyncio.gather(*(batcher.submit(row) for row in rows))
+            finally:
+                await batcher.stop()
+        return asyncio.run(run())
+
+    def test_concurrent_requests_share_a_batch(self):
+        """Test that concurrent submits are coalesced and each gets its own prediction"""
+        model = CountingModel()
+        batcher = MicroBatcher(model.predict, max_batch_size=8, max_wait_ms=50)
+        rows = [np.full((1, 3), i, dtype=np.float64) for i in range(8)]
+        predictions = self.run_requests(batcher, rows)
+        self.assertEqual(predictions, [3.0 * i for i in range(8)])
+        self.assertEqual(model.calls, 1, "Eight concurrent rows should be scored in one call")
+        self.assertEqual(batcher.stats()["batch_size_histogram"]["le_8"], 1)
+
+    def test_max_batch_size(self):
+        """Test that no batch exceeds max_batch_size"""
+        model = CountingModel()
+        batcher = MicroBatcher(model.predict, max_batch_size=4, max_wait_ms=50)
+        rows = [np.full((1, 3), i, dtype=np.float64) for i in range(10)]
+        predictions = self.run_requests(batcher, rows)
+        self.assertEqual(predictions, [3.0 * i for i in range(10)])
+        self.assertEqual(model.calls, 3)
+        self.assertEqual(batcher.stats()["rows"], 10)
+
+    def test_errors_reach_every_request(self):
+        """Test that a failing predict call fails each request in the batch"""
+        def predict(X):
+            raise ValueError("bad batch")
+        batcher = MicroBatcher(predict, max_batch_size=4, max_wait_ms=50)
+        with self.assertRaises(ValueError):
+            self.run_requests(batcher, [np.ones((1, 3)), np.ones((1, 3))])
+
+    def test_expired_rows_are_not_scored(self):
+        """Test that a row past its deadline fails without reaching the model while the others are scored"""
+        model = CountingModel()
+        batcher = MicroBatcher(model.predict, max_batch_size=4, max_wait_ms=5)
+
+        async def run():
+            try:
+                return await asyncio.gather(batcher.submit(np.ones((1, 3)), time.monotonic() - 1),
+                                            batcher.submit(np.ones((1, 3)), time.monotonic() + 60),
+                                            return_exceptions=True)
+            finally:
+                await batcher.stop()
+        expired, scored = asyncio.run(run())
+        self.assertIsInstance(expired, DeadlineExceeded)
+        self.assertEqual(scored, 3.0)
+        self.assertEqual(model.rows, 1)
+        self.assertEqual(batcher.stats()["expired"], 1)
+
+def spin(seconds):
+    """Busy loop, so the profiler finds this frame on the stack"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def background_work(seconds):
+    spin(seconds)
+
+class TestSamplingProfiler(unittest.TestCase):
+    """Test suite for the on-demand route profiler"""
+
+    def test_samples_attributed_to_routes(self):
+        """Test that loop samples follow the registered task and thread samples their labelled frames"""
+        profiler = SamplingProfiler(labels={background_work.__code__: "/batch"})
+        self.assertFalse(profiler.active)
+
+        async def request(route):
+            token = profiler.enter(route)
+            try:
+                spin(0.1)
+            finally:
+                profiler.exit(token)
+
+        async def run():
+            capture = asyncio.ensure_future(profiler.capture(seconds=10, requests=2, interval=0.002))
+            await asyncio.sleep(0.01)
+            self.assertTrue(profiler.active)
+            with self.assertRaises(ProfilerBusy):
+                await profiler.capture(seconds=1)
+            await asyncio.gather(request("/a"), asyncio.to_thread(background_work, 0.1))
+            await request("/b")
+            return await capture
+        result = asyncio.run(run())
+
+        self.assertFalse(profiler.active)
+        self.assertEqual(result.requests, 2)
+        self.assertLess(result.seconds, 5, "The capture should end once the requests are done")
+        routes = result.summary()["routes"]
+        self.assertEqual(set(routes), {"/a", "/b", "/batch"})
+        for route in ("/a", "/b", "/batch"):
+            self.assertTrue(any(name.startswith("spin ") for name in routes[route]["self"]),
+                            f"{route} should be sampled inside spin")
+        for line in result.collapsed().splitlines():
+            stack, count = line.rsplit(" ", 1)
+            self.assertIn(stack.split(";")[0], routes)
+            self.assertGreater(int(count), 0)
+        self.assertIn("<svg", result.svg())
+
+    def test_short_capture_has_samples(self):
+        """Test that a short capture of one busy request attributes samples"""
+        profiler = SamplingProfiler()
+
+        async def run():
+            capture = asyncio.ensure_future(profiler.capture(seconds=10, requests=1, interval=0.002))
+            await asyncio.sleep(0.01)
+            token = profiler.enter("/a")
+            try:
+                spin(0.05)
+            finally:
+                profiler.exit(token)
+            return await capture
+        result = asyncio.run(run())
+        self.assertGreater(sum(result.stacks.values()), 0)
+        self.assertGreater(result.summary()["routes"]["/a"]["samples"], 0)
+
+    def test_frame_name_without_qualname(self):
+        """Test that code objects without co_qualname (before Python 3.11) are named by co_name"""
+        code = types.SimpleNamespace(co_name="predict", co_filename="/srv/src/main.py", co_firstlineno=12)
+        self.assertEqual(frame_name(code), "predict (main.py:12)")
+        self.assertEqual(frame_name(spin.__code__), f"spin (test_serving.py:{spin.__code__.co_firstlineno})")
+
+class TestAdmissionLimiter(unittest.TestCase):
+    """Test suite for per-model admission control"""
+
+    def test_queue_then_shed(self):
+        """Test that requests beyond the limit queue in order, overflow is shed and slots are handed over"""
+        limiter = AdmissionLimiter("m", max_concurrency=1, max_queue=1, retry_after=3)
+
+        async def run():
+            await limiter.acquire()
+            waiting = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            with self.assertRaises(Overloaded) as shed:
+                await limiter.acquire()
+            self.assertEqual(shed.exception.retry_after, 3)
+            self.assertFalse(waiting.done())
+            limiter.release()
+            await waiting
+            self.assertEqual(limiter.active, 1, "The released slot should pass straight to the queued request")
+            limiter.release()
+        asyncio.run(run())
+        stats = limiter.stats()
+        self.assertEqual((stats["active"], stats["waiting"]), (0, 0))
+        self.assertEqual((stats["admitted"], stats["queued"], stats["shed"]), (2, 1, 1))
+
+    def test_deadline_while_queued(self):
+        """Test that a queued request gives up at its deadline and leaves the queue"""
+        limiter = AdmissionLimiter("m", max_concurrency=1, max_queue=4)
+
+        async def run():
+            await limiter.acquire()
+            with self.assertRaises(DeadlineExceeded):
+                await limiter.acquire(time.monotonic() + 0.01)
+            with self.assertRaises(DeadlineExceeded):
+                await limiter.acquire(time.monotonic() - 1)
+            limiter.release()
+        asyncio.run(run())
+        stats = limiter.stats()
+        self.assertEqual((stats["active"], stats["waiting"], stats["timeout"]), (0, 0, 2))
+
+    def test_request_deadline(self):
+        """Test that the header timeout wins over the default and that zero or invalid values mean none"""
+        self.assertEqual(request_deadline("250", 1000, clock=lambda: 10.0), 10.25)
+        self.assertEqual(request_deadline(None, 1000, clock=lambda: 10.0), 11.0)
+        self.assertEqual(request_deadline("soon", 1000, clock=lambda: 10.0), 11.0)
+        self.assertIsNone(request_deadline(None, 0))
+        self.assertIsNone(request_deadline("0", 1000))
+
+class ScaledModel:
+    """Stand-in model predicting ``factor`` times the row sum"""
+
+    def __init__(self, factor):
+        self.factor = factor
+
+    def predict(self, X):
+        return X.sum(axis=1) * self.factor
+
+class TestModelRegistry(unittest.TestCase):
+    """Test suite for hot-swapping model versions"""
+
+    def setUp(self):
+        demographics = pd.DataFrame({"zipcode": ["1", "2"], "households": [10.0, 20.0]})
+        self.index = DemographicsIndex(demographics, ["rooms", "households"])
+        self.rows = [{"zipcode": "1", "rooms": 3}, {"zipcode": "2", "rooms": 5}]
+        # Version -> prediction factor of the model saved as that version
+        self.factors = {1: 1.0, 2: 1.1, 3: 5.0, 4: -1.0}
+
+    def served(self, version):
+        model = ScaledModel(self.factors[version])
+        assembler = FeatureAssembler(["rooms", "households"], self.index)
+        return ServedModel("demo", version, model, assembler, ("demo", version), MicroBatcher(model.predict, max_wait_ms=0))
+
+    def registry(self):
+        def loader(name, version):
+            if version not in self.factors:
+                raise FileNotFoundError(version)
+            return self.served(version)
+        registry = ModelRegistry(loader, self.rows, PredictionCache(maxsize=100), max_change=0.5)
+        registry.models["demo"] = self.served(1)
+        return registry
+
+    def test_reload_swaps_version(self):
+        """Test that a passing version is swapped in and in-flight requests finish on the old one"""
+        registry = self.registry()
+        old = registry["demo"]
+
+        async def run():
+            in_flight = asyncio.ensure_future(old.batcher.submit(np.array([[1.0, 1.0]])))
+            await asyncio.sleep(0)
+            report = await registry.reload("demo", 2)
+            return await in_flight, report
+        prediction, report = asyncio.run(run())
+        self.assertEqual(prediction, 2.0, "The queued row should be scored by the old version")
+        self.assertTrue(report["swapped"])
+        self.assertEqual((report["previous_version"], report["version"]), (1, 2))
+        self.assertAlmostEqual(report["median_relative_change"], 0.1)
+        self.assertEqual(registry["demo"].version, 2)
+
+    def test_large_change_rejected(self):
+        """Test that a version whose predictions move too far is not swapped in"""
+        registry = self.registry()
+        with self.assertRaises(ReloadError):
+            asyncio.run(registry.reload("demo", 3))
+        self.assertEqual(registry["demo"].version, 1)
+        self.assertEqual(registry.rejected, {"demo": 3})
+
+    def test_non_positive_predictions_rejected(self):
+        """Test that negative prices fail the sanity check"""
+        registry = self.registry()
+        with self.assertRaises(ReloadError):
+            asyncio.run(registry.reload("demo", 4))
+        self.assertEqual(registry["demo"].version, 1)
+
+    def test_same_version_is_a_no_op(self):
+        """Test that reloading the serving version only swaps when forced"""
+        registry = self.registry()
+        old = registry["demo"]
+        self.assertFalse(asyncio.run(registry.reload("demo", 1))["swapped"])
+        self.assertIs(registry["demo"], old)
+        self.assertTrue(asyncio.run(registry.reload("demo", 1, force=True))["swapped"])
+        self.assertIsNot(registry["demo"], old)
+
+    def test_missing_version(self):
+        """Test that a missing version raises FileNotFoundError"""
+        with self.assertRaises(FileNotFoundError):
+            asyncio.run(self.registry().reload("demo", 9))
+
+class TestUnexplainableModel(unittest.TestCase):
+    """Test suite for serving an improved model that has no explainer"""
+
+    def test_startup_without_node_values(self):
+        """Test that the API starts on a histogram GBM artifact without node values and only explaining fails"""
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        root = os.path.join(script_dir, "..", "model", "artifacts")
+        if any(latest_version(name, root) is None for name in ("basic", "improved")):
+            self.skipTest("Model artifacts not found. Run create_model.py and create_improved_model.py first.")
+        improved = read_artifact("improved", root=root)
+        features = improved.meta['features']
+        geo_index = load_geo_index(improved.meta, root) if uses_geo_features(features) else None
+        X, y = chunk_features(load_training_table().head(2000), geo_index, features)
+        model = HistGradientBoostingRegressor(max_iter=20).fit(X, y)
+        arrays, meta = CompiledEnsemble.from_model(model).to_artifact()
+        del meta['node_values']
+        meta.update({key: improved.meta[key] for key in ('features', 'geo_version') if key in improved.meta})
+        meta['estimator'] = "HistGradientBoostingRegressor"
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("basic", "geo", "profile"):
+                if os.path.isdir(os.path.join(root, name)):
+                    shutil.copytree(os.path.join(root, name), os.path.join(tmp, name))
+            write_artifact("improved", arrays, meta, tmp)
+            script = ("import json\n"
+                      "from fastapi.testclient import TestClient\n"
+                      "import main\n"
+                      "with TestClient(main.app) as client:\n"
+                      "    print(json.dumps({path: client.post('/' + path, json=main.WARMUP_HOUSE).status_code\n"
+                      "                      for path in ('predict_improved', 'explain_improved')}))\n")
+            result = subprocess.run([sys.executable, "-c", script], cwd=script_dir, capture_output=True, text=True,
+                                    env={**os.environ, "MODEL_ARTIFACTS_DIR": tmp}, timeout=300)
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        statuses = json.loads(result.stdout.strip().splitlines()[-1])
+        self.assertEqual(statuses, {"predict_improved": 200, "explain_improved": 501})
+
+class TestProfileEndpoint(unittest.TestCase):
+    """Test suite for the authentication of POST /admin/profile"""
+
+    def profile_statuses(self, admin_token, headers):
+        """Status of POST /admin/profile with each of ``headers`` on an app started with PROFILER=1"""
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        if latest_version("basic", os.path.join(script_dir, "..", "model", "artifacts")) is None:
+            self.skipTest("Model artifacts not found. Run create_model.py and create_improved_model.py first.")
+        env = {key: value for key, value in os.environ.items() if key != "ADMIN_TOKEN"}
+        env["PROFILER"] = "1"
+        if admin_token is not None:
+            env["ADMIN_TOKEN"] = admin_token
+        script = ("import json, sys\n"
+                  "from fastapi.testclient import TestClient\n"
+                  "import main\n"
+                  "with TestClient(main.app) as client:\n"
+                  "    print(json.dumps([client.post('/admin/profile', params={'seconds': 0.05}, headers=headers).status_code\n"
+                  "                      for headers in json.loads(sys.argv[1])]))\n")
+        result = subprocess.run([sys.executable, "-c", script, json.dumps(headers)], cwd=script_dir, capture_output=True,
+                                text=True, env=env, timeout=300)
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def test_profiler_needs_admin_token(self):
+        """Test that PROFILER=1 without ADMIN_TOKEN leaves profiling off for everyone"""
+        self.assertEqual(self.profile_statuses(None, [{}, {"X-Admin-Token": ""}]), [404, 404])
+
+    def test_unauthenticated_capture_rejected(self):
+        """Test that captures without the admin token are refused"""
+        statuses = self.profile_statuses("secret", [{}, {"X-Admin-Token": "wrong"}, {"X-Admin-Token": "secret"}])
+        self.assertEqual(statuses, [403, 403, 200])
+
+class House(BaseModel):
+    rooms: int
+    area: float
+    zipcode: str
+    sale_year: Optional[int] = None
+
+class TestWireFormats(unittest.TestCase):
+    """Test suite for the columnar batch encodings"""
+
+    def setUp(self):
+        self.specs = field_specs(House)
+        self.defaults = {"sale_year": 2015}
+
+    def test_formats_decode_to_the_same_columns(self):
+        """Test that columnar JSON (raw or already parsed), NDJSON and NumPy bodies decode to the same validated columns"""
+        records = np.array([(3, 1200.0, "98118"), (4, 1500.5, "98001")],
+                           dtype=[("rooms", "i8"), ("area", "f8"), ("zipcode", "U5")])
+        npy = io.BytesIO()
+        np.save(npy, records)
+        bodies = {
+            JSON: json.dumps({"rooms": [3, 4], "area": [1200.0, 1500.5], "zipcode": ["98118", "98001"]}).encode(),
+            NDJSON: b'{"rooms": 3, "area": 1200.0, "zipcode": "98118"}\n{"rooms": 4, "area": 1500.5, "zipcode": "98001"}\n',
+            NPY: npy.getvalue(),
+        }
+        for content_type, body in [*bodies.items(), (JSON, json.loads(bodies[JSON]))]:
+            with self.subTest(content_type=content_type, parsed=isinstance(body, dict)):
+                columns, n = validate_columns(decode_columns(body, content_type), self.specs, self.defaults)
+                self.assertEqual(n, 2)
+                np.testing.assert_array_equal(columns["rooms"], [3.0, 4.0])
+                np.testing.assert_array_equal(columns["area"], [1200.0, 1500.5])
+                self.assertEqual(columns["zipcode"].tolist(), ["98118", "98001"])
+                np.testing.assert_array_equal(columns["sale_year"], [2015, 2015])
+
+    def test_invalid_columns_rejected(self):
+        """Test that missing fields, non-integers, missing values and ragged columns are rejected"""
+        bad = [
+            {"rooms": [3], "zipcode": ["98118"]},
+            {"rooms": [3.5], "area": [1.0], "zipcode": ["98118"]},
+            {"rooms": [3], "area": [None], "zipcode": ["98118"]},
+            {"rooms": [3, 4], "area": [1.0], "zipcode": ["98118"]},
+        ]
+        for columns in bad:
+            with self.subTest(columns=columns):
+                with self.assertRaises(WireFormatError):
+                    validate_columns(decode_columns(json.dumps(columns).encode(), JSON), self.specs)
+
+    def test_numeric_zipcodes_become_text(self):
+        """Test that zipcodes sent as numbers match the text zipcodes of the demographics index"""
+        columns, _ = validate_columns({"rooms": np.array([3]), "area": np.array([1.0]), "zipcode": np.array([98118.0])},
+                                      self.specs)
+        self.assertEqual(columns["zipcode"].tolist(), ["98118"])
+
+    def test_ndjson_blocks(self):
+        """Test that a chunked NDJSON stream is regrouped into whole lines"""
+        async def chunks():
+            for chunk in (b'{"a": 1}\n{"a"', b': 2}\n\n{"a": 3}\n{"a": 4}'):
+                yield chunk
+
+        async def collect():
+            return [block async for block in ndjson_blocks(chunks(), 3)]
+        self.assertEqual(asyncio.run(collect()), [b'{"a": 1}\n{"a": 2}\n{"a": 3}', b'{"a": 4}'])
+
+    def test_negotiate(self):
+        """Test that the first supported Accept type wins and JSON is the default"""
+        self.assertEqual(negotiate("text/html, application/x-npy;q=0.9"), NPY)
+        self.assertEqual(negotiate(None), JSON)
+        self.assertEqual(negotiate("*/*"), JSON)
+
+class TestDriftMonitor(unittest.TestCase):
+    """Test suite for the streaming feature drift monitor"""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.reference = pd.DataFrame({"sqft_living": rng.normal(2000, 500, 5000), "view": rng.integers(0, 3, 5000)})
+        root = tempfile.mkdtemp()
+        write_artifact("profile", *build_profile(self.reference, np.ones(5000, dtype=bool), ("sqft_living", "view")), root)
+        index = DemographicsIndex(pd.DataFrame({"zipcode": ["98001"], "population": [1.0]}))
+        self.monitor = DriftMonitor(read_artifact("profile", root=root), index, flush_rows=16, min_count=50)
+
+    def observe(self, frame, zipcode="98001"):
+        for row in frame.to_dict(orient="records"):
+            self.monitor.observe(dict(row, zipcode=zipcode))
+
+    def test_reference_traffic_is_stable(self):
+        """Test that traffic drawn like the training data scores no drift and matching statistics"""
+        self.observe(self.reference.sample(1000, random_state=1))
+        report = self.monitor.report()
+        self.assertEqual(report["rows"], 1000, "Buffered rows should be flushed before reporting")
+        self.assertEqual(report["drifted"], [])
+        self.assertLess(report["max_psi"], 0.05)
+        living = report["features"]["sqft_living"]
+        self.assertAlmostEqual(living["mean"], 2000, delta=50)
+        self.assertAlmostEqual(living["std"], 500, delta=50)
+        self.assertAlmostEqual(living["quantiles"]["0.5"], 2000, delta=60)
+
+    def test_shifted_traffic_drifts(self):
+        """Test that a shifted feature is flagged, an unchanged one is not, and unknown zipcodes are counted"""
+        shifted = self.reference.sample(500, random_state=1).assign(sqft_living=lambda frame: frame["sqft_living"] + 800)
+        self.observe(shifted)
+        self.observe(shifted.head(100), zipcode="00000")
+        report = self.monitor.report()
+        self.assertEqual(report["drifted"], ["sqft_living"])
+        self.assertEqual(report["features"]["sqft_living"]["drift"], "major")
+        self.assertGreater(report["features"]["sqft_living"]["mean_shift"], 1.4)
+        self.assertAlmostEqual(report["unknown_zipcode_rate"], 100 / 600)
+
+    def test_partial_payloads_columns_and_reset(self):
+        """Test that missing fields are skipped, columnar batches are counted, and reset clears the sketches"""
+        for _ in range(30):
+            self.monitor.observe({"sqft_living": 1800.0, "zipcode": "98001"})
+        self.monitor.observe_columns({"sqft_living": np.full(40, 2100.0), "view": np.ones(40)}, 40, unknown_zipcodes=4)
+        report = self.monitor.report()
+        self.assertEqual(report["rows"], 70)
+        self.assertEqual(report["features"]["view"]["count"], 40)
+        self.assertEqual(report["features"]["view"]["drift"], "insufficient data")
+        self.assertEqual(report["features"]["sqft_living"]["min"], 1800.0)
+        self.assertEqual(report["features"]["sqft_living"]["max"], 2100.0)
+        self.monitor.reset()
+        report = self.monitor.report()
+        self.assertEqual(report["rows"], 0)
+        self.assertIsNone(report["unknown_zipcode_rate"])
+        self.assertNotIn("psi", report["features"]["sqft_living"])
+
+class TestReadyWorkers(unittest.TestCase):
+    def test_ready_once_all_workers_warm(self):
+        """Test that readiness latches once the expected number of workers has warmed up"""
+        workers = ReadyWorkers(expected=2, slots=4)
+        workers.add(101)
+        self.assertFalse(workers.all_ready)
+        workers.add(101)
+        self.assertEqual(len(workers), 1, "Adding a worker twice should count it once")
+        workers.add(102)
+        self.assertTrue(workers.all_ready)
+        workers.discard(101)
+        self.assertNotIn(101, workers)
+        self.assertTrue(workers.all_ready, "A recycled worker should not flip readiness back off")
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_exposition(self):
+        """Test that histogram buckets are cumulative and rendered in Prometheus format"""
+        histogram = Histogram("latency_seconds", "Latency.", ("route",), (("/a", "/b"),), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(("/a",), value)
+        histogram.observe(("/unknown",), 0.5)
+        self.assertEqual(histogram.count(("/a",)), 3)
+        lines = render([histogram]).splitlines()
+        self.assertIn("# TYPE latency_seconds histogram", lines)
+        self.assertIn('latency_seconds_bucket{route="/a",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{route="/a",le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{route="/a",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{route="/a"} 5.55', lines)
+        self.assertIn('latency_seconds_count{route="/b"} 0', lines)
+
+    def test_counter(self):
+        """Test counter increments per label combination"""
+        counter = Counter("requests_total", "Requests.", ("status",), (("2xx", "5xx"),))
+        counter.inc(("2xx",))
+        counter.inc(("2xx",), 2)
+        self.assertEqual(counter.value(("2xx",)), 3)
+        self.assertIn('requests_total{status="5xx"} 0', render([counter]).splitlines())
+
+    def test_stage_timer(self):
+        """Test that each mark records the time since the previous one"""
+        now = [0.0]
+        histogram = Histogram("stage_seconds", "Stages.", ("route", "stage"), (("/a",), ("parse", "predict")), buckets=(1.0, 2.0))
+        timer = StageTimer(histogram, "/a", clock=lambda: now[0])
+        now[0] = 0.5
+        timer.mark("parse")
+        now[0] = 2.0
+        timer.mark("predict")
+        lines = render([histogram]).splitlines()
+        self.assertIn('stage_seconds_bucket{route="/a",stage="parse",le="1.0"} 1', lines)
+        self.assertIn('stage_seconds_bucket{route="/a",stage="predict",le="1.0"} 0', lines)
+        self.assertIn('stage_seconds_bucket{route="/a",stage="predict",le="2.0"} 1', lines)
+        self.assertEqual(timer.elapsed(), 2.0)
+
+class TestBenchmarkGates(unittest.TestCase):
+    def test_summarize(self):
+        """Test latency percentiles and throughput of one load level"""
+        stats = summarize([0.001] * 99 + [0.1], elapsed=2.0)
+        self.assertEqual(stats["requests"], 100)
+        self.assertAlmostEqual(stats["p50_ms"], 1.0)
+        self.assertAlmostEqual(stats["rps"], 50.0)
+
+    def test_regressions_beyond_threshold_fail(self):
+        """Test that slower latency or lower throughput past the threshold is reported"""
+        baseline = {"http": {"predict": {"c1": {"p99_ms": 10.0, "rps": 100.0}}},
+                    "micro": {"basic.predict_row": {"median_us": 50.0}}}
+        within = {"http": {"predict": {"c1": {"p99_ms": 11.0, "rps": 90.0}}},
+                  "micro": {"basic.predict_row": {"median_us": 40.0}}}
+        self.assertEqual(compare(within, baseline, max_regression=0.2), [])
+        worse = {"http": {"predict": {"c1": {"p99_ms": 13.0, "rps": 70.0}}},
+                 "micro": {"basic.predict_row": {"median_us": 70.0}, "new.metric": {"median_us": 1.0}}}
+        regressions = compare(worse, baseline, max_regression=0.2)
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(regressions[0].startswith("http.predict.c1.p99_ms"))
+
+    def test_failed_requests_fail_the_gate(self):
+        """Test that failing requests are a regression and reported even when they are fast"""
+        baseline = {"http": {"predict": {"c1": {"p99_ms": 10.0, "rps": 100.0, "errors": 0}}}}
+        failing = {"http": {"predict": {"c1": {"p99_ms": 1.0, "rps": 1000.0, "errors": 500}}}}
+        self.assertEqual(compare(failing, baseline), ["http.predict.c1.errors: 0 -> 500"])
+        self.assertEqual(failed_requests(failing), ["http.predict.c1: 500 of the requests failed"])
+        self.assertEqual(failed_requests(baseline), [])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
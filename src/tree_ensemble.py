@@ -0,0 +1,249 @@
+import numpy as np
+import pickle, json, os
+
+from artifacts import ARTIFACTS_DIR, latest_version, read_artifact, write_artifact
+from geo_features import uses_geo_features
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "..", "model")
+IMPROVED_MODEL_PATH = os.path.join(MODEL_DIR, "model_improved.pkl")
+IMPROVED_FEATURES_PATH = os.path.join(MODEL_DIR, "model_features_improved.json")
+
+class CompiledEnsemble:
+    """A GradientBoostingRegressor (or HistGradientBoostingRegressor) flattened into packed node arrays.
+
+    All trees live in one set of arrays indexed by a global node id. Leaves
+    point back to themselves, so every row can be pushed down all trees at
+    once for ``max_depth`` levels without checking whether it already
+    stopped. Leaf values are stored pre-multiplied by the learning rate and
+    summed in stage order, which reproduces ``model.predict`` bit for bit.
+    ``dtype`` is the precision the original model compares features in:
+    float32 for GradientBoostingRegressor, float64 for the histogram model.
+    Split nodes hold the mean value of the training rows that reached them
+    (``node_values``), which explanations.py needs to attribute predictions
+    to features.
+    """
+
+    ARRAYS = ('feature', 'threshold', 'left', 'right', 'missing_left', 'value', 'roots')
+
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots, init, max_depth, n_features,
+                 dtype='float32', node_values=True):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.init = float(init)
+        self.max_depth = int(max_depth)
+        self.n_features = int(n_features)
+        self.dtype = np.dtype(dtype)
+        self.node_values = bool(node_values)
+
+    @classmethod
+    def from_gradient_boosting(cls, model):
+        """Flatten a fitted single-output GradientBoostingRegressor."""
+        trees = [estimator.tree_ for estimator in model.estimators_[:, 0]]
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+        feature, threshold, left, right, missing_left, value = [], [], [], [], [], []
+        for offset, tree in zip(offsets, trees):
+            node_ids = np.arange(tree.node_count) + offset
+            is_leaf = tree.children_left == -1
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+            left.append(np.where(is_leaf, node_ids, tree.children_left + offset))
+            right.append(np.where(is_leaf, node_ids, tree.children_right + offset))
+            missing = getattr(tree, 'missing_go_to_left', None)
+            missing_left.append(np.zeros(tree.node_count, dtype=bool) if missing is None else missing.astype(bool))
+            value.append(model.learning_rate * tree.value[:, 0, 0])
+
+        n_features = model.n_features_in_
+        if model.init_ == 'zero':
+            init = 0.0
+        else:
+            init = model.init_.predict(np.zeros((1, n_features)))[0]
+        return cls(
+            feature=np.concatenate(feature).astype(np.intp),
+            threshold=np.concatenate(threshold).astype(np.float64),
+            left=np.concatenate(left).astype(np.intp),
+            right=np.concatenate(right).astype(np.intp),
+            missing_left=np.concatenate(missing_left),
+            value=np.concatenate(value).astype(np.float64),
+            roots=offsets[:-1].astype(np.intp),
+            init=init,
+            max_depth=max(tree.max_depth for tree in trees),
+            n_features=n_features,
+        )
+
+    @classmethod
+    def from_hist_gradient_boosting(cls, model):
+        """Flatten a fitted HistGradientBoostingRegressor with squared error loss.
+
+        Its leaf values already include the learning rate. Unlike
+        GradientBoostingRegressor it compares features as float64, so the
+        ensemble is traversed in float64 too. Split node values are not kept
+        on the same scale, so they are recomputed as the sample-weighted mean
+        of their leaves.
+        """
+        if model._loss.link.__class__.__name__ != 'IdentityLink':
+            raise ValueError("Only HistGradientBoostingRegressor with an identity link can be compiled")
+        trees = [predictors[0].nodes for predictors in model._predictors]
+        if any(nodes['is_categorical'].any() for nodes in trees):
+            raise ValueError("Categorical splits are not supported")
+        offsets = np.cumsum([0] + [len(nodes) for nodes in trees])
+        feature, threshold, left, right, missing_left, value = [], [], [], [], [], []
+        for offset, nodes in zip(offsets, trees):
+            node_ids = np.arange(len(nodes)) + offset
+            is_leaf = nodes['is_leaf'].astype(bool)
+            feature.append(np.where(is_leaf, 0, nodes['feature_idx']))
+            threshold.append(np.where(is_leaf, np.inf, nodes['num_threshold']))
+            left.append(np.where(is_leaf, node_ids, nodes['left'].astype(np.intp) + offset))
+            right.append(np.where(is_leaf, node_ids, nodes['right'].astype(np.intp) + offset))
+            missing_left.append(nodes['missing_go_to_left'].astype(bool) & ~is_leaf)
+            value.append(_split_node_values(nodes, is_leaf))
+
+        return cls(
+            feature=np.concatenate(feature).astype(np.intp),
+            threshold=np.concatenate(threshold).astype(np.float64),
+            left=np.concatenate(left).astype(np.intp),
+            right=np.concatenate(right).astype(np.intp),
+            missing_left=np.concatenate(missing_left),
+            value=np.concatenate(value).astype(np.float64),
+            roots=offsets[:-1].astype(np.intp),
+            init=model._baseline_prediction.ravel()[0],
+            max_depth=max(int(nodes['depth'].max()) for nodes in trees),
+            n_features=model.n_features_in_,
+            dtype='float64',
+        )
+
+    @classmethod
+    def from_model(cls, model):
+        """Flatten either kind of fitted gradient boosting regressor."""
+        if hasattr(model, '_predictors'):
+            return cls.from_hist_gradient_boosting(model)
+        return cls.from_gradient_boosting(model)
+
+    def to_artifact(self):
+        """Arrays and metadata for artifacts.write_artifact."""
+        meta = {'init': self.init, 'max_depth': self.max_depth, 'n_features': self.n_features, 'dtype': self.dtype.name,
+                'node_values': self.node_values}
+        return {name: getattr(self, name) for name in self.ARRAYS}, meta
+
+    @classmethod
+    def from_artifact(cls, artifact):
+        meta = artifact.meta
+        dtype = meta.get('dtype', 'float32')
+        # Histogram models exported before split node values were kept have zeros there
+        node_values = meta.get('node_values', dtype == 'float32')
+        return cls(init=meta['init'], max_depth=meta['max_depth'], n_features=meta['n_features'],
+                   dtype=dtype, node_values=node_values, **{name: artifact[name] for name in cls.ARRAYS})
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def _compile(self):
+        """Derive the traversal arrays once per loaded ensemble."""
+        if self.dtype == np.float32:
+            # x <= t (x float32, t float64) is the same test as x <= the largest float32 not above t
+            threshold = self.threshold.astype(np.float32)
+            rounded_up = threshold.astype(np.float64) > self.threshold
+            threshold[rounded_up] = np.nextafter(threshold[rounded_up], np.float32(-np.inf))
+        else:
+            threshold = np.asarray(self.threshold, dtype=np.float64)
+        self._threshold = threshold
+        # children[2 * node + went_left] picks the next node in a single gather
+        self._children = np.stack([self.right, self.left], axis=1).ravel().astype(np.int32)
+        self._feature32 = self.feature.astype(np.int32)
+        self._roots32 = self.roots.astype(np.int32)[:, None]
+
+    def leaves(self, X):
+        """Leaf node id reached in every tree, shape (n_trees, n_samples)."""
+        if not hasattr(self, '_children'):
+            self._compile()
+        n = X.shape[0]
+        # feature-major copy so each gather is feature * n + row
+        columns = np.ascontiguousarray(X.T).ravel()
+        rows = np.arange(n, dtype=np.int32)
+        nodes = np.repeat(self._roots32, n, axis=1)
+        has_missing = self.missing_left.any() and np.isnan(columns).any()
+        for _ in range(self.max_depth):
+            x = columns[self._feature32[nodes] * n + rows]
+            go_left = x <= self._threshold[nodes]
+            if has_missing:
+                go_left |= np.isnan(x) & self.missing_left[nodes]
+            nodes = self._children[2 * nodes + go_left]
+        return nodes
+
+    def predict(self, X, chunk_size=256):
+        """Score rows of ``X`` (columns in training feature order).
+
+        Rows are processed in small chunks so the (n_trees, chunk) node arrays
+        stay cache resident.
+        """
+        # Compare features in the same precision as the original model does
+        X = self.check_input(X)
+        out = np.empty(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], chunk_size):
+            leaves = self.leaves(X[start:start + chunk_size])
+            out[start:start + leaves.shape[1]] = self.predict_leaves(leaves)
+        return out
+
+    def check_input(self, X):
+        """``X`` as a 2-D array in the ensemble's precision, or ValueError for the wrong number of features."""
+        X = np.asarray(X, dtype=self.dtype)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[-1]} features, but the ensemble expects {self.n_features}")
+        return X
+
+    def predict_leaves(self, leaves):
+        """Predictions from the leaves reached (see ``leaves``)."""
+        stages = np.empty((self.n_trees + 1, leaves.shape[1]), dtype=np.float64)
+        stages[0] = self.init
+        stages[1:] = self.value[leaves]
+        # accumulate adds the stages strictly in order, matching sklearn's predict_stages
+        return np.add.accumulate(stages, axis=0)[-1]
+
+def _split_node_values(nodes, is_leaf):
+    """Leaf values of a histogram GBM tree, with each split node set to the count-weighted mean of its children."""
+    value = np.where(is_leaf, nodes['value'], 0.0)
+    count = nodes['count'].astype(np.float64)
+    # Deepest splits first, so both children are final before their parent
+    for depth in range(int(nodes['depth'].max()) - 1, -1, -1):
+        splits = np.flatnonzero(~is_leaf & (nodes['depth'] == depth))
+        left, right = nodes['left'][splits], nodes['right'][splits]
+        value[splits] = (count[left] * value[left] + count[right] * value[right]) / (count[left] + count[right])
+    return value
+
+def input_dtype(model):
+    """Precision a fitted gradient boosting model compares its features in."""
+    return np.float64 if hasattr(model, '_predictors') else np.float32
+
+def export_compiled_model(model, features, root=ARTIFACTS_DIR, geo_version=None):
+    """Write the flattened ensemble as a new version of the 'improved' artifact.
+
+    ``geo_version`` is the 'geo' artifact version the model's neighborhood features are read from.
+    """
+    compiled = CompiledEnsemble.from_model(model)
+    arrays, meta = compiled.to_artifact()
+    meta['features'] = list(features)
+    meta['estimator'] = type(model).__name__
+    if geo_version is not None:
+        meta['geo_version'] = geo_version
+    return compiled, write_artifact("improved", arrays, meta, root)
+
+def load_compiled_model(version=None, root=ARTIFACTS_DIR):
+    return CompiledEnsemble.from_artifact(read_artifact("improved", version, root))
+
+def main():
+    with open(IMPROVED_MODEL_PATH, "rb") as f:
+        model = pickle.load(f)
+    with open(IMPROVED_FEATURES_PATH, "r") as f:
+        features = json.load(f)
+    # A model with neighborhood features is paired with the geo index written by the same training run
+    geo_version = latest_version("geo") if uses_geo_features(features) else None
+    compiled, version = export_compiled_model(model, features, geo_version=geo_version)
+    print(f"Exported {compiled.n_trees} trees ({len(compiled.value)} nodes) as improved artifact v{version}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Daily model refresh from newly closed sales, without retraining on the full history.
+
+    python update_models.py --sales data/new_sales.csv
+
+Only the new sales are read. Houses are split by a hash of their id
+(out_of_core.holdout_mask). The training share updates the models. The
+held-out share is scored by the serving version and by the updated one, for
+the before/after report.
+
+- basic: the training share is appended to the NeighborIndex of the LATEST
+  'basic' artifact (NeighborIndex.append). The scaler, tree and clusters
+  are not refit. Once the appended rows outnumber ``compact_share`` of the
+  tree's rows or ``max_appended_rows``, whichever is fewer, the tree is
+  rebuilt; exact queries search the appended rows by brute force, so their
+  number is capped in absolute terms.
+- improved: ``stages`` boosting stages are added to model_improved.pkl with
+  warm start, fit to the new sales' residuals of the trees so far. The
+  added trees are shallow (STAGE_PARAMS), since a day's sales are few. The
+  neighborhood features of the new sales come from the model's own geo
+  index, which is not updated; new sales enter it at the next full retrain.
+
+Each updated model becomes a new artifact version with its report in the
+metadata ('update'). A model that got worse on the held-out sales is not
+written unless ``--force`` is given. A running API picks new versions up
+with POST /admin/reload or MODEL_RELOAD_POLL_SECONDS.
+
+Run time follows the number of new sales. The only work proportional to the
+history is copying the basic model's arrays into the new version.
+"""
+import argparse, json, os, pickle, time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error, r2_score
+
+from artifacts import ARTIFACTS_DIR, read_artifact, write_artifact
+from create_improved_model import chunk_features
+from datasets import DEMOGRAPHICS_PATH, load_demographics, training_chunks
+from geo_features import load_geo_index, uses_geo_features
+from neighbors import NeighborIndex
+from out_of_core import HOLDOUT_SHARE, holdout_mask
+from tree_ensemble import IMPROVED_MODEL_PATH, CompiledEnsemble
+
+# Tree size of the added stages. On a few thousand new sales, depth-5 stages fit noise, and the
+# learning rate of a GradientBoostingRegressor applies to all of its stages, so it cannot be lowered instead
+STAGE_PARAMS = {"max_depth": 2, "min_samples_leaf": 50}
+
+def load_new_sales(path):
+    """The new sales as rows of the training table (sales left-joined with demographics)."""
+    return pd.concat(training_chunks(path, demographics_path=DEMOGRAPHICS_PATH), ignore_index=True)
+
+def split_new_sales(table, share=HOLDOUT_SHARE):
+    """(train, held out) rows of ``table``; all sales of a house fall on the same side."""
+    held_out = holdout_mask(table['id'].to_numpy(), share)
+    return table[~held_out], table[held_out]
+
+def scores(y, predictions):
+    if not len(y):
+        return None
+    return {"r2": float(r2_score(y, predictions)) if len(y) > 1 else None,
+            "mae": float(mean_absolute_error(y, predictions))}
+
+def worse(report):
+    """Whether the update made held-out MAE worse (no held-out sales: not worse)."""
+    return report["before"] is not None and report["after"]["mae"] > report["before"]["mae"]
+
+def add_stages(model, X, y, stages, **tree_params):
+    """Fit ``stages`` more boosting stages of ``model`` to its residuals on (X, y), in place (warm start).
+
+    ``tree_params`` (e.g. max_depth) apply to the added trees only. Every
+    parameter changed for the fit except the tree count is restored after it,
+    so clones of the model (cross-validation, evaluate_model) are fit like
+    its original trees.
+    """
+    if hasattr(model, 'n_iter_'):
+        # HistGradientBoostingRegressor: stop only at max_iter, as in out_of_core.fit_chunks
+        count, params = 'max_iter', {'early_stopping': False, 'max_iter': model.n_iter_ + stages}
+    else:
+        count, params = 'n_estimators', {'n_estimators': model.n_estimators_ + stages}
+    params.update(warm_start=True, **tree_params)
+    original = {key: value for key, value in model.get_params(deep=False).items() if key in params and key != count}
+    model.set_params(**params).fit(X, y)
+    return model.set_params(**original)
+
+def update_basic(train, held_out, known_zipcodes, root=ARTIFACTS_DIR, compact_share=0.25, max_appended_rows=10_000,
+                 force=False):
+    """Append the new sales to the basic model's neighbor index; returns the report (version None if not written)."""
+    artifact = read_artifact("basic", root=root)
+    features = artifact.meta['features']
+    train = train[train['zipcode'].isin(known_zipcodes)]
+    held_out = held_out[held_out['zipcode'].isin(known_zipcodes)]
+    index = NeighborIndex.from_artifact(artifact)
+    report = {"base_version": artifact.version, "rows": len(train), "held_out": len(held_out),
+              "before": scores(held_out['price'], index.predict(held_out[features]) if len(held_out) else [])}
+
+    index.append(train[features], train['price'])
+    report["compacted"] = index.appended_rows > min(compact_share * index.tree_rows, max_appended_rows)
+    if report["compacted"]:
+        index.compact()
+    report["appended_rows"] = index.appended_rows
+    report["after"] = scores(held_out['price'], index.predict(held_out[features]) if len(held_out) else [])
+
+    report["version"] = None
+    if len(train) and (force or not worse(report)):
+        arrays, meta = index.to_artifact()
+        meta['features'] = features
+        meta['update'] = report
+        report["version"] = write_artifact("basic", arrays, meta, root)
+    return report
+
+def update_improved(train, held_out, stages=10, root=ARTIFACTS_DIR, model_path=IMPROVED_MODEL_PATH, force=False,
+                    tree_params=STAGE_PARAMS):
+    """Add boosting stages to the improved model fit on the new sales; returns the report (version None if not written).
+
+    model_improved.pkl must be the model of the LATEST 'improved' artifact,
+    since it is what the stages are added to; it is rewritten with them.
+    """
+    artifact = read_artifact("improved", root=root)
+    features = artifact.meta['features']
+    serving = CompiledEnsemble.from_artifact(artifact)
+    with open(model_path, "rb") as f:
+        model = pickle.load(f)
+    compiled = CompiledEnsemble.from_model(model)
+    if compiled.n_trees != serving.n_trees or not np.array_equal(compiled.value, serving.value):
+        raise ValueError(f"{model_path} is not the model of improved artifact v{artifact.version}; "
+                         "export it (tree_ensemble.py) or retrain before updating")
+    geo_index = load_geo_index(artifact.meta, root) if uses_geo_features(features) else None
+
+    # As in training: new training sales leave their own house out of its neighborhood
+    # features, held-out ones are scored the way serving scores them
+    X_held_out, y_held_out = chunk_features(held_out.copy(), geo_index, features, exclude_own=False)
+    report = {"base_version": artifact.version, "rows": len(train), "held_out": len(held_out),
+              "trees_before": serving.n_trees,
+              "before": scores(y_held_out, serving.predict(X_held_out) if len(held_out) else [])}
+    if not len(train):
+        report.update({"trees_after": serving.n_trees, "after": report["before"], "version": None})
+        return report
+
+    X_train, y_train = chunk_features(train.copy(), geo_index, features)
+    add_stages(model, X_train, y_train, stages, **tree_params)
+    compiled = CompiledEnsemble.from_model(model)
+    report.update({"trees_after": compiled.n_trees,
+                   "after": scores(y_held_out, compiled.predict(X_held_out) if len(held_out) else [])})
+
+    report["version"] = None
+    if force or not worse(report):
+        arrays, meta = compiled.to_artifact()
+        meta.update({key: artifact.meta[key] for key in ('features', 'estimator', 'geo_version') if key in artifact.meta})
+        meta['update'] = report
+        report["version"] = write_artifact("improved", arrays, meta, root)
+        # The next update adds its stages to this model, so it replaces the pickle once the artifact is written
+        temporary = f"{model_path}.tmp-{os.getpid()}"
+        with open(temporary, "wb") as f:
+            pickle.dump(model, f)
+        os.replace(temporary, model_path)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the models with newly closed sales, without full refits.")
+    parser.add_argument("--sales", required=True, help="CSV of new sales, in the columns of kc_house_data.csv")
+    parser.add_argument("--models", nargs="+", choices=("basic", "improved"), default=["basic", "improved"])
+    parser.add_argument("--stages", type=int, default=10, help="boosting stages added to the improved model")
+    parser.add_argument("--holdout-share", type=float, default=HOLDOUT_SHARE,
+                        help="share of the new houses held out for the before/after metrics")
+    parser.add_argument("--compact-share", type=float, default=0.25,
+                        help="rebuild the basic model's tree once appended rows exceed this share of it")
+    parser.add_argument("--max-appended-rows", type=int, default=10_000,
+                        help="rebuild the basic model's tree once this many rows are appended, whatever its size")
+    parser.add_argument("--force", action="store_true", help="write models even if the held-out metrics got worse")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    table = load_new_sales(args.sales)
+    train, held_out = split_new_sales(table, args.holdout_share)
+    print(f"Read {len(table):,} new sales ({len(train):,} to train on, {len(held_out):,} held out)")
+    reports = {}
+    if "basic" in args.models:
+        reports["basic"] = update_basic(train, held_out, load_demographics()['zipcode'], compact_share=args.compact_share,
+                                        max_appended_rows=args.max_appended_rows, force=args.force)
+    if "improved" in args.models:
+        reports["improved"] = update_improved(train, held_out, args.stages, force=args.force)
+    for name, report in reports.items():
+        outcome = f"wrote {name} v{report['version']}" if report["version"] else f"kept {name} v{report['base_version']}"
+        print(f"--- {name}: {outcome} ---\nbefore: {report['before']}\nafter:  {report['after']}")
+    print(json.dumps(reports, indent=2))
+    print(f"Updated in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
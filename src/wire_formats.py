@@ -0,0 +1,185 @@
+"""Request and response encodings for bulk scoring.
+
+``/predict_batch`` picks the body format from Content-Type and the response
+format from Accept:
+
+- ``application/json``: an array of house objects, or an object holding one
+  equal-length array per field (columnar JSON)
+- ``application/x-ndjson``: one house object per line, scored and streamed
+  back one line per house as the body arrives
+- ``application/x-npy``: a NumPy structured array as written by ``np.save``
+- ``application/vnd.apache.arrow.stream``: an Arrow IPC stream (needs pyarrow)
+
+Columnar bodies decode straight into one array per field and are checked
+column by column against the pydantic model's fields, so no per-house Python
+objects are built.
+"""
+import io, json, typing
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+NPY = "application/x-npy"
+ARROW = "application/vnd.apache.arrow.stream"
+RESPONSE_TYPES = (JSON, NDJSON, NPY, ARROW)
+
+class WireFormatError(ValueError):
+    """A body that cannot be decoded, or whose columns do not fit the model's fields."""
+
+def media_type(header):
+    """The bare media type of a Content-Type header, JSON when it is missing."""
+    return (header or JSON).split(";")[0].strip().lower()
+
+def negotiate(accept):
+    """The first response type in an Accept header that can be produced, else JSON."""
+    for part in (accept or "").split(","):
+        kind = media_type(part)
+        if kind in RESPONSE_TYPES and (kind != ARROW or pa is not None):
+            return kind
+    return JSON
+
+def field_specs(model):
+    """{field: (type, required)} of a pydantic model, with Optional[...] unwrapped."""
+    specs = {}
+    for name, field in model.model_fields.items():
+        kind = field.annotation
+        args = [arg for arg in typing.get_args(kind) if arg is not type(None)]
+        specs[name] = (args[0] if args else kind, field.is_required())
+    return specs
+
+def decode_columns(body, content_type):
+    """{field: array} from a columnar JSON, NDJSON, NumPy or Arrow body.
+
+    A JSON ``body`` may also be given already parsed, so it is not decoded twice.
+    """
+    try:
+        if content_type == JSON:
+            columns = json.loads(body) if isinstance(body, (bytes, str)) else body
+            if not isinstance(columns, dict):
+                raise WireFormatError("Columnar JSON must be an object of arrays")
+            return {name: np.asarray(values) for name, values in columns.items()}
+        if content_type == NDJSON:
+            frame = pd.read_json(io.BytesIO(body), lines=True, dtype=False)
+            return {name: frame[name].to_numpy() for name in frame.columns}
+        if content_type == NPY:
+            records = np.load(io.BytesIO(body), allow_pickle=False)
+            if records.dtype.names is None:
+                raise WireFormatError("NumPy body must be a structured array with one field per feature")
+            return {name: records[name] for name in records.dtype.names}
+        if content_type == ARROW:
+            if pa is None:
+                raise WireFormatError("Arrow bodies need pyarrow, which is not installed")
+            table = pa.ipc.open_stream(body).read_all()
+            return {name: table.column(name).to_numpy(zero_copy_only=False) for name in table.column_names}
+    except WireFormatError:
+        raise
+    except Exception as e:
+        raise WireFormatError(f"Could not decode {content_type} body: {e}")
+    raise WireFormatError(f"Unsupported content type {content_type}")
+
+def _numeric(name, values, kind):
+    if values.dtype.kind not in "biuf":
+        try:
+            values = values.astype(np.float64)
+        except (TypeError, ValueError):
+            raise WireFormatError(f"Field {name!r} must be numeric")
+    values = values.astype(np.float64, copy=False)
+    if not np.isfinite(values).all():
+        raise WireFormatError(f"Field {name!r} has missing or non-finite values")
+    if kind is int and (values != np.floor(values)).any():
+        raise WireFormatError(f"Field {name!r} must hold integers")
+    return values
+
+def _text(name, values):
+    if values.dtype.kind in "iu":
+        return values.astype(str)
+    if values.dtype.kind == "f":
+        return _numeric(name, values, int).astype(np.int64).astype(str)
+    if values.dtype.kind == "S":
+        return values.astype(str)
+    if values.dtype.kind == "O" and any(value is None or value != value for value in values):
+        raise WireFormatError(f"Field {name!r} has missing values")
+    return values.astype(str)
+
+def validate_columns(columns, specs, defaults=None):
+    """Check decoded ``columns`` against ``specs`` and return (columns, number of rows).
+
+    Numeric fields come back as float64 arrays and text fields as str arrays.
+    Optional fields that are absent, or missing in some rows, take their value
+    from ``defaults``.
+    """
+    defaults = defaults or {}
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise WireFormatError("All fields must have the same number of values")
+    n = lengths.pop() if lengths else 0
+    validated = {}
+    for name, (kind, required) in specs.items():
+        values = columns.get(name)
+        if values is None:
+            if required:
+                raise WireFormatError(f"Missing field {name!r}")
+            if name in defaults:
+                validated[name] = np.full(n, defaults[name], dtype=np.float64)
+            continue
+        values = np.asarray(values)
+        if not required and name in defaults and values.dtype.kind in "fO":
+            values = pd.Series(values).fillna(defaults[name]).to_numpy()
+        validated[name] = _text(name, values) if kind is str else _numeric(name, values, kind)
+    return validated, n
+
+async def ndjson_blocks(chunks, rows):
+    """Regroup a byte stream of NDJSON into blocks of up to ``rows`` complete, non-empty lines."""
+    pending = b""
+    lines = []
+    async for chunk in chunks:
+        pending += chunk
+        *complete, pending = pending.split(b"\n")
+        lines.extend(line for line in complete if line.strip())
+        while len(lines) >= rows:
+            yield b"\n".join(lines[:rows])
+            lines = lines[rows:]
+    if pending.strip():
+        lines.append(pending)
+    if lines:
+        yield b"\n".join(lines)
+
+def ndjson_lines(predictions, errors, start=0):
+    """One ``{"prediction": ...}`` line per row; failed rows get a null prediction and their error."""
+    details = {error["index"]: error["detail"] for error in errors}
+    out = []
+    for i, prediction in enumerate(predictions.tolist()):
+        if i in details:
+            out.append(json.dumps({"index": start + i, "prediction": None, "error": details[i]}))
+        else:
+            out.append(f'{{"index": {start + i}, "prediction": {prediction!r}}}')
+    return ("\n".join(out) + "\n").encode() if out else b""
+
+def encode_predictions(predictions, errors, accept, meta):
+    """(body, media type, headers) of a batch result in a non-JSON ``accept`` type.
+
+    Failed rows are NaN in NumPy bodies and null in Arrow and NDJSON ones.
+    ``meta`` (model name and version) goes in the headers.
+    """
+    headers = {f"X-{key.title().replace('_', '-')}": str(value) for key, value in meta.items()}
+    headers["X-Prediction-Errors"] = str(len(errors))
+    if accept == NPY:
+        out = io.BytesIO()
+        np.save(out, np.asarray(predictions, dtype=np.float64))
+        return out.getvalue(), NPY, headers
+    if accept == ARROW:
+        table = pa.table({"prediction": pa.array(predictions, mask=np.isnan(predictions))},
+                         metadata={key: str(value) for key, value in meta.items()})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), ARROW, headers
+    return ndjson_lines(predictions, errors), NDJSON, headers